@@ -1,10 +1,14 @@
-from flask import Flask, jsonify, render_template
+from flask import Flask, jsonify, render_template, request
 from flask_cors import CORS
 from flask_caching import Cache
+from werkzeug.middleware.proxy_fix import ProxyFix
 from backend.config import Config
 from backend.routes import register_blueprints  # 假设 routes/__init__.py 已定义
 from datetime import datetime
 from backend.models import db
+from backend.utils.file_upload import is_content_addressed_url
+from backend.utils.order_items import backfill_order_items
+from backend.utils.cart_store import merge_duplicate_cart_rows, add_cart_price_column
 
 
 cache = Cache()
@@ -13,6 +17,8 @@ cache = Cache()
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    if app.config.get('PROXY_FIX_X_FOR'):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
 
     # 初始化扩展
     db.init_app(app)
@@ -30,6 +36,26 @@ def create_app(config_class=Config):
         except Exception as e:
             print(f"数据库表创建失败: {e}")
 
+    @app.cli.command('backfill-order-items')
+    def backfill_order_items_command():
+        """将旧订单的JSON商品信息回填到 order_items 表（flask backfill-order-items）"""
+        written = backfill_order_items()
+        print(f"已回填 {written} 条订单明细")
+
+    @app.cli.command('merge-cart-duplicates')
+    def merge_cart_duplicates_command():
+        """合并重复的购物车行并添加唯一索引（flask merge-cart-duplicates）"""
+        deleted = merge_duplicate_cart_rows()
+        print(f"已合并重复购物车行，删除 {deleted} 行")
+
+    @app.cli.command('upgrade-cart-schema')
+    def upgrade_cart_schema_command():
+        """为已有的 carts 表添加加入购物车时的单价列（flask upgrade-cart-schema）"""
+        if add_cart_price_column():
+            print("已添加 carts.price 列")
+        else:
+            print("carts.price 列已存在")
+
     # 定义端点中文描述
     endpoint_descriptions = {
         # 认证相关 (/api/auth)
@@ -52,11 +78,13 @@ def create_app(config_class=Config):
         '/api/admin/users/<int:user_id>/orders': '获取用户订单列表',
         '/api/admin/users/<int:user_id>/reset_password': '重置用户密码',
         '/api/admin/users/<int:user_id>/<method:PUT>': '修改用户信息',
+        '/api/admin/recommendations/stats': '获取推荐缓存统计（需要管理员权限）',
 
         # 用户相关 (/api/users)
         '/api/users/profile': '获取个人资料（需要登录）',
         '/api/users/profile/<method:PUT>': '更新个人资料（需要登录）',
         '/api/users/password': '修改密码（需要登录）',
+        '/api/users/preferences': '获取分类偏好（需要登录）',
 
         # 商品相关 (/api/products)
         '/api/products': '获取商品列表（支持分页、排序和搜索）',
@@ -67,11 +95,15 @@ def create_app(config_class=Config):
         '/api/products/<int:product_id>/<method:DELETE>': '删除商品（软删除，需要登录）',
         '/api/products/<int:product_id>/status': '更新商品状态（需要管理员权限）',
         '/api/products/recommended': '获取推荐商品（需要登录）',
+        '/api/products/recent': '获取最近浏览的商品（需要登录）',
         '/api/products/hot': '获取热门商品',
+        '/api/products/suggest': '商品名称与标签自动补全',
+        '/api/products/<int:product_id>/similar': '获取相似商品',
 
         # 购物车相关 (/api/carts)
         '/api/carts/cart': '获取购物车商品列表（需要登录）',
         '/api/carts/cart/<method:POST>': '添加商品到购物车（需要登录）',
+        '/api/carts/summary': '获取购物车汇总（分组小计、不可购买与价格变动的商品，需要登录）',
         '/api/carts/<int:cart_id>': '更新购物车商品数量（需要登录）',
         '/api/carts/<int:cart_id>/<method:DELETE>': '从购物车中删除商品（软删除，需要登录）',
         '/api/carts/batch': '批量删除购物车商品（需要登录）',
@@ -84,6 +116,7 @@ def create_app(config_class=Config):
         '/api/orders/<int:order_id>/<method:DELETE>': '删除订单（软删除，需要登录）',
         '/api/orders/admin/orders': '管理员获取所有订单列表（需要管理员权限）',
         '/api/orders/admin/orders/<int:order_id>/ship': '管理员发货（需要管理员权限）',
+        '/api/orders/admin/orders/batch-transition': '管理员批量变更订单状态，逐个返回结果（需要管理员权限）',
 
         # 地址相关 (/api/addresses)
         '/api/addresses/': '获取用户的所有地址（需要令牌）',
@@ -97,6 +130,7 @@ def create_app(config_class=Config):
         # 标签相关 (/api/tags)
         '/api/tags': '获取标签列表（支持分页和搜索）',
         '/api/tags/<int:tag_id>': '获取标签详情',
+        '/api/tags/trending': '获取热度上升最快的分类（支持窗口参数）',
         '/api/tags/<method:POST>': '创建标签（需要管理员权限）',
         '/api/tags/<int:tag_id>/<method:PUT>': '更新标签（需要管理员权限）',
         '/api/tags/<int:tag_id>/<method:DELETE>': '删除标签（软删除，需要管理员权限）',
@@ -152,6 +186,15 @@ def create_app(config_class=Config):
         return render_template('index.html', current_date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                                endpoints=endpoints)
 
+    # 内容寻址的上传文件内容不可变，允许客户端和代理长期缓存
+    @app.after_request
+    def add_upload_cache_headers(response):
+        if response.status_code in (200, 304) and is_content_addressed_url(request.path):
+            response.cache_control.public = True
+            response.cache_control.max_age = 365 * 24 * 3600
+            response.cache_control.immutable = True
+        return response
+
     # 处理 favicon.ico 请求，避免 404
     @app.route('/favicon.ico')
     def favicon():
@@ -0,0 +1 @@
+# 性能基准脚本包，使用 python -m backend.benchmarks.<模块名> 运行
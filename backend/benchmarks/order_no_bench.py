@@ -0,0 +1,105 @@
+"""订单号生成基准：单进程生成速度（单线程与多线程），以及多进程并发生成时的唯一性与有序性
+
+多进程检查中每个进程使用独立节点ID：指定 --redis-url 时从 Redis 租用（验证租约分配），否则按进程序号配置。
+出现重复订单号或单进程内非递增时以非零状态退出。
+
+运行：python -m backend.benchmarks.order_no_bench [--ids 2000000] [--processes 4] [--per-process 200000]
+                                                  [--redis-url redis://localhost:6379/15]
+"""
+import argparse
+import multiprocessing
+import sys
+import threading
+import time
+
+from backend.app import create_app
+from backend.config import Config
+from backend.utils.order_no import SnowflakeGenerator, format_order_no, new_order_no
+
+
+def make_config(node_id, redis_url):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+        CACHE_TYPE = 'SimpleCache'
+        REDIS_URL = redis_url or 'redis://localhost:6379/0'
+        ORDER_NODE_ID = None if redis_url else node_id
+        DEBUG = False
+        TESTING = True
+    return BenchConfig
+
+
+def generate(args):
+    """子进程：在应用上下文中通过 new_order_no 生成订单号"""
+    index, count, redis_url = args
+    app = create_app(make_config(index, redis_url))
+    with app.app_context():
+        return [new_order_no() for _ in range(count)]
+
+
+def bench_single(count):
+    generator = SnowflakeGenerator(1)
+    start = time.perf_counter()
+    for _ in range(count):
+        generator.next_id()
+    elapsed = time.perf_counter() - start
+    print(f'next_id            {count / elapsed / 1e6:6.2f}M ids/s')
+
+    start = time.perf_counter()
+    for _ in range(count):
+        format_order_no(generator.next_id())
+    elapsed = time.perf_counter() - start
+    print(f'next_id + format   {count / elapsed / 1e6:6.2f}M ids/s')
+
+
+def bench_threads(count, threads):
+    generator = SnowflakeGenerator(2)
+    results = [[] for _ in range(threads)]
+
+    def worker(out):
+        for _ in range(count // threads):
+            out.append(generator.next_id())
+
+    workers = [threading.Thread(target=worker, args=(out,)) for out in results]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    ids = [i for out in results for i in out]
+    print(f'{threads} threads          {len(ids) / elapsed / 1e6:6.2f}M ids/s, duplicates={len(ids) - len(set(ids))}')
+    return len(ids) == len(set(ids))
+
+
+def check_processes(processes, per_process, redis_url):
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        batches = pool.map(generate, [(i, per_process, redis_url) for i in range(processes)])
+    elapsed = time.perf_counter() - start
+    numbers = [n for batch in batches for n in batch]
+    duplicates = len(numbers) - len(set(numbers))
+    unordered = sum(any(a >= b for a, b in zip(batch, batch[1:])) for batch in batches)
+    lengths = {len(n) for n in numbers}
+    print(f'{processes} processes        {len(numbers)} order numbers in {elapsed:.2f}s (incl. startup), '
+          f'duplicates={duplicates}, unordered_processes={unordered}, lengths={sorted(lengths)}')
+    return duplicates == 0 and unordered == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--ids', type=int, default=2000000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--per-process', type=int, default=200000)
+    parser.add_argument('--redis-url', default=None)
+    args = parser.parse_args()
+
+    bench_single(args.ids)
+    ok = bench_threads(args.ids, args.threads)
+    ok = check_processes(args.processes, args.per_process, args.redis_url) and ok
+    if not ok:
+        sys.exit('订单号出现重复或乱序')
+
+
+if __name__ == '__main__':
+    main()
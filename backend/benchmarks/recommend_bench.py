@@ -0,0 +1,63 @@
+"""商品共同购买近邻基准：合成购买矩阵上的相似度计算耗时与请求内合并耗时
+
+运行：python -m backend.benchmarks.recommend_bench [--users 50000] [--items 100000] [--orders 300000]
+"""
+import argparse
+import time
+
+import numpy as np
+from scipy import sparse
+
+from backend.utils.recommender import compute_item_neighbors
+from backend.utils.similarity import pack_neighbors, unpack_neighbors
+
+
+def make_purchases(rng, users, items, orders):
+    # 商品热度服从长尾分布，用户购买量不均
+    item_weights = 1 / np.arange(1, items + 1) ** 0.8
+    item_weights /= item_weights.sum()
+    rows = rng.integers(0, users, orders)
+    cols = rng.choice(items, size=orders, p=item_weights)
+    matrix = sparse.csr_matrix((np.ones(orders, dtype=np.float32), (rows, cols)), shape=(users, items))
+    matrix.data[:] = 1
+    return matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--orders', type=int, default=300000)
+    parser.add_argument('--k', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    matrix = make_purchases(rng, args.users, args.items, args.orders)
+    print(f'matrix {matrix.shape}, nnz={matrix.nnz}')
+
+    start = time.perf_counter()
+    neighbors = compute_item_neighbors(matrix, args.k)
+    print(f'item neighbors top-{args.k}: {time.perf_counter() - start:.2f}s, nnz={neighbors.nnz}')
+
+    packed = {}
+    for row in range(neighbors.shape[0]):
+        begin, end = neighbors.indptr[row], neighbors.indptr[row + 1]
+        if begin != end:
+            packed[row] = pack_neighbors(neighbors.indices[begin:end], neighbors.data[begin:end])
+    print(f'stored size {sum(len(v) for v in packed.values()) / 1024 / 1024:.1f}MB for {len(packed)} items')
+
+    # 模拟请求内合并：每个用户取20个已购商品的近邻列表
+    seeds = [rng.choice(list(packed), 20) for _ in range(1000)]
+    start = time.perf_counter()
+    for seed_ids in seeds:
+        scores = {}
+        for seed in seed_ids:
+            ids, values = unpack_neighbors(packed[seed])
+            for product_id, score in zip(ids.tolist(), values.tolist()):
+                scores[product_id] = scores.get(product_id, 0) + score
+        sorted(scores.items(), key=lambda x: x[1], reverse=True)[:20]
+    print(f'merge 20 neighbor lists: {(time.perf_counter() - start) * 1000 / len(seeds):.2f}ms per request')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""推荐效果与延迟评测：在 SQLite 中生成合成用户、商品与订单，留出每个用户最近一笔订单作为测试集，
+回放所有推荐策略，输出 precision/recall@K、覆盖率、单次调用延迟分位数与SQL查询次数
+
+不依赖 MySQL；Redis 默认使用 fakeredis（需安装），也可通过 --redis-url 指定真实实例。
+配合 --save-baseline / --baseline 在 CI 中比较：效果下降、查询次数增加或延迟超出容忍倍数时以非零状态退出。
+
+运行：python -m backend.benchmarks.recommend_eval [--users 2000] [--products 5000] [--k 10]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from backend.app import create_app
+from backend.config import Config
+from backend.models import db, User, Product, Tag, Order, OrderItem, Address
+from backend.utils.recommender import (get_hot_products, get_recommended_products, get_user_purchase_history,
+                                       invalidate_user_recommendations, rebuild_recommend_index, user_cf_scores)
+from backend.utils.similarity import get_similar_product_ids, rebuild_similar_index
+
+TAG_WORDS = ['数码', '书籍', '生活', '运动', '服饰', '乐器', '家具', '电器', '美妆', '文具', '玩具', '食品',
+             '户外', '宠物', '母婴', '汽车', '游戏', '影音', '收藏', '园艺']
+NAME_WORDS = ['二手', '全新', '九成新', '经典', '限量', '便携', '大号', '迷你', '专业', '入门', '高级', '学生']
+
+
+def make_config(database_path, redis_url):
+    class EvalConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{database_path}'
+        CACHE_TYPE = 'SimpleCache'
+        REDIS_URL = redis_url or 'redis://localhost:6379/0'
+        DEBUG = False
+        TESTING = True
+    return EvalConfig
+
+
+def attach_redis(app, redis_url):
+    if redis_url:
+        return
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit('未安装 fakeredis，请安装或通过 --redis-url 指定 Redis 实例')
+    app.extensions['redis_client'] = fakeredis.FakeRedis()
+
+
+def insert_rows(model, rows, chunk=5000):
+    for start in range(0, len(rows), chunk):
+        db.session.execute(model.__table__.insert(), rows[start:start + chunk])
+    db.session.commit()
+
+
+def generate(rng, n_users, n_products, n_tags, orders_per_user, interests):
+    """生成合成数据：每个用户偏好少数几个分类，按分类内长尾热度购买；返回每个用户留出的最近一笔订单"""
+    now = datetime.utcnow()
+    tags = TAG_WORDS[:n_tags] + [f'分类{i}' for i in range(len(TAG_WORDS), n_tags)]
+    insert_rows(Tag, [{'id': i + 1, 'name': name, 'is_deleted': False} for i, name in enumerate(tags)])
+    insert_rows(User, [{'id': i + 1, 'nickname': f'user{i + 1}', 'phone': f'1{i + 1:010d}', 'password_hash': 'x'}
+                       for i in range(n_users)])
+    insert_rows(Address, [{'id': 1, 'user_id': 1, 'province': '省', 'city': '市', 'district': '区', 'detail': '地址'}])
+
+    products, by_tag = [], {tag_id: [] for tag_id in range(1, n_tags + 1)}
+    for product_id in range(1, n_products + 1):
+        tag_id = rng.randint(1, n_tags)
+        by_tag[tag_id].append(product_id)
+        products.append({
+            'id': product_id, 'name': f'{rng.choice(NAME_WORDS)}{tags[tag_id - 1]}{product_id}',
+            'description': f'{tags[tag_id - 1]} {rng.choice(NAME_WORDS)}', 'price': rng.randint(1, 500),
+            'quantity': 100, 'views': int(rng.paretovariate(1.2) * 10), 'status': '已通过', 'is_deleted': False,
+            'seller_id': rng.randint(1, n_users), 'tag_id': tag_id, 'created_at': now, 'updated_at': now
+        })
+    insert_rows(Product, products)
+
+    # 分类内商品热度服从 Zipf 分布
+    weights = {tag_id: [1 / (rank + 1) for rank in range(len(ids))] for tag_id, ids in by_tag.items()}
+    sellers = {product['id']: product['seller_id'] for product in products}
+    orders, items, held_out = [], [], {}
+    order_id = 0
+    for user_id in range(1, n_users + 1):
+        preferred = rng.sample(range(1, n_tags + 1), interests)
+        n_orders = max(1, int(rng.expovariate(1 / orders_per_user)))
+        for index in range(n_orders):
+            tag_id = rng.choice(preferred) if rng.random() < 0.85 else rng.randint(1, n_tags)
+            if not by_tag[tag_id]:
+                continue
+            basket = set(rng.choices(by_tag[tag_id], weights[tag_id], k=rng.randint(1, 3)))
+            if index == n_orders - 1 and n_orders > 1:
+                held_out[user_id] = basket  # 最近一笔订单不写入数据库，作为测试集
+                continue
+            order_id += 1
+            created = now - timedelta(days=n_orders - index)
+            orders.append({
+                'id': order_id, 'order_no': f'E{order_id:010d}', 'total_amount': 1, 'status': '已完成',
+                'products_info': '[]', 'is_deleted': False, 'create_time': created, 'update_time': created,
+                'user_id': user_id, 'address_id': 1
+            })
+            items.extend({'order_id': order_id, 'product_id': pid, 'seller_id': sellers[pid], 'quantity': 1,
+                          'unit_price': 1, 'created_at': created} for pid in basket)
+    insert_rows(Order, orders)
+    insert_rows(OrderItem, items)
+    return held_out, len(orders)
+
+
+def strategy_hot(user_id, k):
+    return [product.id for product in get_hot_products(k)]
+
+
+def strategy_item_cf(user_id, k):
+    invalidate_user_recommendations(user_id)  # 清除用户缓存，测量完整计算路径
+    return [product.id for product in get_recommended_products(user_id, k)]
+
+
+def strategy_item_cf_cached(user_id, k):
+    return [product.id for product in get_recommended_products(user_id, k)]
+
+
+def strategy_user_cf(user_id, k):
+    purchased = set(get_user_purchase_history(user_id))
+    scores = user_cf_scores(user_id)
+    ranked = [pid for pid, _ in sorted(scores.items(), key=lambda x: x[1], reverse=True) if pid not in purchased]
+    return ranked[:k] or strategy_hot(user_id, k)
+
+
+def strategy_content(user_id, k):
+    history = get_user_purchase_history(user_id)
+    if not history:
+        return strategy_hot(user_id, k)
+    purchased = set(history)
+    return [pid for pid in get_similar_product_ids(history[0], k + len(purchased)) if pid not in purchased][:k]
+
+
+# 按顺序执行：item_cf_cached 依赖 item_cf 写入的用户缓存
+STRATEGIES = [
+    ('hot', strategy_hot),
+    ('item_cf', strategy_item_cf),
+    ('item_cf_cached', strategy_item_cf_cached),
+    ('user_cf', strategy_user_cf),
+    ('content_similar', strategy_content),
+]
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+
+def evaluate(strategy, users, held_out, k, n_products, query_counter):
+    precision = recall = hit_users = 0
+    recommended, timings, queries = set(), [], []
+    for user_id in users:
+        query_counter['count'] = 0
+        start = time.perf_counter()
+        result = strategy(user_id, k)[:k]
+        timings.append((time.perf_counter() - start) * 1000)
+        queries.append(query_counter['count'])
+
+        hits = len(set(result) & held_out[user_id])
+        precision += hits / k
+        recall += hits / len(held_out[user_id])
+        hit_users += hits > 0
+        recommended.update(result)
+
+    timings.sort()
+    return {
+        f'precision@{k}': round(precision / len(users), 4),
+        f'recall@{k}': round(recall / len(users), 4),
+        'hit_rate': round(hit_users / len(users), 4),
+        'coverage': round(len(recommended) / n_products, 4),
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'avg_queries': round(sum(queries) / len(queries), 2),
+        'max_queries': max(queries)
+    }
+
+
+def compare(results, baseline, quality_tolerance, latency_tolerance):
+    """与基线比较，返回回归描述列表"""
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, value in metrics.items():
+            if metric not in base:
+                continue
+            if metric.startswith(('precision', 'recall', 'hit_rate', 'coverage')):
+                if value < base[metric] * (1 - quality_tolerance):
+                    regressions.append(f'{name}.{metric}: {base[metric]} -> {value}')
+            elif metric.endswith('queries'):
+                if value > base[metric]:
+                    regressions.append(f'{name}.{metric}: {base[metric]} -> {value}')
+            elif metric.endswith('_ms'):
+                if value > max(base[metric] * latency_tolerance, 1.0):
+                    regressions.append(f'{name}.{metric}: {base[metric]} -> {value}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--tags', type=int, default=20)
+    parser.add_argument('--orders-per-user', type=float, default=5)
+    parser.add_argument('--interests', type=int, default=2, help='每个用户偏好的分类数')
+    parser.add_argument('--eval-users', type=int, default=500, help='参与评测的用户数（从有留出订单的用户中抽样）')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--strategies', default=','.join(name for name, _ in STRATEGIES))
+    parser.add_argument('--database', help='SQLite 文件路径，默认使用临时文件')
+    parser.add_argument('--redis-url', help='Redis 地址，默认使用 fakeredis')
+    parser.add_argument('--json', help='将结果写入 JSON 文件')
+    parser.add_argument('--save-baseline', help='将结果保存为基线')
+    parser.add_argument('--baseline', help='与基线比较，出现回归时以状态码 1 退出')
+    parser.add_argument('--quality-tolerance', type=float, default=0.05, help='效果指标允许的相对下降')
+    parser.add_argument('--latency-tolerance', type=float, default=2.0, help='延迟允许的倍数')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='recommend_eval_')
+    database = args.database or os.path.join(workdir, 'eval.db')
+    if os.path.exists(database):
+        os.remove(database)
+    app = create_app(make_config(database, args.redis_url))
+    attach_redis(app, args.redis_url)
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        start = time.perf_counter()
+        held_out, n_orders = generate(rng, args.users, args.products, args.tags, args.orders_per_user, args.interests)
+        print(f'generated {args.users} users, {args.products} products, {n_orders} orders '
+              f'in {time.perf_counter() - start:.1f}s')
+
+        start = time.perf_counter()
+        rebuild_recommend_index()
+        rebuild_similar_index()
+        print(f'offline jobs: {time.perf_counter() - start:.1f}s')
+
+        users = sorted(held_out)
+        users = rng.sample(users, min(args.eval_users, len(users)))
+        query_counter = {'count': 0}
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count_query(*_):
+            query_counter['count'] += 1
+
+        selected = set(args.strategies.split(','))
+        results = {}
+        for name, strategy in STRATEGIES:
+            if name in selected:
+                results[name] = evaluate(strategy, users, held_out, args.k, args.products, query_counter)
+                db.session.remove()
+
+    columns = list(next(iter(results.values())).keys())
+    print(f'\n{len(users)} users evaluated, K={args.k}')
+    print(f'{"strategy":<16}' + ''.join(f'{column:>14}' for column in columns))
+    for name, metrics in results.items():
+        print(f'{name:<16}' + ''.join(f'{metrics[column]:>14}' for column in columns))
+
+    for path in filter(None, [args.json, args.save_baseline]):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.quality_tolerance, args.latency_tolerance)
+        if regressions:
+            print('\nregressions:\n  ' + '\n  '.join(regressions))
+            sys.exit(1)
+        print('\nno regressions against baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""相似商品索引构建基准：合成商品上的 TF-IDF 构建与批量 Top-K 计算耗时
+
+运行：python -m backend.benchmarks.similarity_bench [--products 100000] [--k 20]
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from backend.utils.similarity import TfidfIndex, document_tokens, pack_neighbors
+
+CJK_WORDS = ['苹果', '手机', '二手', '教材', '自行车', '耳机', '台灯', '考研', '键盘', '显示器', '书包', '运动鞋',
+             '充电器', '高数', '英语', '篮球', '吉他', '相机', '电脑', '衣柜', '椅子', '风扇', '电饭煲', '床垫']
+LATIN_WORDS = ['iphone', 'ipad', 'macbook', 'kindle', 'switch', 'airpods', 'nike', 'lenovo', 'xiaomi', 'canon',
+               'usb', 'type-c', 'pro', 'max', 'mini', 'plus']
+TAGS = ['数码', '书籍', '生活', '运动', '服饰', '乐器', '家具', '电器']
+
+
+def make_document(rng):
+    name = ''.join(rng.sample(CJK_WORDS, 2)) + ' ' + ' '.join(rng.sample(LATIN_WORDS, 2))
+    description = '，'.join(rng.choice(CJK_WORDS) for _ in range(rng.randint(3, 15)))
+    return document_tokens(name, description, rng.choice(TAGS))
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    print(f'{label:<24} {time.perf_counter() - start:8.2f}s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--block-size', type=int, default=256)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    documents = timed('tokenize', lambda: [make_document(rng) for _ in range(args.products)])
+    index = timed('build tf-idf', lambda: TfidfIndex.build(np.arange(1, args.products + 1), documents))
+    print(f'matrix {index.matrix.shape}, nnz={index.matrix.nnz}')
+    neighbors, scores = timed(f'top-{args.k} (block {args.block_size})',
+                              lambda: index.top_k(args.k, args.block_size))
+    packed = timed('pack', lambda: [pack_neighbors(index.product_ids[neighbors[i]], scores[i])
+                                    for i in range(args.products)])
+    print(f'stored size {sum(len(p) for p in packed) / 1024 / 1024:.1f}MB ({len(packed[0])} bytes/product)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""自动补全前缀树基准：构建耗时与查询延迟分位数
+
+运行：python -m backend.benchmarks.suggest_bench [--items 100000] [--queries 20000]
+"""
+import argparse
+import random
+import time
+
+from backend.utils.suggest import SuggestTrie
+
+CJK_WORDS = ['苹果', '手机', '二手', '教材', '自行车', '耳机', '台灯', '考研', '键盘', '显示器', '书包', '运动鞋']
+LATIN_WORDS = ['iphone', 'ipad', 'macbook', 'kindle', 'switch', 'airpods', 'nike', 'lenovo', 'xiaomi', 'canon']
+
+
+def make_name(rng):
+    parts = rng.sample(CJK_WORDS, 2) + [rng.choice(LATIN_WORDS), str(rng.randint(1, 999))]
+    rng.shuffle(parts)
+    return ' '.join(parts) if rng.random() < 0.5 else ''.join(parts)
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    names = [make_name(rng) for _ in range(args.items)]
+
+    trie = SuggestTrie()
+    start = time.perf_counter()
+    trie.bulk_load((('product', i), name, rng.randint(0, 10000)) for i, name in enumerate(names))
+    print(f'build {args.items} items: {time.perf_counter() - start:.2f}s')
+
+    prefixes = []
+    for _ in range(args.queries):
+        name = rng.choice(names)
+        prefixes.append(name[:rng.randint(1, min(6, len(name)))])
+
+    timings = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        trie.search(prefix, 10)
+        timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+    print(f'search p50 {percentile(timings, 50):.1f}us  p99 {percentile(timings, 99):.1f}us  '
+          f'max {timings[-1]:.1f}us')
+
+    start = time.perf_counter()
+    for i in range(1000):
+        trie.upsert(('product', i), make_name(rng), rng.randint(0, 10000))
+    print(f'incremental upsert avg {(time.perf_counter() - start) * 1000:.1f}us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""上传写入基准：对比旧版两次读取写入、单线程流式写入与线程池并发写入
+
+运行：python -m backend.benchmarks.upload_bench [--files 10] [--size-mb 5] [--workers 4]
+"""
+import argparse
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+
+from werkzeug.datastructures import FileStorage
+
+from backend.utils.file_upload import DEFAULT_ALLOWED_FILE_TYPES, write_uploads
+
+PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+
+
+def make_uploads(payloads):
+    return [FileStorage(io.BytesIO(payload), filename=f'image_{i}.png', content_type='image/png')
+            for i, payload in enumerate(payloads)]
+
+
+def legacy_save(files, target_folder, max_size):
+    """旧版实现：先完整读取一遍计算大小，回退后再保存"""
+    for i, file in enumerate(files):
+        size = 0
+        while True:
+            chunk = file.stream.read(8192)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise ValueError('文件过大')
+        file.stream.seek(0)
+        file.save(os.path.join(target_folder, f'{i}.png'))
+
+
+def legacy_save_hashed(files, target_folder, max_size):
+    """旧版实现加上内容哈希（内容寻址所需），共读取两遍"""
+    for i, file in enumerate(files):
+        hasher = hashlib.sha256()
+        while True:
+            chunk = file.stream.read(8192)
+            if not chunk:
+                break
+            hasher.update(chunk)
+        file.stream.seek(0)
+        file.save(os.path.join(target_folder, f'{hasher.hexdigest()}.png'))
+
+
+def run(name, func, payloads, repeat):
+    timings = []
+    for _ in range(repeat):
+        files = make_uploads(payloads)
+        folder = tempfile.mkdtemp(prefix='upload_bench_')
+        try:
+            start = time.perf_counter()
+            func(files, folder)
+            timings.append(time.perf_counter() - start)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+    best = min(timings)
+    total_mb = sum(len(p) for p in payloads) / 1024 / 1024
+    print(f'{name:<28} best {best * 1000:8.1f} ms  {total_mb / best:8.1f} MB/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=10)
+    parser.add_argument('--size-mb', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 1024 * 1024)
+    max_size = size + 1
+    payloads = [PNG_HEADER + os.urandom(size - len(PNG_HEADER)) for _ in range(args.files)]
+    print(f'{args.files} x {args.size_mb}MB uploads, {args.workers} workers')
+
+    run('legacy two-pass', lambda files, folder: legacy_save(files, folder, max_size), payloads, args.repeat)
+    run('legacy two-pass + sha256', lambda files, folder: legacy_save_hashed(files, folder, max_size),
+        payloads, args.repeat)
+    run('single-pass sequential', lambda files, folder: write_uploads(
+        files, folder, max_size=max_size, allowed_types=DEFAULT_ALLOWED_FILE_TYPES, max_workers=1),
+        payloads, args.repeat)
+    run('single-pass thread pool', lambda files, folder: write_uploads(
+        files, folder, max_size=max_size, allowed_types=DEFAULT_ALLOWED_FILE_TYPES, max_workers=args.workers),
+        payloads, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""用户 MinHash/LSH 相似用户查询基准：签名计算与索引构建耗时、查询延迟，以及与精确 Jaccard Top-K 的召回率
+
+运行：python -m backend.benchmarks.user_similarity_bench [--users 100000] [--items 50000] [--k 30]
+"""
+import argparse
+import time
+
+import numpy as np
+from scipy import sparse
+
+from backend.utils.user_similarity import LSHIndex, MinHasher
+
+
+def make_purchases(rng, users, items, groups):
+    # 用户属于若干兴趣组，组内商品共享，使相似用户确实存在
+    group_items = [rng.choice(items, 40, replace=False) for _ in range(groups)]
+    rows, cols = [], []
+    for user in range(users):
+        group = group_items[rng.integers(groups)]
+        basket = np.concatenate([rng.choice(group, rng.integers(2, 8), replace=False),
+                                 rng.integers(0, items, rng.integers(0, 3))])
+        rows.extend([user] * len(basket))
+        cols.extend(basket.tolist())
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(users, items))
+    matrix.data[:] = 1
+    return matrix
+
+
+def percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--groups', type=int, default=2000)
+    parser.add_argument('--k', type=int, default=30)
+    parser.add_argument('--queries', type=int, default=300)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    matrix = make_purchases(rng, args.users, args.items, args.groups)
+    item_ids = np.arange(args.items)
+    print(f'matrix {matrix.shape}, nnz={matrix.nnz}')
+
+    hasher = MinHasher()
+    start = time.perf_counter()
+    signatures = hasher.signatures(matrix, item_ids)
+    print(f'signatures: {time.perf_counter() - start:.2f}s ({signatures.nbytes / 1024 / 1024:.1f}MB)')
+    start = time.perf_counter()
+    index = LSHIndex(np.arange(args.users), signatures)
+    print(f'lsh index: {time.perf_counter() - start:.2f}s')
+
+    sizes = np.asarray(matrix.sum(axis=1)).ravel()
+    timings, recalls = [], []
+    for user in rng.choice(args.users, args.queries, replace=False).tolist():
+        start = time.perf_counter()
+        result = index.most_similar(signatures[user], args.k, exclude=user)
+        timings.append((time.perf_counter() - start) * 1000)
+
+        # 精确 Jaccard：|A∩B| / (|A| + |B| - |A∩B|)，只统计相似度不低于 0.2 的真实近邻
+        overlap = np.asarray((matrix @ matrix[user].T).todense()).ravel()
+        jaccard = overlap / (sizes + sizes[user] - overlap)
+        jaccard[user] = 0
+        exact = [u for u in np.argsort(-jaccard)[:args.k].tolist() if jaccard[u] >= 0.2]
+        if exact:
+            found = {u for u, _ in result}
+            recalls.append(len(found & set(exact)) / len(exact))
+
+    timings.sort()
+    print(f'query p50 {percentile(timings, 50):.2f}ms  p99 {percentile(timings, 99):.2f}ms')
+    print(f'recall of exact top-{args.k} (jaccard >= 0.2): {np.mean(recalls):.3f} over {len(recalls)} queries')
+
+
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,17 @@ class Config:
     # Redis缓存配置
     REDIS_URL = 'redis://localhost:6379/0'
 
+    # 反向代理配置：应用前可信代理的层数（0 表示直接对外）。大于0时由 ProxyFix 按层数从 X-Forwarded-For
+    # 取客户端地址，客户端自行添加的条目会被忽略
+    PROXY_FIX_X_FOR = 0
+
+    # 后台任务配置（'redis' 或 'memory'，memory 仅用于测试和单进程开发）
+    JOBS_BACKEND = 'redis'
+
+    # 订单配置
+    ORDER_PAYMENT_TIMEOUT = 1800  # 待付款订单的库存预占时间（秒），超时自动取消
+    ORDER_NODE_ID = None  # 订单号生成器节点ID（0-1023），多进程部署时每个进程需不同；未配置时从 Redis 租用
+
     # JWT配置
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt-secret-key-change-in-production'
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
@@ -0,0 +1,44 @@
+"""管理命令
+
+用法:
+    python -m backend.manage worker [--queues default] [--concurrency 2] [--no-scheduler]
+    python -m backend.manage run <任务名称>
+    python -m backend.manage stats
+"""
+import argparse
+import json
+from backend.app import create_app
+from backend.utils.jobs import Worker, enqueue, job_stats, registered_jobs
+import backend.tasks  # noqa: F401  注册任务
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m backend.manage')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    worker_parser = commands.add_parser('worker', help='启动任务工作进程')
+    worker_parser.add_argument('--queues', default='default', help='逗号分隔的队列名称')
+    worker_parser.add_argument('--concurrency', type=int, default=2, help='执行线程数')
+    worker_parser.add_argument('--no-scheduler', action='store_true', help='不参与周期任务调度')
+
+    run_parser = commands.add_parser('run', help='将任务加入队列')
+    run_parser.add_argument('name', choices=sorted(registered_jobs()))
+
+    commands.add_parser('stats', help='查看任务执行统计')
+
+    args = parser.parse_args(argv)
+    app = create_app()
+
+    if args.command == 'worker':
+        Worker(app, queues=args.queues.split(','), concurrency=args.concurrency,
+               scheduler=not args.no_scheduler).run()
+    elif args.command == 'run':
+        with app.app_context():
+            print(f"已入队 {args.name}: {enqueue(args.name)}")
+    elif args.command == 'stats':
+        with app.app_context():
+            print(json.dumps(job_stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
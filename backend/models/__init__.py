@@ -7,9 +7,12 @@ from .user import User
 from .admin import Admin
 from .product import Product
 from .cart import Cart
+from .order_item import OrderItem
 from .order import Order
 from .address import Address
 from .tag import Tag
 from .comment import Comment
 from .balance import Balance
-from .message import Message
\ No newline at end of file
+from .message import Message
+from .stored_file import StoredFile
+from .idempotency_key import IdempotencyKey
\ No newline at end of file
@@ -43,8 +43,8 @@ class Balance(db.Model):
         db.session.commit()
         return transaction
 
-    def pay(self, amount, order_no, description='支付订单'):
-        """支付"""
+    def pay(self, amount, order_no, description='支付订单', commit=True):
+        """支付（commit=False 时由调用方与订单状态变更在同一事务中提交）"""
         if amount <= 0:
             raise ValueError('支付金额必须大于0')
         if amount > self.amount:
@@ -54,7 +54,8 @@ class Balance(db.Model):
                                   description=f'{description}: {order_no}')
         db.session.add(self)
         db.session.add(transaction)
-        db.session.commit()
+        if commit:
+            db.session.commit()
         return transaction
 
     def refund(self, amount, order_no, description='订单退款'):
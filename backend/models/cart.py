@@ -4,9 +4,14 @@ from . import db
 
 class Cart(db.Model):
     __tablename__ = 'carts'
+    # 每个用户每个商品只有一行，移出购物车为软删除，再次加入时复用该行
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'product_id', name='uq_carts_user_product'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, comment='购物车ID')
     quantity = db.Column(db.Integer, default=1, nullable=False, comment='商品数量')
+    price = db.Column(db.Float, nullable=True, comment='加入购物车时的商品单价')
     added_at = db.Column(db.DateTime, default=datetime.utcnow, comment='添加时间')
     is_deleted = db.Column(db.Boolean, default=False, comment='是否软删除')
     created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='创建时间')
@@ -25,6 +30,7 @@ class Cart(db.Model):
         data = {
             'id': self.id,
             'quantity': self.quantity,
+            'price': self.price,
             'added_at': self.added_at.isoformat(),
             'user_id': self.user_id,
             'product_id': self.product_id,
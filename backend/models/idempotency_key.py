@@ -0,0 +1,23 @@
+from datetime import datetime
+from . import db
+
+
+class IdempotencyKey(db.Model):
+    """幂等请求的响应记录（Redis 中记录的持久化兜底，过期后由后台任务清理）"""
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'endpoint', 'key', name='uq_idempotency_keys_user_endpoint_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, comment='记录ID')
+    user_id = db.Column(db.Integer, nullable=False, comment='用户ID')
+    endpoint = db.Column(db.String(100), nullable=False, comment='接口端点')
+    key = db.Column(db.String(64), nullable=False, comment='客户端提供的 Idempotency-Key')
+    request_hash = db.Column(db.String(64), nullable=False, comment='请求方法、路径与请求体的SHA-256摘要')
+    status_code = db.Column(db.Integer, nullable=True, comment='响应状态码，为空表示请求处理中')
+    response_body = db.Column(db.Text, nullable=True, comment='响应体')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='创建时间')
+    expires_at = db.Column(db.DateTime, nullable=False, index=True, comment='过期时间')
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.endpoint} {self.key}>'
@@ -1,17 +1,38 @@
 import json
+import logging
 from datetime import datetime
 from sqlalchemy import Enum
 from . import db
+from .order_item import OrderItem
+from .product import Product
+
+logger = logging.getLogger(__name__)
 
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    # 超时兜底扫描按状态与下单时间查询待付款订单
+    __table_args__ = (db.Index('ix_orders_status_create_time', 'status', 'create_time'),)
+
+    # 接口中的英文状态代码与数据库中状态值的对应关系
+    STATUS_CODES = {'pending_payment': '待付款', 'paid': '已付款', 'shipped': '已发货', 'completed': '已完成',
+                    'cancelled': '已取消'}
+    # 订单状态机：当前状态 -> 允许转换到的状态（用户与管理员的状态变更共用）
+    TRANSITIONS = {
+        '待付款': ('已付款', '已取消'),
+        '已付款': ('已发货',),
+        '已发货': ('已完成',),
+        '已完成': (),
+        '已取消': ()
+    }
+    # 转换到该状态时记录的时间字段
+    STATUS_TIME_FIELDS = {'已付款': 'payment_time', '已发货': 'shipping_time', '已完成': 'complete_time'}
 
     id = db.Column(db.Integer, primary_key=True, comment='订单ID')
     order_no = db.Column(db.String(30), unique=True, index=True, comment='订单流水号(唯一)')
     total_amount = db.Column(db.Float, nullable=False, comment='订单总金额')
     status = db.Column(Enum('待付款', '已付款', '已发货', '已完成', '已取消'), default='待付款', comment='订单状态')
-    products_info = db.Column(db.Text, nullable=False, comment='商品信息(JSON格式，包含商品ID、数量、单价)')
+    products_info = db.Column(db.Text, nullable=False, comment='商品信息(JSON格式，已由order_items取代，保留用于回填与回滚)')
     payment_method = db.Column(db.String(20), nullable=True, comment='支付方式(微信/支付宝/余额)')
     is_deleted = db.Column(db.Boolean, default=False, comment='是否软删除')
     create_time = db.Column(db.DateTime, default=datetime.utcnow, comment='下单时间')
@@ -26,10 +47,25 @@ class Order(db.Model):
 
     # 关系
     comments = db.relationship('Comment', backref='order', lazy='dynamic')
+    items = db.relationship('OrderItem', backref='order', lazy='select', cascade='all, delete-orphan',
+                            order_by='OrderItem.id')
+
+    @classmethod
+    def status_value(cls, status):
+        """将接口传入的状态（英文代码或中文状态值）转换为数据库中的状态值"""
+        return cls.STATUS_CODES.get(status, status)
+
+    @classmethod
+    def sources_of(cls, status):
+        """可以转换到指定状态的当前状态"""
+        return [source for source, targets in cls.TRANSITIONS.items() if status in targets]
 
     @property
     def products(self):
-        """将JSON字符串转换为Python列表"""
+        """订单商品列表，优先读取 order_items，尚未回填的旧订单退回解析JSON"""
+        if self.items:
+            return [{'product_id': item.product_id, 'quantity': item.quantity, 'price': item.unit_price}
+                    for item in self.items]
         if not self.products_info:
             return []
         try:
@@ -39,13 +75,47 @@ class Order(db.Model):
 
     @products.setter
     def products(self, products):
-        """将Python列表转换为JSON字符串并校验"""
+        """校验商品信息并生成订单明细（与订单在同一事务中写入），同时保留JSON副本"""
         if not isinstance(products, list):
             raise ValueError('商品信息必须是列表')
         for item in products:
             if not all(k in item for k in ['product_id', 'quantity', 'price']):
                 raise ValueError('商品信息必须包含product_id, quantity, price')
-        self.products_info = json.dumps(products)
+        self.products_info = json.dumps([{k: item[k] for k in ('product_id', 'quantity', 'price')}
+                                         for item in products])
+        self.items = self.build_items(products)
+
+    @staticmethod
+    def build_items(products, sellers=None):
+        """由商品信息生成订单明细，同一商品合并数量；未提供 seller_id 时批量查询商品补全
+
+        Args:
+            products: 包含 product_id、quantity、price（可选 seller_id）的字典列表
+            sellers: 可选的商品ID到卖家ID映射，批量处理多个订单时由调用方一次查询得到
+
+        Returns:
+            list: OrderItem 列表（未提供卖家且商品不存在的条目被跳过）
+        """
+        merged = {}
+        for item in products:
+            product_id = int(item['product_id'])
+            if product_id in merged:
+                merged[product_id]['quantity'] += int(item['quantity'])
+            else:
+                merged[product_id] = dict(item, product_id=product_id, quantity=int(item['quantity']))
+
+        missing = [pid for pid, item in merged.items() if not item.get('seller_id')]
+        if missing and sellers is None:
+            sellers = dict(db.session.query(Product.id, Product.seller_id).filter(Product.id.in_(missing)).all())
+        for pid in missing:
+            merged[pid]['seller_id'] = sellers.get(pid)
+        skipped = [pid for pid, item in merged.items() if not item.get('seller_id')]
+        if skipped:
+            logger.warning(f"Skipped order items for missing products {skipped}")
+
+        return [OrderItem(product_id=pid, seller_id=item['seller_id'], quantity=item['quantity'],
+                          unit_price=float(item['price']))
+                for pid, item in merged.items() if item.get('seller_id')]
 
     def pay(self, method='余额'):
         """支付订单"""
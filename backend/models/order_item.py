@@ -0,0 +1,31 @@
+from datetime import datetime
+from . import db
+
+
+class OrderItem(db.Model):
+    __tablename__ = 'order_items'
+
+    id = db.Column(db.Integer, primary_key=True, comment='订单明细ID')
+    quantity = db.Column(db.Integer, nullable=False, comment='购买数量')
+    unit_price = db.Column(db.Float, nullable=False, comment='下单时单价')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='创建时间')
+
+    # 外键
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False, index=True, comment='订单ID')
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True, comment='商品ID')
+    seller_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True, comment='卖家ID')
+
+    __table_args__ = (
+        db.UniqueConstraint('order_id', 'product_id', name='uq_order_items_order_product'),
+    )
+
+    def to_dict(self):
+        return {
+            'product_id': self.product_id,
+            'quantity': self.quantity,
+            'price': self.unit_price,
+            'seller_id': self.seller_id
+        }
+
+    def __repr__(self):
+        return f'<OrderItem order={self.order_id} product={self.product_id} x{self.quantity}>'
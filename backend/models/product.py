@@ -79,7 +79,7 @@ class Product(db.Model):
         db.session.add(self)
         db.session.commit()
 
-    def to_dict(self, with_seller=False):
+    def to_dict(self, with_seller=False, with_views=True):
         data = {
             'id': self.id,
             'quick_id': self.quick_id,
@@ -93,8 +93,12 @@ class Product(db.Model):
             'status': self.status,
             'created_at': self.created_at.isoformat(),
             'published_at': self.published_at.isoformat() if self.published_at else None,
-            'tag_id': self.tag_id
+            'tag_id': self.tag_id,
+            'seller_id': self.seller_id
         }
+        if not with_views:
+            # 浏览量每次访问都变化，不能放在按缓存代数生成强ETag的列表中
+            del data['views']
 
         if with_seller and self.seller:
             data['seller'] = {
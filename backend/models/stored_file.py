@@ -0,0 +1,34 @@
+from datetime import datetime
+from . import db
+
+
+class StoredFile(db.Model):
+    __tablename__ = 'stored_files'
+
+    id = db.Column(db.Integer, primary_key=True, comment='文件ID')
+    sha256 = db.Column(db.String(64), unique=True, nullable=False, index=True, comment='文件内容SHA-256摘要(唯一)')
+    path = db.Column(db.String(255), nullable=False, comment='相对上传目录的存储路径')
+    size = db.Column(db.Integer, nullable=False, comment='文件大小(字节)')
+    mime_type = db.Column(db.String(100), nullable=True, comment='MIME类型')
+    ref_count = db.Column(db.Integer, default=0, nullable=False, comment='引用计数')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='创建时间')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment='更新时间')
+
+    @property
+    def url(self):
+        """文件访问URL"""
+        return f'/static/uploads/{self.path}'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'sha256': self.sha256,
+            'url': self.url,
+            'size': self.size,
+            'mime_type': self.mime_type,
+            'ref_count': self.ref_count,
+            'created_at': self.created_at.isoformat()
+        }
+
+    def __repr__(self):
+        return f'<StoredFile {self.sha256[:12]} x{self.ref_count}>'
@@ -1,11 +1,11 @@
 from .auth import auth_bp
 from .admin import admin_bp
 from .user import user_bp
-from .product import product_bp
+from .product import product_bp, cache as product_cache
 from .cart import cart_bp
 from .order import order_bp
 from .address import address_bp
-from .tag import tag_bp
+from .tag import tag_bp, cache as tag_cache
 from .comment import comment_bp
 from .balance import balance_bp
 from .message import message_bp
@@ -22,4 +22,8 @@ def register_blueprints(app):
     app.register_blueprint(tag_bp, url_prefix='/api/tags')
     app.register_blueprint(comment_bp, url_prefix='/api/comments')
     app.register_blueprint(balance_bp, url_prefix='/api/balances')
-    app.register_blueprint(message_bp, url_prefix='/api/messages')
\ No newline at end of file
+    app.register_blueprint(message_bp, url_prefix='/api/messages')
+
+    # 初始化蓝图内使用的视图缓存
+    product_cache.init_app(app)
+    tag_cache.init_app(app)
\ No newline at end of file
@@ -1,8 +1,10 @@
 from flask import Blueprint, request, jsonify
 from ..models import db, Address
 from ..utils.decorators import login_required
+from ..utils.http_cache import make_etag, conditional
 from datetime import datetime
 import json
+import os
 import logging
 
 address_bp = Blueprint('address', __name__)
@@ -190,7 +192,18 @@ def set_default_address(current_user, address_id):
         logger.error(f"User {current_user.id} failed to set default address {address_id}: {str(e)}")
         return json_response(False, f'设置默认地址失败: {str(e)}', status=500)
 
+REGIONS_FILE = 'static/data/regions.json'
+
+def regions_validator():
+    """省市区数据的版本信息：数据文件的修改时间和大小"""
+    try:
+        stat = os.stat(REGIONS_FILE)
+    except OSError:
+        return None, None
+    return make_etag('regions', stat.st_mtime_ns, stat.st_size), datetime.utcfromtimestamp(stat.st_mtime)
+
 @address_bp.route('/regions', methods=['GET'])
+@conditional(regions_validator)
 def get_regions():
     """获取省市区数据（无需认证）
 
@@ -198,7 +211,7 @@ def get_regions():
         JSON: 省市区数据
     """
     try:
-        with open('static/data/regions.json', 'r', encoding='utf-8') as f:
+        with open(REGIONS_FILE, 'r', encoding='utf-8') as f:
             regions = json.load(f)
         logger.info("Fetched regions data")
         return json_response(True, '获取省市区数据成功', regions)
@@ -1,7 +1,13 @@
 from flask import Blueprint, request, jsonify
 from ..models import db, User, Product, Order
 from ..utils.decorators import admin_required, super_admin_required
+from ..utils.http_cache import bump_generation
+from ..utils.product_cache import invalidate_product_cards
+from ..utils.suggest import sync_product_ids
+from ..utils.similarity import schedule_product_index
+from ..utils.recommender import cache_stats
 from sqlalchemy import desc
+from sqlalchemy.orm import selectinload
 import logging
 
 admin_bp = Blueprint('admin', __name__)
@@ -164,6 +170,12 @@ def batch_update_product_status(current_admin):
     )
     try:
         db.session.commit()
+        bump_generation('products')
+        invalidate_product_cards(data['product_ids'])
+        sync_product_ids(data['product_ids'])
+        if data['status'] == '已通过':
+            for product_id in data['product_ids']:
+                schedule_product_index(product_id)
         logger.info(f"Admin {current_admin.id} updated product statuses: {data['product_ids']} to {data['status']}")
         return json_response(True, f'商品状态已更新为{data["status"]}')
     except Exception as e:
@@ -189,9 +201,9 @@ def get_user_orders(current_admin, user_id):
     per_page = max(1, min(100, request.args.get('per_page', 10, type=int)))
     status = request.args.get('status')
 
-    query = Order.query.filter_by(user_id=user_id, is_deleted=False)
+    query = Order.query.options(selectinload(Order.items)).filter_by(user_id=user_id, is_deleted=False)
     if status:
-        query = query.filter_by(status=status)
+        query = query.filter_by(status=Order.status_value(status))
 
     pagination = query.order_by(desc(Order.create_time)).paginate(page=page, per_page=per_page)
     logger.info(f"Admin {current_admin.id} fetched orders for user {user_id} (page={page}, status={status})")
@@ -269,4 +281,20 @@ def update_user(current_admin, user_id):
     except Exception as e:
         db.session.rollback()
         logger.error(f"Admin {current_admin.id} failed to update user {user_id}: {str(e)}")
-        return json_response(False, f'更新失败: {str(e)}', status=500)
\ No newline at end of file
+        return json_response(False, f'更新失败: {str(e)}', status=500)
+
+@admin_bp.route('/admin/recommendations/stats', methods=['GET'])
+@admin_required
+def get_recommendation_cache_stats(current_admin):
+    """获取推荐缓存统计（命中率与陈旧度）
+
+    Returns:
+        JSON: 缓存统计
+    """
+    try:
+        stats = cache_stats.summary()
+        logger.info(f"Admin {current_admin.id} fetched recommendation cache stats")
+        return json_response(True, '获取推荐缓存统计成功', stats)
+    except Exception as e:
+        logger.error(f"Admin {current_admin.id} failed to fetch recommendation cache stats: {str(e)}")
+        return json_response(False, f'获取失败: {str(e)}', status=500)
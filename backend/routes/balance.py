@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
-from ..models import db, Balance
+from ..models import db, Balance, Order
 from ..utils.decorators import token_required
+from ..utils.idempotency import idempotent
+from ..utils.order_state import transition_orders, OK
 from datetime import datetime
 import logging
 
@@ -70,9 +72,12 @@ def recharge_balance(current_user):
 
 @balance_bp.route('/pay', methods=['POST'])
 @token_required
+@idempotent
 def pay_from_balance(current_user):
     """从余额中支付（用于订单支付）
 
+    扣款与订单 待付款→已付款 的条件更新在同一事务中提交：订单已被取消（如支付超时）或已支付时不扣款。
+
     Args:
         amount (float): 支付金额
         order_id (int): 订单ID
@@ -92,14 +97,29 @@ def pay_from_balance(current_user):
     except ValueError as e:
         return json_response(False, str(e), status=400)
 
+    order = Order.query.filter_by(id=data['order_id'], user_id=current_user.id, is_deleted=False).first()
+    if not order:
+        return json_response(False, '订单不存在', status=404)
+    if order.status != '待付款':
+        return json_response(False, '订单不是待付款状态', status=400)
+    if abs(order.total_amount - amount) > 0.005:
+        return json_response(False, '支付金额与订单金额不一致', status=400)
+
     balance = Balance.query.filter_by(user_id=current_user.id).first()
     if not balance or balance.amount < amount:
         return json_response(False, '余额不足', status=400)
 
+    def debit(order_ids):
+        Order.query.filter(Order.id.in_(order_ids)).update({Order.payment_method: '余额'},
+                                                           synchronize_session=False)
+        balance.pay(amount, order.id, description=f'用户 {current_user.nickname} 支付订单', commit=False)
+
     try:
-        balance.pay(amount, data['order_id'], description=f'用户 {current_user.nickname} 支付订单')
-        db.session.commit()
-        logger.info(f"User {current_user.id} paid {amount} for order {data['order_id']}")
+        result = transition_orders([order.id], '已付款', user_id=current_user.id, sources=['待付款'],
+                                   on_change=debit)[order.id]
+        if result != OK:
+            return json_response(False, '订单不是待付款状态', status=400)
+        logger.info(f"User {current_user.id} paid {amount} for order {order.id}")
         return json_response(True, '支付成功', balance.to_dict(with_transactions=True))
     except ValueError as e:
         db.session.rollback()
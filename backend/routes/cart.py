@@ -1,8 +1,12 @@
 from flask import Blueprint, request, jsonify
-from ..models import db, Cart, Product
+from ..models import Product
 from ..utils.decorators import token_required
 from ..utils.cart_helper import batch_add_to_cart, batch_update_cart
-from sqlalchemy import and_
+from ..utils.cart_store import load_cart, remove_cart_lines, find_cart_lines, cart_line_dict, cart_items
+from ..utils.product_cache import get_product_cards
+from ..utils.cart_summary import get_cart_summary
+from ..utils.trending import record_tag_events
+import redis
 import logging
 
 cart_bp = Blueprint('cart', __name__)
@@ -20,9 +24,22 @@ def get_cart_items(current_user):
     Returns:
         JSON: 购物车列表
     """
-    cart_items = Cart.query.filter_by(user_id=current_user.id, is_deleted=False).all()
+    lines = load_cart(current_user.id)
+    cards = get_product_cards(lines)
     logger.info(f"User {current_user.id} fetched cart items")
-    return json_response(True, '获取购物车成功', [item.to_dict(with_product=True) for item in cart_items])
+    return json_response(True, '获取购物车成功', cart_items(current_user.id, lines, cards))
+
+@cart_bp.route('/summary', methods=['GET'])
+@token_required
+def get_cart_summary_route(current_user):
+    """获取购物车汇总：按卖家分组的小计、总金额、不可购买的商品与价格变动的商品
+
+    Returns:
+        JSON: 购物车汇总
+    """
+    summary = get_cart_summary(current_user.id)
+    logger.info(f"User {current_user.id} fetched cart summary")
+    return json_response(True, '获取购物车汇总成功', summary)
 
 @cart_bp.route('/cart', methods=['POST'])
 @token_required
@@ -48,15 +65,14 @@ def add_to_cart(current_user):
     if product.is_deleted or product.status != '已通过':
         return json_response(False, '商品不可购买', status=400)
 
-    success, message, _ = batch_add_to_cart(current_user.id, [{'product_id': data['product_id'], 'quantity': quantity}])
+    success, message, lines = batch_add_to_cart(current_user.id, [{'product_id': product.id, 'quantity': quantity}])
     if not success:
         return json_response(False, message, status=400)
 
-    cart_item = Cart.query.filter(
-        and_(Cart.user_id == current_user.id, Cart.product_id == data['product_id'], Cart.is_deleted == False)
-    ).first()
-    logger.info(f"User {current_user.id} added product {data['product_id']} to cart")
-    return json_response(True, '添加购物车成功', cart_item.to_dict(with_product=True))
+    record_tag_events('cart', [product.tag_id])
+    logger.info(f"User {current_user.id} added product {product.id} to cart")
+    return json_response(True, '添加购物车成功', cart_line_dict(current_user.id, product.id, lines[product.id],
+                                                          product.to_dict()))
 
 @cart_bp.route('/cart/<int:cart_id>', methods=['PUT'])
 @token_required
@@ -70,7 +86,6 @@ def update_cart_item(current_user, cart_id):
     Returns:
         JSON: 更新结果
     """
-    cart_item = Cart.query.filter_by(id=cart_id, user_id=current_user.id, is_deleted=False).first_or_404()
     data = request.get_json()
     if not data or 'quantity' not in data:
         return json_response(False, '缺少quantity字段', status=400)
@@ -79,12 +94,17 @@ def update_cart_item(current_user, cart_id):
     if not isinstance(quantity, int) or quantity <= 0:
         return json_response(False, 'quantity 必须为正整数', status=400)
 
-    success, message, _ = batch_update_cart(current_user.id, [{'cart_id': cart_id, 'quantity': quantity}])
+    if not find_cart_lines(load_cart(current_user.id), [cart_id]):
+        return json_response(False, '购物车项不存在', status=404)
+
+    success, message, lines = batch_update_cart(current_user.id, [{'cart_id': cart_id, 'quantity': quantity}])
     if not success:
         return json_response(False, message, status=400)
 
+    (product_id, line), = lines.items()
     logger.info(f"User {current_user.id} updated cart item {cart_id}")
-    return json_response(True, '更新购物车成功', cart_item.to_dict(with_product=True))
+    return json_response(True, '更新购物车成功', cart_line_dict(current_user.id, product_id, line,
+                                                          get_product_cards([product_id]).get(product_id)))
 
 @cart_bp.route('/cart/<int:cart_id>', methods=['DELETE'])
 @token_required
@@ -97,14 +117,15 @@ def remove_from_cart(current_user, cart_id):
     Returns:
         JSON: 删除结果
     """
-    cart_item = Cart.query.filter_by(id=cart_id, user_id=current_user.id, is_deleted=False).first_or_404()
-    cart_item.is_deleted = True
+    lines = find_cart_lines(load_cart(current_user.id), [cart_id])
+    if not lines:
+        return json_response(False, '购物车项不存在', status=404)
+
     try:
-        db.session.commit()
+        remove_cart_lines(current_user.id, lines)
         logger.info(f"User {current_user.id} removed cart item {cart_id}")
         return json_response(True, '商品已从购物车中移除')
-    except Exception as e:
-        db.session.rollback()
+    except redis.RedisError as e:
         logger.error(f"User {current_user.id} failed to remove cart item {cart_id}: {str(e)}")
         return json_response(False, f'删除失败: {str(e)}', status=500)
 
@@ -123,14 +144,10 @@ def batch_remove_from_cart(current_user):
     if not data or 'cart_ids' not in data or not isinstance(data['cart_ids'], list):
         return json_response(False, '缺少cart_ids字段或格式错误', status=400)
 
-    Cart.query.filter(
-        and_(Cart.id.in_(data['cart_ids']), Cart.user_id == current_user.id, Cart.is_deleted == False)
-    ).update({Cart.is_deleted: True}, synchronize_session=False)
     try:
-        db.session.commit()
+        remove_cart_lines(current_user.id, find_cart_lines(load_cart(current_user.id), data['cart_ids']))
         logger.info(f"User {current_user.id} batch removed cart items: {data['cart_ids']}")
         return json_response(True, '商品已从购物车中移除')
-    except Exception as e:
-        db.session.rollback()
+    except redis.RedisError as e:
         logger.error(f"User {current_user.id} failed to batch remove cart items: {str(e)}")
         return json_response(False, f'批量删除失败: {str(e)}', status=500)
\ No newline at end of file
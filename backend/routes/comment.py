@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify, current_app
-from ..models import db, Comment, User, Product, Order, Admin
+from ..models import db, Comment, User, Product, Order, OrderItem, Admin
 from ..utils.decorators import token_required, admin_required
+from ..utils.http_cache import conditional, generation_validator, get_generation, bump_generation
 from datetime import datetime
 import redis
 import logging
@@ -15,6 +16,7 @@ def get_redis_client():
     return redis.Redis.from_url(current_app.config.get('REDIS_URL', 'redis://localhost:6379/0'))
 
 @comment_bp.route('/product/<int:product_id>', methods=['GET'])
+@conditional(generation_validator(lambda product_id: f'comments:{product_id}'), weak=True)
 def get_product_comments(product_id):
     """获取商品的所有评论
 
@@ -38,7 +40,8 @@ def get_product_comments(product_id):
     sort_by = request.args.get('sort_by', 'create_time')
     sort_order = request.args.get('sort_order', 'desc')
 
-    cache_key = f"product:comments:{product_id}:{page}:{per_page}:{sort_by}:{sort_order}"
+    version, _ = get_generation(f'comments:{product_id}')
+    cache_key = f"product:comments:{product_id}:{version}:{page}:{per_page}:{sort_by}:{sort_order}"
     cached_data = redis_client.get(cache_key)
     if cached_data:
         logger.info(f"Fetched cached comments for product {product_id}")
@@ -146,7 +149,7 @@ def create_comment(current_user):
         order = Order.query.filter_by(id=order_id, user_id=current_user.id).first()
         if not order:
             return json_response(False, '订单不存在或不属于当前用户', status=404)
-        if str(data['product_id']) not in order.products:
+        if not db.session.query(OrderItem.id).filter_by(order_id=order.id, product_id=data['product_id']).first():
             return json_response(False, '该订单不包含此商品', status=400)
 
     new_comment = Comment(
@@ -163,6 +166,7 @@ def create_comment(current_user):
     try:
         db.session.add(new_comment)
         db.session.commit()
+        bump_generation(f"comments:{data['product_id']}")
         cache_pattern = f"product:comments:{data['product_id']}:*"
         for key in redis_client.scan_iter(cache_pattern):
             redis_client.delete(key)
@@ -199,6 +203,7 @@ def like_comment(current_user, comment_id):
         redis_client.sadd(like_key, user_id_str)
         comment.likes += 1
         db.session.commit()
+        bump_generation(f'comments:{comment.product_id}')
         logger.info(f"User {current_user.id} liked comment {comment_id}")
         return json_response(True, '点赞成功', {'comment_id': comment.id, 'likes': comment.likes})
     except Exception as e:
@@ -233,6 +238,7 @@ def unlike_comment(current_user, comment_id):
         if comment.likes > 0:
             comment.likes -= 1
         db.session.commit()
+        bump_generation(f'comments:{comment.product_id}')
         logger.info(f"User {current_user.id} unliked comment {comment_id}")
         return json_response(True, '取消点赞成功', {'comment_id': comment.id, 'likes': comment.likes})
     except Exception as e:
@@ -257,6 +263,7 @@ def update_comment(current_user, comment_id):
         comment.is_deleted = True
         try:
             db.session.commit()
+            bump_generation(f'comments:{comment.product_id}')
             cache_pattern = f"product:comments:{comment.product_id}:*"
             for key in redis_client.scan_iter(cache_pattern):
                 redis_client.delete(key)
@@ -287,6 +294,7 @@ def update_comment(current_user, comment_id):
 
     try:
         db.session.commit()
+        bump_generation(f'comments:{comment.product_id}')
         cache_pattern = f"product:comments:{comment.product_id}:*"
         for key in redis_client.scan_iter(cache_pattern):
             redis_client.delete(key)
@@ -1,14 +1,26 @@
 from flask import Blueprint, request, jsonify, current_app
 from ..models import db, Order, Cart, Product, Address
 from ..utils.decorators import token_required, admin_required
-from sqlalchemy import and_
-from datetime import datetime
+from ..utils.recommender import invalidate_user_recommendations
+from ..utils.preferences import invalidate_user_preferences
+from ..utils.trending import record_tag_events
+from ..utils.order_no import new_order_no
+from ..utils.http_cache import bump_generation
+from ..utils.order_timeout import schedule_payment_timeout
+from ..utils.idempotency import idempotent
+from ..utils.cart_store import flush_cart, remove_cart_lines, discard_cart_cache
+from ..utils.stock import reserve_stock, release_stock, deduct_product_stock, InsufficientStock
+from ..utils.order_state import transition_orders, OK, NOT_FOUND, INVALID_TRANSITION
+from sqlalchemy.orm import selectinload
 import json
+import redis
 import logging
 
 order_bp = Blueprint('order', __name__)
 logger = logging.getLogger(__name__)
 
+MAX_BATCH_ORDERS = 1000
+
 def json_response(success, message, data=None, status=200):
     """统一响应格式"""
     return jsonify({'success': success, 'message': message, 'data': data}), status
@@ -32,16 +44,16 @@ def get_orders(current_user):
     status = request.args.get('status')
     search = request.args.get('search', '').strip()
 
-    query = Order.query.filter_by(user_id=current_user.id, is_deleted=False)
+    query = Order.query.options(selectinload(Order.items)).filter_by(user_id=current_user.id, is_deleted=False)
     if status:
-        query = query.filter_by(status=status)
+        query = query.filter_by(status=Order.status_value(status))
     if search:
-        query = query.filter(Order.order_number.ilike(f'%{search}%'))
+        query = query.filter(Order.order_no.ilike(f'%{search}%'))
 
     pagination = query.order_by(Order.create_time.desc()).paginate(page=page, per_page=per_page)
     logger.info(f"User {current_user.id} fetched orders (page={page})")
     return json_response(True, '获取订单列表成功', {
-        'items': [order.to_dict(include_products=True) for order in pagination.items],
+        'items': [order.to_dict() for order in pagination.items],
         'total': pagination.total,
         'pages': pagination.pages,
         'current_page': page
@@ -63,10 +75,11 @@ def get_order(current_user, order_id):
         return json_response(False, '订单不存在', status=404)
 
     logger.info(f"User {current_user.id} fetched order {order_id}")
-    return json_response(True, '获取订单详情成功', order.to_dict(include_products=True, include_address=True))
+    return json_response(True, '获取订单详情成功', order.to_dict(with_address=True))
 
 @order_bp.route('/orders', methods=['POST'])
 @token_required
+@idempotent
 def create_order(current_user):
     """创建订单
 
@@ -85,10 +98,16 @@ def create_order(current_user):
     if not isinstance(data['cart_ids'], list) or not data['cart_ids']:
         return json_response(False, 'cart_ids 必须为非空列表', status=400)
 
-    cart_items = Cart.query.filter(
-        and_(Cart.id.in_(data['cart_ids']), Cart.user_id == current_user.id, Cart.is_deleted == False)
+    # 购物车数量在 Redis 中延迟写回，下单前先同步到数据库
+    try:
+        flush_cart(current_user.id)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to flush cart for user {current_user.id} before ordering: {str(e)}")
+    # 购物车项与商品一次联表查询
+    rows = db.session.query(Cart, Product).join(Product, Cart.product_id == Product.id).filter(
+        Cart.id.in_(data['cart_ids']), Cart.user_id == current_user.id, Cart.is_deleted == False
     ).all()
-    if not cart_items:
+    if not rows:
         return json_response(False, '购物车商品不存在', status=400)
 
     address = Address.query.filter_by(id=data['address_id'], user_id=current_user.id, is_deleted=False).first()
@@ -97,38 +116,74 @@ def create_order(current_user):
 
     total_amount = 0
     products_data = []
-    for cart_item in cart_items:
-        product = cart_item.product
-        if product.is_deleted or product.status != 'approved':
+    quantities = {}
+    db_stock = {}
+    names = {}
+    for cart_item, product in rows:
+        if product.is_deleted or product.status != '已通过':
             return json_response(False, f'商品 {product.name} 不可购买', status=400)
         if product.quantity < cart_item.quantity:
             return json_response(False, f'商品 {product.name} 库存不足', status=400)
         total_amount += product.price * cart_item.quantity
-        products_data.append({'product_id': product.id, 'quantity': cart_item.quantity, 'price': product.price})
+        products_data.append({'product_id': product.id, 'quantity': cart_item.quantity, 'price': product.price,
+                              'seller_id': product.seller_id})
+        quantities[product.id] = quantities.get(product.id, 0) + cart_item.quantity
+        db_stock[product.id] = product.quantity
+        names[product.id] = product.name
+    cart_ids = [cart_item.id for cart_item, _ in rows]
+    tag_ids = [product.tag_id for _, product in rows]
 
     order = Order(
         user_id=current_user.id,
-        order_number=datetime.now().strftime('%Y%m%d%H%M%S') + str(current_user.id),
+        order_no=new_order_no(),
         total_amount=total_amount,
         address_id=address.id,
-        products=json.dumps(products_data),
-        status='pending_payment'
+        products=products_data,
+        status='待付款'
     )
 
+    # 预占前加入支付超时队列：超时未付款时取消，下单失败而预占未归还时由超时处理归还
+    try:
+        schedule_payment_timeout(order.order_no)
+    except redis.RedisError as e:
+        logger.error(f"Failed to schedule payment timeout for order {order.order_no}: {str(e)}")
+
+    # 先在 Redis 中原子预占库存，库存争用不落到数据库行锁上
+    try:
+        reserve_stock(order.order_no, quantities, db_stock)
+    except InsufficientStock as e:
+        return json_response(False, f'商品 {names[e.product_id]} 库存不足', status=400)
+    except ValueError as e:
+        return json_response(False, f'创建订单失败: {str(e)}', status=409)
+
+    # 数据库条件扣减库存是最终的超卖保护（Redis 不可用或库存被流程外修改时同样生效）
     try:
-        for cart_item in cart_items:
-            product = cart_item.product
-            product.quantity -= cart_item.quantity
-            cart_item.is_deleted = True
+        deduct_product_stock(quantities)
+        Cart.query.filter(Cart.id.in_(cart_ids), Cart.user_id == current_user.id).update(
+            {Cart.is_deleted: True}, synchronize_session=False
+        )
         db.session.add(order)
         db.session.commit()
-        logger.info(f"User {current_user.id} created order {order.id}")
-        return json_response(True, '创建订单成功', order.to_dict(include_products=True), 201)
+    except InsufficientStock as e:
+        db.session.rollback()
+        release_stock(order.order_no)
+        return json_response(False, f'商品 {names[e.product_id]} 库存不足', status=400)
     except Exception as e:
         db.session.rollback()
+        release_stock(order.order_no)
         logger.error(f"User {current_user.id} failed to create order: {str(e)}")
         return json_response(False, f'创建订单失败: {str(e)}', status=500)
 
+    try:
+        remove_cart_lines(current_user.id, list(quantities), persist=False)
+    except redis.RedisError as e:
+        logger.error(f"Failed to remove ordered items from cart cache: {str(e)}")
+        discard_cart_cache(current_user.id)
+    bump_generation('products')
+    record_tag_events('order', tag_ids)
+    logger.info(f"User {current_user.id} created order {order.id}")
+    return json_response(True, '创建订单成功', order.to_dict(), 201)
+
 @order_bp.route('/orders/<int:order_id>/status', methods=['PUT'])
 @token_required
 def update_order_status(current_user, order_id):
@@ -141,40 +196,26 @@ def update_order_status(current_user, order_id):
     Returns:
         JSON: 更新结果
     """
-    order = Order.query.filter_by(id=order_id, user_id=current_user.id, is_deleted=False).first()
-    if not order:
-        return json_response(False, '订单不存在', status=404)
-
     data = request.get_json()
-    if 'status' not in data:
+    if not data or 'status' not in data:
         return json_response(False, '缺少status字段', status=400)
 
-    allowed_status = {
-        'pending_payment': ['paid', 'cancelled'],
-        'paid': ['shipped'],
-        'shipped': ['completed'],
-        'completed': [],
-        'cancelled': []
-    }
-    if data['status'] not in allowed_status.get(order.status, []):
-        return json_response(False, '非法的状态转换', status=400)
-
-    order.status = data['status']
-    if data['status'] == 'paid':
-        order.payment_time = datetime.utcnow()
-    elif data['status'] == 'shipped':
-        order.shipping_time = datetime.utcnow()
-    elif data['status'] == 'completed':
-        order.complete_time = datetime.utcnow()
+    new_status = Order.status_value(data['status'])
+    if new_status not in Order.TRANSITIONS:
+        return json_response(False, '无效的订单状态', status=400)
 
     try:
-        db.session.commit()
-        logger.info(f"User {current_user.id} updated order {order_id} status to {data['status']}")
-        return json_response(True, '订单状态更新成功', {'status': order.status})
+        result = transition_orders([order_id], new_status, user_id=current_user.id, notify=False)[order_id]
     except Exception as e:
-        db.session.rollback()
         logger.error(f"User {current_user.id} failed to update order {order_id} status: {str(e)}")
         return json_response(False, f'更新失败: {str(e)}', status=500)
+    if result == NOT_FOUND:
+        return json_response(False, '订单不存在', status=404)
+    if result == INVALID_TRANSITION:
+        return json_response(False, '非法的状态转换', status=400)
+
+    logger.info(f"User {current_user.id} updated order {order_id} status to {new_status}")
+    return json_response(True, '订单状态更新成功', {'status': new_status})
 
 @order_bp.route('/orders/<int:order_id>', methods=['DELETE'])
 @token_required
@@ -191,12 +232,15 @@ def delete_order(current_user, order_id):
     if not order:
         return json_response(False, '订单不存在', status=404)
 
-    if order.status not in ['completed', 'cancelled']:
+    if order.status not in ['已完成', '已取消']:
         return json_response(False, '只能删除已完成或已取消的订单', status=400)
 
     order.is_deleted = True
     try:
         db.session.commit()
+        if order.status == '已完成':
+            invalidate_user_recommendations(current_user.id)
+            invalidate_user_preferences(current_user.id)
         logger.info(f"User {current_user.id} deleted order {order_id}")
         return json_response(True, '订单已删除')
     except Exception as e:
@@ -223,16 +267,16 @@ def admin_get_orders(current_admin):
     status = request.args.get('status')
     search = request.args.get('search', '').strip()
 
-    query = Order.query.filter_by(is_deleted=False)
+    query = Order.query.options(selectinload(Order.items), selectinload(Order.user)).filter_by(is_deleted=False)
     if status:
-        query = query.filter_by(status=status)
+        query = query.filter_by(status=Order.status_value(status))
     if search:
-        query = query.filter(Order.order_number.ilike(f'%{search}%'))
+        query = query.filter(Order.order_no.ilike(f'%{search}%'))
 
     pagination = query.order_by(Order.create_time.desc()).paginate(page=page, per_page=per_page)
     logger.info(f"Admin {current_admin.id} fetched all orders (page={page})")
     return json_response(True, '获取订单列表成功', {
-        'items': [order.to_dict(include_products=True, include_user=True) for order in pagination.items],
+        'items': [order.to_dict(with_user=True) for order in pagination.items],
         'total': pagination.total,
         'pages': pagination.pages,
         'current_page': page
@@ -249,20 +293,56 @@ def admin_ship_order(current_admin, order_id):
     Returns:
         JSON: 发货结果
     """
-    order = Order.query.filter_by(id=order_id, is_deleted=False).first()
-    if not order:
+    try:
+        result = transition_orders([order_id], '已发货')[order_id]
+    except Exception as e:
+        logger.error(f"Admin {current_admin.id} failed to ship order {order_id}: {str(e)}")
+        return json_response(False, f'发货失败: {str(e)}', status=500)
+    if result == NOT_FOUND:
         return json_response(False, '订单不存在', status=404)
-
-    if order.status != 'paid':
+    if result == INVALID_TRANSITION:
         return json_response(False, '只能发货已付款的订单', status=400)
 
-    order.status = 'shipped'
-    order.shipping_time = datetime.utcnow()
+    logger.info(f"Admin {current_admin.id} shipped order {order_id}")
+    return json_response(True, '订单已发货', {'status': '已发货'})
+
+@order_bp.route('/admin/orders/batch-transition', methods=['POST'])
+@admin_required
+def admin_batch_transition(current_admin):
+    """管理员批量变更订单状态（如批量发货），按订单状态机校验，逐个返回结果
+
+    Args:
+        order_ids (list): 订单ID列表，最多 MAX_BATCH_ORDERS 个
+        status (str): 目标状态
+
+    Returns:
+        JSON: 每个订单的结果（ok、not_found、invalid_transition）与汇总
+    """
+    data = request.get_json()
+    if not data or not all(k in data for k in ['order_ids', 'status']):
+        return json_response(False, '缺少必填字段: order_ids, status', status=400)
+
+    order_ids = data['order_ids']
+    if not isinstance(order_ids, list) or not order_ids or not all(isinstance(i, int) for i in order_ids):
+        return json_response(False, 'order_ids 必须为非空整数列表', status=400)
+    if len(order_ids) > MAX_BATCH_ORDERS:
+        return json_response(False, f'每次最多处理{MAX_BATCH_ORDERS}个订单', status=400)
+
+    status = Order.status_value(data['status'])
+    if status not in Order.TRANSITIONS:
+        return json_response(False, '无效的订单状态', status=400)
+
     try:
-        db.session.commit()
-        logger.info(f"Admin {current_admin.id} shipped order {order_id}")
-        return json_response(True, '订单已发货', {'status': order.status})
+        results = transition_orders(order_ids, status)
     except Exception as e:
-        db.session.rollback()
-        logger.error(f"Admin {current_admin.id} failed to ship order {order_id}: {str(e)}")
-        return json_response(False, f'发货失败: {str(e)}', status=500)
\ No newline at end of file
+        logger.error(f"Admin {current_admin.id} failed to batch transition orders to {status}: {str(e)}")
+        return json_response(False, f'批量更新失败: {str(e)}', status=500)
+
+    succeeded = sum(result == OK for result in results.values())
+    logger.info(f"Admin {current_admin.id} moved {succeeded}/{len(results)} orders to {status}")
+    return json_response(True, '批量更新完成', {
+        'status': status,
+        'results': [{'id': order_id, 'result': result} for order_id, result in results.items()],
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded
+    })
\ No newline at end of file
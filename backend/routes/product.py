@@ -1,10 +1,21 @@
 from flask import Blueprint, request, jsonify, current_app
 from ..models import db, Product, User
-from ..utils.decorators import token_required, admin_required
-from ..utils.file_upload import save_file
+from ..utils.decorators import token_required, admin_required, get_optional_user_id
+from ..utils.file_upload import (write_uploads, register_stored_files, discard_unregistered_blobs,
+                                 get_allowed_file_types, delete_files)
 from ..utils.recommender import get_recommended_products, get_hot_products
+from ..utils.suggest import get_suggestions, sync_products
+from ..utils.similarity import get_similar_product_ids, schedule_product_index
+from ..utils.http_cache import make_etag, conditional, generation_validator, generation_cache_key, bump_generation, latest
+from ..utils.product_cache import get_product_cards, invalidate_product_cards
+from ..utils.recent_views import track_recent_view, get_recent_view_ids
+from ..utils.unique_views import track_unique_viewer, get_unique_viewers
+from ..utils.trending import record_tag_events
+from ..utils.stock import forget_stock
 from sqlalchemy import desc
 from flask_caching import Cache
+from functools import wraps
+from collections import Counter
 import logging
 
 product_bp = Blueprint('product', __name__)
@@ -15,8 +26,48 @@ def json_response(success, message, data=None, status=200):
     """统一响应格式"""
     return jsonify({'success': success, 'message': message, 'data': data}), status
 
+def product_detail_validator(product_id):
+    """商品详情的版本信息：商品与卖家的更新时间（只查询版本列，不做序列化）
+
+    卖家本人查看时响应附带独立访客数，ETag 加入用户ID与访客数，且不提供 Last-Modified（访客数变化不改变更新时间）。
+    """
+    row = db.session.query(Product.updated_at, User.updated_at, Product.seller_id).join(
+        User, Product.seller_id == User.id
+    ).filter(Product.id == product_id, Product.is_deleted == False).first()
+    if not row:
+        return None, None
+    versions = (row[0], row[1])
+    user_id = get_optional_user_id()
+    if user_id is not None and user_id == row.seller_id:
+        viewers = get_unique_viewers(product_id)
+        return make_etag('product', product_id, *versions, user_id, sorted(viewers.items())), None
+    return make_etag('product', product_id, *versions), latest(versions)
+
+def release_product_images(product_id, image_urls):
+    """商品变更提交后释放不再使用的图片引用；失败只记录日志，不影响已提交的变更"""
+    if not image_urls:
+        return
+    try:
+        delete_files(image_urls)
+    except Exception as e:
+        logger.error(f"Failed to release images of product {product_id}: {str(e)}")
+
+VOLATILE_SORT_KEYS = ('views',)  # 浏览量自增不改变 products 缓存代数
+products_generation_validator = generation_validator('products')
+
+def sorts_by_volatile_field():
+    """商品列表是否按不改变缓存代数的字段排序（此时不缓存、不提供ETag，每次重新查询）"""
+    return request.args.get('sort_by') in VOLATILE_SORT_KEYS
+
+def product_list_validator():
+    """商品列表的版本信息：products 缓存代数；按浏览量排序时返回空，跳过条件请求处理"""
+    if sorts_by_volatile_field():
+        return None, None
+    return products_generation_validator()
+
 @product_bp.route('/', methods=['GET'])
-@cache.cached(timeout=300, query_string=True)
+@conditional(product_list_validator)
+@cache.cached(timeout=300, make_cache_key=generation_cache_key('products'), unless=sorts_by_volatile_field)
 def get_products():
     """获取商品列表，支持分页、排序和搜索
 
@@ -51,13 +102,42 @@ def get_products():
     pagination = query.paginate(page=page, per_page=per_page)
     logger.info(f"Fetched products list (page={page}, search={search})")
     return json_response(True, '获取商品列表成功', {
-        'items': [product.to_dict() for product in pagination.items],
+        'items': [product.to_dict(with_views=False) for product in pagination.items],
         'total': pagination.total,
         'pages': pagination.pages,
         'current_page': page
     })
 
+def count_product_view(f):
+    """商品详情接口的装饰器：请求成功（含304）时浏览量加一并记录分类浏览事件
+
+    应放在 conditional 之外，使条件请求命中时同样计数。浏览量自增不改变 updated_at，否则每次访问都会使ETag失效。
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        response = current_app.make_response(f(*args, **kwargs))
+        if response.status_code not in (200, 304):
+            return response
+        product_id = kwargs['product_id']
+        try:
+            Product.query.filter_by(id=product_id).update(
+                {Product.views: Product.views + 1, Product.updated_at: Product.updated_at}, synchronize_session=False
+            )
+            db.session.commit()
+            tag_id = db.session.query(Product.tag_id).filter_by(id=product_id).scalar()
+            record_tag_events('view', [tag_id])
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to increment views for product {product_id}: {str(e)}")
+        return response
+
+    return decorated
+
 @product_bp.route('/<int:product_id>', methods=['GET'])
+@track_recent_view
+@track_unique_viewer
+@count_product_view
+@conditional(product_detail_validator, weak=True, private=True)
 def get_product(product_id):
     """获取商品详情
 
@@ -65,21 +145,17 @@ def get_product(product_id):
         product_id (int): 商品ID
 
     Returns:
-        JSON: 商品信息
+        JSON: 商品信息；卖家本人查看时附带最近7天/30天独立访客数 unique_viewers
     """
     product = Product.query.filter_by(id=product_id, is_deleted=False).first()
     if not product:
         return json_response(False, '商品不存在', status=404)
 
-    product.views += 1
-    try:
-        db.session.commit()
-        logger.info(f"Fetched product {product_id}, views incremented")
-        return json_response(True, '获取商品详情成功', product.to_dict(include_seller=True))
-    except Exception as e:
-        db.session.rollback()
-        logger.error(f"Failed to increment views for product {product_id}: {str(e)}")
-        return json_response(False, f'获取详情失败: {str(e)}', status=500)
+    logger.info(f"Fetched product {product_id}")
+    data = product.to_dict(with_seller=True)
+    if get_optional_user_id() == product.seller_id:
+        data['unique_viewers'] = get_unique_viewers(product_id)
+    return json_response(True, '获取商品详情成功', data)
 
 @product_bp.route('/', methods=['POST'])
 @token_required
@@ -127,6 +203,8 @@ def create_product(current_user):
     try:
         db.session.add(product)
         db.session.commit()
+        bump_generation('products')
+        sync_products([product])
         logger.info(f"User {current_user.id} created product {product.id}")
         return json_response(True, '创建商品成功', product.to_dict(), 201)
     except Exception as e:
@@ -146,6 +224,7 @@ def update_product(current_user, product_id):
         description (str, optional): 新描述
         quantity (int, optional): 新库存
         category_id (int, optional): 新分类ID
+        images (list, optional): 保留的图片URL（现有图片的子集，可调整顺序；新图片通过上传接口添加）
 
     Returns:
         JSON: 更新后的商品信息
@@ -162,6 +241,16 @@ def update_product(current_user, product_id):
     if not data:
         return json_response(False, '请求数据为空', status=400)
 
+    removed_images = []
+    if 'images' in data:
+        images = data['images']
+        current = Counter(product.image_list)
+        if not isinstance(images, list) or not all(isinstance(url, str) for url in images) \
+                or Counter(images) - current:
+            return json_response(False, 'images 必须为现有图片URL的子集', status=400)
+        removed_images = list((current - Counter(images)).elements())
+        product.image_list = images
+
     allowed_fields = ['name', 'price', 'description', 'quantity', 'category_id']
     for field in allowed_fields:
         if field in data:
@@ -188,13 +277,20 @@ def update_product(current_user, product_id):
 
     try:
         db.session.commit()
+        bump_generation('products')
+        invalidate_product_cards([product_id])
+        if 'quantity' in data:
+            forget_stock([product_id])
+        sync_products([product])
         logger.info(f"User {current_user.id} updated product {product_id}")
-        return json_response(True, '更新商品成功', product.to_dict())
     except Exception as e:
         db.session.rollback()
         logger.error(f"User {current_user.id} failed to update product {product_id}: {str(e)}")
         return json_response(False, f'更新失败: {str(e)}', status=500)
 
+    release_product_images(product_id, removed_images)
+    return json_response(True, '更新商品成功', product.to_dict())
+
 @product_bp.route('/<int:product_id>/images', methods=['POST'])
 @token_required
 def upload_product_images(current_user, product_id):
@@ -218,29 +314,31 @@ def upload_product_images(current_user, product_id):
     if 'images' not in request.files:
         return json_response(False, '没有上传文件', status=400)
 
-    images = request.files.getlist('images')
-    image_urls = []
-    for image in images:
-        if image.filename:
-            try:
-                image_url = save_file(image)
-                image_urls.append(image_url)
-            except Exception as e:
-                logger.error(f"Failed to save image for product {product_id}: {str(e)}")
-                return json_response(False, f'上传图片失败: {str(e)}', status=500)
-
-    if image_urls:
-        product.image_urls = image_urls if not product.image_urls else product.image_urls + image_urls
-        try:
-            db.session.commit()
-            logger.info(f"User {current_user.id} uploaded images for product {product_id}")
-            return json_response(True, '上传图片成功', {'image_urls': image_urls})
-        except Exception as e:
-            db.session.rollback()
-            logger.error(f"User {current_user.id} failed to upload images for product {product_id}: {str(e)}")
-            return json_response(False, f'上传失败: {str(e)}', status=500)
+    images = [image for image in request.files.getlist('images') if image.filename]
+    if not images:
+        return json_response(False, '没有有效图片上传', status=400)
 
-    return json_response(False, '没有有效图片上传', status=400)
+    try:
+        blobs = write_uploads(images, current_app.config['UPLOAD_FOLDER'], allowed_types=get_allowed_file_types())
+    except Exception as e:
+        logger.error(f"Failed to save image for product {product_id}: {str(e)}")
+        return json_response(False, f'上传图片失败: {str(e)}', status=500)
+
+    # 登记或提交失败时删除本次新写入的文件，避免磁盘上留下没有记录的文件
+    try:
+        image_urls = [stored.url for stored in register_stored_files(blobs)]
+        product.image_list = product.image_list + image_urls
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        discard_unregistered_blobs(blobs)
+        logger.error(f"User {current_user.id} failed to upload images for product {product_id}: {str(e)}")
+        return json_response(False, f'上传失败: {str(e)}', status=500)
+
+    bump_generation('products')
+    invalidate_product_cards([product_id])
+    logger.info(f"User {current_user.id} uploaded images for product {product_id}")
+    return json_response(True, '上传图片成功', {'image_urls': image_urls})
 
 @product_bp.route('/<int:product_id>', methods=['DELETE'])
 @token_required
@@ -261,16 +359,23 @@ def delete_product(current_user, product_id):
     if product.seller_id != current_user.id and not is_admin:
         return json_response(False, '无权限删除此商品', status=403)
 
+    images = product.image_list
     product.is_deleted = True
+    product.image_list = []
     try:
         db.session.commit()
+        bump_generation('products', f'comments:{product_id}')
+        invalidate_product_cards([product_id])
+        sync_products([product])
         logger.info(f"User {current_user.id} deleted product {product_id}")
-        return json_response(True, '商品已删除')
     except Exception as e:
         db.session.rollback()
         logger.error(f"User {current_user.id} failed to delete product {product_id}: {str(e)}")
         return json_response(False, f'删除失败: {str(e)}', status=500)
 
+    release_product_images(product_id, images)
+    return json_response(True, '商品已删除')
+
 @product_bp.route('/<int:product_id>/status', methods=['PUT'])
 @admin_required
 def update_product_status(current_admin, product_id):
@@ -278,7 +383,7 @@ def update_product_status(current_admin, product_id):
 
     Args:
         product_id (int): 商品ID
-        status (str): 新状态（pending/approved/rejected）
+        status (str): 新状态（待审核/已通过/已下架）
 
     Returns:
         JSON: 更新结果
@@ -291,13 +396,18 @@ def update_product_status(current_admin, product_id):
     if 'status' not in data:
         return json_response(False, '缺少status字段', status=400)
 
-    valid_statuses = ['pending', 'approved', 'rejected']
+    valid_statuses = ['待审核', '已通过', '已下架']
     if data['status'] not in valid_statuses:
         return json_response(False, f'非法的状态值，可用值: {", ".join(valid_statuses)}', status=400)
 
     product.status = data['status']
     try:
         db.session.commit()
+        bump_generation('products')
+        invalidate_product_cards([product_id])
+        sync_products([product])
+        if product.status == '已通过':
+            schedule_product_index(product_id)
         logger.info(f"Admin {current_admin.id} updated product {product_id} status to {data['status']}")
         return json_response(True, '商品状态更新成功', {'status': product.status})
     except Exception as e:
@@ -305,6 +415,63 @@ def update_product_status(current_admin, product_id):
         logger.error(f"Admin {current_admin.id} failed to update product {product_id} status: {str(e)}")
         return json_response(False, f'更新失败: {str(e)}', status=500)
 
+@product_bp.route('/suggest', methods=['GET'])
+def suggest_products():
+    """商品名称与标签的自动补全建议（基于进程内前缀树，不访问数据库）
+
+    Args:
+        q (str): 输入前缀
+        limit (int, optional): 返回数量，默认10，最大10
+
+    Returns:
+        JSON: 建议列表
+    """
+    prefix = request.args.get('q', '').strip()
+    limit = max(1, min(10, request.args.get('limit', 10, type=int)))
+    if not prefix:
+        return json_response(True, '获取建议成功', {'items': []})
+    try:
+        return json_response(True, '获取建议成功', {'items': get_suggestions(prefix, limit)})
+    except Exception as e:
+        logger.error(f"Failed to fetch suggestions for {prefix}: {str(e)}")
+        return json_response(False, f'获取失败: {str(e)}', status=500)
+
+@product_bp.route('/<int:product_id>/similar', methods=['GET'])
+def get_similar_products(product_id):
+    """获取相似商品（基于名称、描述和标签的TF-IDF余弦相似度，离线预计算）
+
+    Args:
+        product_id (int): 商品ID
+        limit (int, optional): 返回数量，默认10，最大20
+
+    Returns:
+        JSON: 相似商品列表
+    """
+    limit = max(1, min(20, request.args.get('limit', 10, type=int)))
+    similar_ids = get_similar_product_ids(product_id, limit)
+    if similar_ids:
+        products = Product.query.filter(
+            Product.id.in_(similar_ids),
+            Product.status == '已通过',
+            Product.is_deleted == False
+        ).all()
+        products_by_id = {product.id: product for product in products}
+        items = [products_by_id[pid].to_dict() for pid in similar_ids if pid in products_by_id]
+    else:
+        # 尚未计算近邻（新商品）时退化为同分类热门商品
+        product = Product.query.filter_by(id=product_id, is_deleted=False).first()
+        if not product:
+            return json_response(False, '商品不存在', status=404)
+        items = [p.to_dict() for p in Product.query.filter(
+            Product.tag_id == product.tag_id,
+            Product.id != product_id,
+            Product.status == '已通过',
+            Product.is_deleted == False
+        ).order_by(Product.views.desc()).limit(limit).all()]
+
+    logger.info(f"Fetched similar products for {product_id}")
+    return json_response(True, '获取相似商品成功', {'items': items})
+
 @product_bp.route('/recommended', methods=['GET'])
 @token_required
 def get_recommended_products_route(current_user):
@@ -325,8 +492,30 @@ def get_recommended_products_route(current_user):
         logger.error(f"User {current_user.id} failed to fetch recommended products: {str(e)}")
         return json_response(False, f'获取失败: {str(e)}', status=500)
 
+@product_bp.route('/recent', methods=['GET'])
+@token_required
+def get_recent_products(current_user):
+    """获取最近浏览的商品（继续浏览）
+
+    Args:
+        limit (int, optional): 返回数量，默认20，最大50
+
+    Returns:
+        JSON: 最近浏览的商品列表，最近的在前
+    """
+    limit = max(1, min(50, request.args.get('limit', 20, type=int)))
+    try:
+        product_ids = get_recent_view_ids(current_user.id, limit)
+        cards = get_product_cards(product_ids)
+        logger.info(f"User {current_user.id} fetched recently viewed products")
+        return json_response(True, '获取最近浏览成功', {'items': [cards[pid] for pid in product_ids if pid in cards]})
+    except Exception as e:
+        logger.error(f"User {current_user.id} failed to fetch recently viewed products: {str(e)}")
+        return json_response(False, f'获取失败: {str(e)}', status=500)
+
 @product_bp.route('/hot', methods=['GET'])
-@cache.cached(timeout=600)  # 缓存10分钟
+@conditional(generation_validator('products'), weak=True)
+@cache.cached(timeout=600, make_cache_key=generation_cache_key('products'))  # 缓存10分钟
 def get_hot_products_route():
     """获取热门商品
 
@@ -3,6 +3,9 @@ from ..models import db, Tag
 from ..utils.decorators import admin_required  # 管理员专用
 from sqlalchemy import desc
 from flask_caching import Cache
+from ..utils.suggest import sync_tag
+from ..utils.http_cache import make_etag, conditional, generation_validator, generation_cache_key, bump_generation
+from ..utils.trending import compute_trending, WINDOWS
 import logging
 
 tag_bp = Blueprint('tag', __name__)
@@ -12,8 +15,16 @@ logger = logging.getLogger(__name__)
 def json_response(success, message, data=None, status=200):
     return jsonify({'success': success, 'message': message, 'data': data}), status
 
+def tag_detail_validator(tag_id):
+    """标签详情的版本信息：标签的更新时间"""
+    updated_at = db.session.query(Tag.updated_at).filter_by(id=tag_id, is_deleted=False).scalar()
+    if updated_at is None:
+        return None, None
+    return make_etag('tag', tag_id, updated_at), updated_at
+
 @tag_bp.route('/tags', methods=['GET'])
-@cache.cached(timeout=300, key_prefix='tags_list')  # 缓存5分钟
+@conditional(generation_validator('tags'))
+@cache.cached(timeout=300, make_cache_key=generation_cache_key('tags'))  # 缓存5分钟
 def get_tags():
     """获取标签列表，支持分页和搜索
 
@@ -42,7 +53,36 @@ def get_tags():
         'current_page': page
     })
 
+@tag_bp.route('/trending', methods=['GET'])
+@cache.cached(timeout=60, query_string=True)  # 缓存1分钟
+def get_trending_tags():
+    """获取热度上升最快的分类（当前窗口与上一窗口的浏览、加购、下单加权计数对比）
+
+    Args:
+        window (str, optional): 窗口，15m/1h/24h，默认1h
+        limit (int, optional): 返回数量，默认10，最大50
+
+    Returns:
+        JSON: 分类列表，按上升速度降序
+    """
+    window = request.args.get('window', '1h')
+    if window not in WINDOWS:
+        return json_response(False, f'非法的窗口，可用值: {", ".join(WINDOWS)}', status=400)
+    limit = max(1, min(50, request.args.get('limit', 10, type=int)))
+    try:
+        trending = compute_trending(window, limit)
+        tags = {tag.id: tag for tag in Tag.query.filter(
+            Tag.id.in_([item['tag_id'] for item in trending]), Tag.is_deleted == False
+        ).all()} if trending else {}
+        items = [{**item, 'name': tags[item['tag_id']].name} for item in trending if item['tag_id'] in tags]
+        logger.info(f"Fetched trending tags (window={window}, limit={limit})")
+        return json_response(True, '获取热门分类成功', {'window': window, 'items': items})
+    except Exception as e:
+        logger.error(f"Failed to fetch trending tags: {str(e)}")
+        return json_response(False, f'获取失败: {str(e)}', status=500)
+
 @tag_bp.route('/tags/<int:tag_id>', methods=['GET'])
+@conditional(tag_detail_validator)
 def get_tag(tag_id):
     """获取标签详情
 
@@ -76,7 +116,8 @@ def create_tag(current_admin):
     try:
         db.session.add(tag)
         db.session.commit()
-        cache.delete('tags_list')
+        bump_generation('tags')
+        sync_tag(tag)
         logger.info(f"Admin {current_admin.id} created tag {tag.id}")
         return json_response(True, '创建标签成功', tag.to_dict(), 201)
     except Exception as e:
@@ -119,7 +160,8 @@ def update_tag(current_admin, tag_id):
 
     try:
         db.session.commit()
-        cache.delete('tags_list')
+        bump_generation('tags')
+        sync_tag(tag)
         logger.info(f"Admin {current_admin.id} updated tag {tag_id}")
         return json_response(True, '更新标签成功', tag.to_dict())
     except Exception as e:
@@ -145,7 +187,8 @@ def delete_tag(current_admin, tag_id):
     tag.is_deleted = True
     try:
         db.session.commit()
-        cache.delete('tags_list')
+        bump_generation('tags')
+        sync_tag(tag)
         logger.info(f"Admin {current_admin.id} deleted tag {tag_id}")
         return json_response(True, '标签已删除')
     except Exception as e:
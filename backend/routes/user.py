@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify, current_app
 from ..models import db, User
 from ..utils.decorators import login_required  # 仅限普通用户
+from ..utils.preferences import get_user_preferences, preference_vector
 import logging
 
 user_bp = Blueprint('user', __name__)
@@ -16,6 +17,14 @@ def get_profile(current_user):
     logger.info(f"User {current_user.id} fetched profile")
     return json_response(True, '获取个人信息成功', current_user.to_dict())
 
+@user_bp.route('/preferences', methods=['GET'])
+@login_required
+def get_preferences(current_user):
+    """获取当前用户的分类偏好（按购买次数归一化的权重）"""
+    preferences = preference_vector(get_user_preferences(current_user.id))
+    logger.info(f"User {current_user.id} fetched preferences")
+    return json_response(True, '获取偏好成功', {'items': preferences})
+
 @user_bp.route('/profile', methods=['PUT'])
 @login_required
 def update_profile(current_user):
@@ -0,0 +1,56 @@
+"""后台任务定义，由 `python -m backend.manage worker` 加载执行
+
+周期任务的间隔与读请求兜底触发使用相同的常量；工作进程按时重建后，读请求检查到结果未过期便不再触发。
+"""
+from backend.utils.jobs import periodic_job
+from backend.utils.offline_jobs import run_locked
+from backend.utils import similarity, recommender, unique_views, cart_store, stock, idempotency, order_timeout
+from backend.utils import order_state  # noqa: F401  注册订单状态通知任务
+
+
+@periodic_job('rebuild_similar_index', every=similarity.REBUILD_INTERVAL, max_retries=2, backoff=60)
+def rebuild_similar_index():
+    """重建相似商品索引"""
+    run_locked(similarity.SIMILAR_JOB, similarity.rebuild_similar_index)
+
+
+@periodic_job('rebuild_recommend_index', every=recommender.REBUILD_INTERVAL, max_retries=2, backoff=60)
+def rebuild_recommend_index():
+    """重建商品协同过滤邻居与用户 MinHash 索引"""
+    run_locked(recommender.RECOMMEND_JOB, recommender.rebuild_recommend_index)
+
+
+@periodic_job('rebuild_hot_ranking', every=600, max_retries=1, backoff=30)
+def rebuild_hot_ranking():
+    """按最近7天独立访客数重建热门排行"""
+    unique_views.rebuild_hot_ranking()
+
+
+@periodic_job('flush_carts', every=5, max_retries=0)
+def flush_carts():
+    """将 Redis 中有变更的购物车写回 carts 表"""
+    cart_store.flush_dirty_carts()
+
+
+@periodic_job('cancel_expired_orders', every=5, max_retries=0)
+def cancel_expired_orders():
+    """取消超过支付截止时间的待付款订单并归还库存"""
+    order_timeout.cancel_expired_orders()
+
+
+@periodic_job('requeue_overdue_orders', every=600, max_retries=1, backoff=60)
+def requeue_overdue_orders():
+    """将支付超时队列中丢失的待付款订单重新入队"""
+    order_timeout.requeue_overdue_orders()
+
+
+@periodic_job('reconcile_stock', every=300, max_retries=1, backoff=30)
+def reconcile_stock():
+    """对账 Redis 库存与数据库库存"""
+    stock.reconcile_stock()
+
+
+@periodic_job('purge_idempotency_keys', every=3600, max_retries=1, backoff=60)
+def purge_idempotency_keys():
+    """删除过期的幂等请求记录"""
+    idempotency.purge_expired_keys()
@@ -1,6 +1,8 @@
-from flask import current_app
-from ..models import db, Cart, Product
-from sqlalchemy import and_
+from ..models import db, Product
+from .redis_client import get_redis_client
+from .cart_store import load_cart, save_cart_lines, upsert_cart_rows, discard_cart_cache, flush_cart_if_dirty
+from .product_cache import get_product_cards
+from .stock import STOCK_KEY
 import redis
 import logging
 
@@ -8,115 +10,134 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_redis_client():
-    """动态获取 Redis 客户端，确保在应用上下文中"""
-    redis_pool = redis.ConnectionPool.from_url(
-        current_app.config.get('REDIS_URL', 'redis://localhost:6379/0')
-    )
-    return redis.Redis(connection_pool=redis_pool)
+def check_stock_batch(quantities):
+    """批量检查商品库存：一次 IN 查询商品，一次 MGET 读取 Redis 中的库存
+
+    Redis 中有库存键时以其为准（下单预占后的可售库存），否则使用数据库库存。
+
+    Args:
+        quantities (dict): 商品ID到所需数量的映射
+
+    Returns:
+        dict: 商品ID到 (是否满足, 提示信息) 的映射
+    """
+    if not quantities:
+        return {}
+    product_ids = list(quantities)
+    products = dict(db.session.query(Product.id, Product.quantity).filter(
+        Product.id.in_(product_ids),
+        Product.is_deleted == False,
+        Product.status == '已通过'
+    ).all())
+
+    try:
+        cached = get_redis_client().mget([STOCK_KEY.format(pid) for pid in product_ids])
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read cached stock: {str(e)}")
+        cached = [None] * len(product_ids)
+
+    results = {}
+    for product_id, value in zip(product_ids, cached):
+        if product_id not in products:
+            results[product_id] = (False, '商品不存在或已下架')
+            continue
+        stock = int(value) if value is not None else products[product_id]
+        if stock < quantities[product_id]:
+            results[product_id] = (False, f'商品库存不足，当前库存: {stock}')
+        else:
+            results[product_id] = (True, '库存充足')
+    return results
 
 def check_stock(product_id, quantity):
-    """检查商品库存（带并发保护）"""
-    product = Product.query.filter_by(
-        id=product_id,
-        is_deleted=False,
-        status='approved'
-    ).first()
-
-    if not product:
-        return False, '商品不存在或已下架'
-
-    redis_client = get_redis_client()
-    redis_key = f'stock:{product_id}'
-    with redis_client.pipeline() as pipe:
-        try:
-            pipe.watch(redis_key)
-            stock = int(pipe.get(redis_key) or product.quantity)
-            if stock < quantity:
-                return False, f'商品库存不足，当前库存: {stock}'
-            return True, '库存充足'
-        except redis.WatchError:
-            logger.warning(f"Stock check failed for product {product_id} due to concurrency")
-            return False, '库存检查失败，请重试'
+    """检查单个商品库存"""
+    return check_stock_batch({product_id: quantity})[product_id]
 
 def batch_add_to_cart(user_id, items):
-    """批量添加商品到购物车（优化事务提交）"""
-    success_items = []
+    """批量添加商品到购物车（一次读取购物车、一次商品查询、一次库存 MGET）
 
+    已在购物车中的商品只更新 Redis 中的数量，由 flush_dirty_carts 延迟写回数据库；
+    新商品以一条 upsert 语句写入 carts 行并直接取回购物车项。
+
+    Returns:
+        tuple: (是否成功, 提示信息, 商品ID到购物车项的映射)
+    """
+    lines = load_cart(user_id)
+    requested = {}
     for item in items:
         product_id = item.get('product_id')
-        quantity = item.get('quantity', 1)
-
-        stock_ok, message = check_stock(product_id, quantity)
+        requested[product_id] = requested.get(product_id, 0) + item.get('quantity', 1)
+
+    # 按加入后的总数量检查库存
+    stock = check_stock_batch({pid: quantity + lines[pid]['q'] if pid in lines else quantity
+                               for pid, quantity in requested.items()})
+    updated = {}
+    created = {}
+    for product_id, quantity in requested.items():
+        stock_ok, message = stock[product_id]
         if not stock_ok:
             logger.warning(f"Stock check failed for product {product_id}: {message}")
             continue
-
-        cart_item = Cart.query.filter(
-            and_(
-                Cart.user_id == user_id,
-                Cart.product_id == product_id,
-                Cart.is_deleted == False
-            )
-        ).first()
-
-        if cart_item:
-            cart_item.quantity += quantity
+        if product_id in lines:
+            updated[product_id] = {**lines[product_id], 'q': lines[product_id]['q'] + quantity}
         else:
-            cart_item = Cart(
-                user_id=user_id,
-                product_id=product_id,
-                quantity=quantity
-            )
-            db.session.add(cart_item)
-
-        success_items.append(product_id)
-
-    if success_items:
-        try:
-            db.session.commit()
-            logger.info(f"Added to cart for user {user_id}: {success_items}")
-            return True, '商品已添加到购物车', success_items
-        except Exception as e:
-            db.session.rollback()
-            logger.error(f"Failed to add to cart for user {user_id}: {str(e)}")
-            return False, f'添加失败: {str(e)}', []
-
-    return False, '没有商品被添加到购物车', []
+            created[product_id] = quantity
+
+    if not updated and not created:
+        return False, '没有商品被添加到购物车', {}
+
+    try:
+        if created:
+            # 先写回此前的删除，使重新加入的商品以新数量恢复已删除的行，而不是累加到旧行上
+            flush_cart_if_dirty(user_id)
+            prices = {pid: card['price'] for pid, card in get_product_cards(created).items()}
+            created = upsert_cart_rows(user_id, created, prices)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Failed to add to cart for user {user_id}: {str(e)}")
+        return False, f'添加失败: {str(e)}', {}
+
+    changed = {**updated, **created}
+    try:
+        save_cart_lines(user_id, changed)
+    except redis.RedisError as e:
+        logger.error(f"Failed to save cart for user {user_id}: {str(e)}")
+        discard_cart_cache(user_id)
+        if updated:
+            return False, f'添加失败: {str(e)}', {}
+    logger.info(f"Added to cart for user {user_id}: {list(changed)}")
+    return True, '商品已添加到购物车', changed
 
 def batch_update_cart(user_id, items):
-    """批量更新购物车商品数量（优化事务提交）"""
-    success_items = []
+    """批量更新购物车商品数量（一次读取购物车、一次商品查询、一次库存 MGET）
 
-    for item in items:
-        cart_id = item.get('cart_id')
-        quantity = item.get('quantity', 1)
+    只更新 Redis 中的数量，由 flush_dirty_carts 延迟写回数据库。
 
-        cart_item = Cart.query.filter_by(
-            id=cart_id,
-            user_id=user_id,
-            is_deleted=False
-        ).first()
-
-        if not cart_item:
-            continue
+    Returns:
+        tuple: (是否成功, 提示信息, 商品ID到购物车项的映射)
+    """
+    lines = load_cart(user_id)
+    by_id = {line['id']: (pid, line) for pid, line in lines.items()}
+    requested = {}
+    for item in items:
+        if item.get('cart_id') in by_id:
+            requested[by_id[item['cart_id']][0]] = item.get('quantity', 1)
 
-        stock_ok, message = check_stock(cart_item.product_id, quantity)
+    stock = check_stock_batch(requested)
+    updated = {}
+    for product_id, quantity in requested.items():
+        stock_ok, message = stock[product_id]
         if not stock_ok:
-            logger.warning(f"Stock check failed for cart {cart_id}: {message}")
+            logger.warning(f"Stock check failed for cart {lines[product_id]['id']}: {message}")
             continue
-
-        cart_item.quantity = quantity
-        success_items.append(cart_id)
-
-    if success_items:
-        try:
-            db.session.commit()
-            logger.info(f"Updated cart for user {user_id}: {success_items}")
-            return True, '购物车已更新', success_items
-        except Exception as e:
-            db.session.rollback()
-            logger.error(f"Failed to update cart for user {user_id}: {str(e)}")
-            return False, f'更新失败: {str(e)}', []
-
-    return False, '没有购物车项被更新', []
\ No newline at end of file
+        updated[product_id] = {**lines[product_id], 'q': quantity}
+
+    if not updated:
+        return False, '没有购物车项被更新', {}
+
+    try:
+        save_cart_lines(user_id, updated)
+        logger.info(f"Updated cart for user {user_id}: {[line['id'] for line in updated.values()]}")
+        return True, '购物车已更新', updated
+    except redis.RedisError as e:
+        logger.error(f"Failed to update cart for user {user_id}: {str(e)}")
+        return False, f'更新失败: {str(e)}', {}
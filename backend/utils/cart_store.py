@@ -0,0 +1,412 @@
+from ..models import db, Cart
+from .redis_client import get_redis_client
+from datetime import datetime
+from sqlalchemy import Index, MetaData, Table, case, func, inspect, text
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from typing import Dict, Iterable, List, Optional
+import json
+import redis
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CART_KEY = 'cart:user:{}'  # 字段为商品ID，值为 {"id": 购物车项ID, "q": 数量, "t": 添加时间, "p": 加入时单价}
+CART_DIRTY_KEY = 'cart:dirty'  # 有未持久化变更的用户ID
+CART_REMOVED_KEY = 'cart:removed:{}'  # 用户ID -> 已从 Redis 删除、待在数据库中软删除的购物车项ID
+CART_SUMMARY_KEY = 'cart:summary:{}'  # 用户ID；购物车或其中任一商品变更时删除
+SUMMARY_WATCHERS_KEY = 'cart:summary:watch:{}'  # 商品ID -> 缓存了含该商品的购物车汇总的用户ID
+LOADED_FIELD = '_'  # 占位字段，使空购物车也能被缓存
+CART_TTL = 7 * 86400
+
+
+def _encode(line: dict) -> str:
+    return json.dumps(line, separators=(',', ':'))
+
+
+def _rehydrate(user_id: int) -> Dict[int, dict]:
+    """从数据库加载用户的有效购物车项并写入 Redis（已删除但尚未写回数据库的行不加载）"""
+    key = CART_KEY.format(user_id)
+    try:
+        removed = {int(cart_id) for cart_id in get_redis_client().smembers(CART_REMOVED_KEY.format(user_id))}
+    except redis.RedisError as e:
+        logger.error(f"Failed to read removed cart items for user {user_id}: {str(e)}")
+        removed = set()
+    rows = Cart.query.filter_by(user_id=user_id, is_deleted=False).all()
+    lines = {row.product_id: {'id': row.id, 'q': row.quantity, 't': row.added_at.isoformat(), 'p': row.price}
+             for row in rows if row.id not in removed}
+    try:
+        with get_redis_client().pipeline() as pipe:
+            pipe.delete(key, CART_SUMMARY_KEY.format(user_id))
+            pipe.hset(key, mapping={LOADED_FIELD: 1, **{pid: _encode(line) for pid, line in lines.items()}})
+            pipe.expire(key, CART_TTL)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"Failed to cache cart for user {user_id}: {str(e)}")
+    return lines
+
+
+def load_cart(user_id: int) -> Dict[int, dict]:
+    """读取用户购物车（一次 HGETALL；未缓存时从数据库加载）
+
+    Args:
+        user_id: 用户ID
+
+    Returns:
+        Dict[int, dict]: 商品ID到 {'id', 'q', 't', 'p'} 的映射
+    """
+    try:
+        data = get_redis_client().hgetall(CART_KEY.format(user_id))
+    except redis.RedisError as e:
+        logger.error(f"Failed to read cart for user {user_id}: {str(e)}")
+        data = None
+    if not data:
+        return _rehydrate(user_id)
+    return {int(field): json.loads(value) for field, value in data.items() if field != LOADED_FIELD.encode()}
+
+
+def save_cart_lines(user_id: int, lines: Dict[int, dict]):
+    """写入或覆盖购物车项并标记待持久化
+
+    Args:
+        user_id: 用户ID
+        lines: 商品ID到 {'id', 'q', 't', 'p'} 的映射
+    """
+    if not lines:
+        return
+    key = CART_KEY.format(user_id)
+    with get_redis_client().pipeline() as pipe:
+        pipe.hset(key, mapping={LOADED_FIELD: 1, **{pid: _encode(line) for pid, line in lines.items()}})
+        pipe.expire(key, CART_TTL)
+        pipe.delete(CART_SUMMARY_KEY.format(user_id))
+        pipe.sadd(CART_DIRTY_KEY, user_id)
+        pipe.execute()
+
+
+def remove_cart_lines(user_id: int, product_ids: Iterable[int], persist: bool = True):
+    """删除购物车项
+
+    Args:
+        user_id: 用户ID
+        product_ids: 商品ID
+        persist: 是否标记待持久化；数据库中已删除（如下单）时传 False
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    redis_client = get_redis_client()
+    key = CART_KEY.format(user_id)
+    # 删除需要显式记录：flush_cart 不能把"不在 Redis 中"当作已删除（新行写入数据库后才写入 Redis）
+    removed = [json.loads(value)['id'] for value in redis_client.hmget(key, product_ids) if value] if persist else []
+    with redis_client.pipeline() as pipe:
+        pipe.hdel(key, *product_ids)
+        pipe.delete(CART_SUMMARY_KEY.format(user_id))
+        if removed:
+            pipe.sadd(CART_REMOVED_KEY.format(user_id), *removed)
+            pipe.expire(CART_REMOVED_KEY.format(user_id), CART_TTL)
+        if persist:
+            pipe.sadd(CART_DIRTY_KEY, user_id)
+        pipe.execute()
+
+
+def discard_cart_cache(user_id: int):
+    """写入 Redis 失败后丢弃缓存，下次读取时从数据库重新加载，避免缓存缺少已插入的行"""
+    try:
+        get_redis_client().delete(CART_KEY.format(user_id), CART_SUMMARY_KEY.format(user_id))
+    except redis.RedisError as e:
+        logger.error(f"Failed to discard cart cache for user {user_id}: {str(e)}")
+
+
+def invalidate_cart_summaries(product_ids: Iterable[int]):
+    """商品信息或库存变更后删除包含这些商品的购物车汇总缓存
+
+    Args:
+        product_ids: 商品ID
+    """
+    watch_keys = [SUMMARY_WATCHERS_KEY.format(pid) for pid in product_ids]
+    if not watch_keys:
+        return
+    try:
+        redis_client = get_redis_client()
+        user_ids = redis_client.sunion(watch_keys)
+        with redis_client.pipeline() as pipe:
+            if user_ids:
+                pipe.delete(*[CART_SUMMARY_KEY.format(int(uid)) for uid in user_ids])
+            pipe.delete(*watch_keys)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"Failed to invalidate cart summaries: {str(e)}")
+
+
+def find_cart_lines(lines: Dict[int, dict], cart_ids: Iterable[int]) -> Dict[int, dict]:
+    """按购物车项ID查找购物车项
+
+    Args:
+        lines: load_cart 的结果
+        cart_ids: 购物车项ID
+
+    Returns:
+        Dict[int, dict]: 商品ID到购物车项的映射
+    """
+    wanted = set(cart_ids)
+    return {pid: line for pid, line in lines.items() if line['id'] in wanted}
+
+
+def flush_cart(user_id: int) -> int:
+    """将用户购物车在 Redis 中的变更写回 carts 表（数量更新与软删除）
+
+    先移出待持久化集合再读取，读取后发生的变更会重新标记，由下一轮处理。只软删除 remove_cart_lines
+    记录的购物车项；不在 Redis 中的行可能是刚写入数据库、尚未写入 Redis 的新行，保持不变。
+
+    Args:
+        user_id: 用户ID
+
+    Returns:
+        int: 变更的行数
+
+    Raises:
+        Exception: 数据库写入失败（已回滚，用户重新标记为待持久化）
+    """
+    redis_client = get_redis_client()
+    redis_client.srem(CART_DIRTY_KEY, user_id)
+    with redis_client.pipeline() as pipe:
+        pipe.hgetall(CART_KEY.format(user_id))
+        pipe.smembers(CART_REMOVED_KEY.format(user_id))
+        data, removed_members = pipe.execute()
+    if not data and not removed_members:
+        return 0  # 缓存已过期或被清除，数据库即为最新状态
+    lines = {int(field): json.loads(value) for field, value in data.items() if field != LOADED_FIELD.encode()}
+    removed = {int(cart_id) for cart_id in removed_members}
+
+    changed = 0
+    try:
+        for row in Cart.query.filter_by(user_id=user_id, is_deleted=False).all():
+            line = lines.get(row.product_id)
+            if row.id in removed and (line is None or line['id'] != row.id):
+                row.is_deleted = True
+                changed += 1
+            elif line is not None and line['id'] == row.id and line['q'] != row.quantity:
+                row.quantity = line['q']
+                changed += 1
+        if changed:
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        redis_client.sadd(CART_DIRTY_KEY, user_id)
+        raise
+    if removed_members:
+        # 只移除本轮处理过的ID，读取后新记录的删除留给下一轮
+        redis_client.srem(CART_REMOVED_KEY.format(user_id), *removed_members)
+    return changed
+
+
+def flush_cart_if_dirty(user_id: int) -> int:
+    """用户有未持久化的变更时先写回数据库
+
+    upsert_cart_rows 以 carts 行为基础累加数量，行中尚未写回的删除或数量修改会使重新加入的商品累加到旧数量上。
+
+    Args:
+        user_id: 用户ID
+
+    Returns:
+        int: 变更的行数
+    """
+    if get_redis_client().sismember(CART_DIRTY_KEY, user_id):
+        return flush_cart(user_id)
+    return 0
+
+
+def flush_dirty_carts(limit: int = 500) -> int:
+    """持久化有变更的购物车（由任务工作进程周期执行）
+
+    Args:
+        limit: 本轮最多处理的用户数
+
+    Returns:
+        int: 处理的用户数
+    """
+    user_ids = [int(uid) for uid in get_redis_client().srandmember(CART_DIRTY_KEY, limit)]
+    for user_id in user_ids:
+        try:
+            flush_cart(user_id)
+        except Exception as e:
+            logger.error(f"Failed to flush cart for user {user_id}: {str(e)}")
+    if user_ids:
+        logger.info(f"Flushed carts for {len(user_ids)} users")
+    return len(user_ids)
+
+
+def merge_duplicate_cart_rows(batch_size: int = 500) -> int:
+    """合并同一用户同一商品的重复购物车行并添加 (user_id, product_id) 唯一索引
+
+    db.create_all() 不会为已存在的 carts 表添加唯一约束，没有约束时 upsert 不会命中已有行。每组保留ID最小的
+    有效行（没有有效行时保留ID最小的行），数量为各有效行之和，添加时间取最早值，其余行删除。
+    合并前先写回这些用户在 Redis 中的变更，合并后丢弃其购物车缓存。可重复执行。
+
+    Args:
+        batch_size: 每批处理的（用户, 商品）组数
+
+    Returns:
+        int: 删除的重复行数
+    """
+    deleted = 0
+    while True:
+        groups = db.session.query(Cart.user_id, Cart.product_id).group_by(Cart.user_id, Cart.product_id).having(
+            func.count(Cart.id) > 1
+        ).limit(batch_size).all()
+        if not groups:
+            break
+        user_ids = {user_id for user_id, _ in groups}
+        for user_id in user_ids:
+            try:
+                flush_cart(user_id)
+            except redis.RedisError as e:
+                logger.warning(f"Failed to flush cart for user {user_id} before merging: {str(e)}")
+
+        try:
+            for user_id, product_id in groups:
+                rows = Cart.query.filter_by(user_id=user_id, product_id=product_id).order_by(Cart.id).all()
+                active = [row for row in rows if not row.is_deleted]
+                keep = (active or rows)[0]
+                if active:
+                    keep.quantity = sum(row.quantity for row in active)
+                    keep.added_at = min(row.added_at for row in active)
+                for row in rows:
+                    if row is not keep:
+                        db.session.delete(row)
+                        deleted += 1
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to merge duplicate cart rows: {str(e)}")
+            raise
+        for user_id in user_ids:
+            discard_cart_cache(user_id)
+        logger.info(f"Merged duplicate cart rows for {len(groups)} user/product pairs ({deleted} rows removed)")
+
+    names = {index['name'] for index in inspect(db.engine).get_indexes(Cart.__tablename__)}
+    names |= {constraint['name'] for constraint in inspect(db.engine).get_unique_constraints(Cart.__tablename__)}
+    if 'uq_carts_user_product' not in names:
+        # 基于反射的表创建索引，不修改模型的元数据
+        table = Table(Cart.__tablename__, MetaData(), autoload_with=db.engine)
+        Index('uq_carts_user_product', table.c.user_id, table.c.product_id, unique=True).create(db.engine)
+        logger.info("Created unique index uq_carts_user_product")
+    return deleted
+
+
+def add_cart_price_column() -> bool:
+    """为已存在的 carts 表添加 price 列（db.create_all() 不会修改已存在的表），可重复执行
+
+    Returns:
+        bool: 本次是否添加了该列
+    """
+    columns = {column['name'] for column in inspect(db.engine).get_columns(Cart.__tablename__)}
+    if 'price' in columns:
+        return False
+    with db.engine.begin() as connection:
+        connection.execute(text(f'ALTER TABLE {Cart.__tablename__} ADD COLUMN price FLOAT NULL'))
+    logger.info("Added column carts.price")
+    return True
+
+
+def _upsert_statement(rows: List[dict]):
+    """按数据库方言构造购物车项的插入或更新语句
+
+    已有行为软删除时恢复为新加入的数量与时间，否则在原数量上累加（并发重复加入不会产生重复行）。
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        stmt = mysql_insert(Cart).values(rows)
+        incoming = stmt.inserted
+        # MySQL 按顺序执行赋值，is_deleted 必须最后更新，前面的表达式才能读到旧值
+        return stmt.on_duplicate_key_update([
+            ('id', func.last_insert_id(Cart.id)),
+            ('quantity', case((Cart.is_deleted, incoming.quantity), else_=Cart.quantity + incoming.quantity)),
+            ('added_at', case((Cart.is_deleted, incoming.added_at), else_=Cart.added_at)),
+            ('price', case((Cart.is_deleted, incoming.price), else_=Cart.price)),
+            ('updated_at', incoming.updated_at),
+            ('is_deleted', False),
+        ])
+    stmt = sqlite_insert(Cart).values(rows)
+    incoming = stmt.excluded
+    return stmt.on_conflict_do_update(index_elements=['user_id', 'product_id'], set_={
+        'quantity': case((Cart.is_deleted, incoming.quantity), else_=Cart.quantity + incoming.quantity),
+        'added_at': case((Cart.is_deleted, incoming.added_at), else_=Cart.added_at),
+        'price': case((Cart.is_deleted, incoming.price), else_=Cart.price),
+        'updated_at': incoming.updated_at,
+        'is_deleted': False,
+    })
+
+
+def upsert_cart_rows(user_id: int, quantities: Dict[int, int], prices: Dict[int, float]) -> Dict[int, dict]:
+    """为新加入购物车的商品写入 carts 行（一条 INSERT ... ON DUPLICATE KEY / ON CONFLICT 语句），以获得稳定的购物车项ID
+
+    依赖 (user_id, product_id) 唯一约束，不先查询是否存在。支持 RETURNING 的数据库直接取回写入后的行；
+    MySQL 单行时通过 LAST_INSERT_ID(id) 取回ID，仅在命中已有行时按主键读取数量，多行时一次查询取回。
+
+    Args:
+        user_id: 用户ID
+        quantities: 商品ID到数量的映射
+        prices: 商品ID到当前单价的映射，记录为加入时单价
+
+    Returns:
+        Dict[int, dict]: 商品ID到 {'id', 'q', 't', 'p'} 的映射
+    """
+    now = datetime.utcnow()
+    stmt = _upsert_statement([
+        {'user_id': user_id, 'product_id': pid, 'quantity': quantity, 'price': prices.get(pid), 'added_at': now,
+         'created_at': now, 'updated_at': now, 'is_deleted': False}
+        for pid, quantity in quantities.items()
+    ])
+    columns = (Cart.id, Cart.product_id, Cart.quantity, Cart.added_at, Cart.price)
+    if db.session.get_bind().dialect.insert_returning:
+        rows = db.session.execute(stmt.returning(*columns)).all()
+    else:
+        result = db.session.execute(stmt)
+        if len(quantities) == 1 and result.rowcount == 1:
+            (product_id, quantity), = quantities.items()
+            rows = [(result.lastrowid, product_id, quantity, now, prices.get(product_id))]
+        elif len(quantities) == 1:
+            rows = db.session.query(*columns).filter(Cart.id == result.lastrowid).all()
+        else:
+            rows = db.session.query(*columns).filter(
+                Cart.user_id == user_id,
+                Cart.product_id.in_(list(quantities))
+            ).all()
+    db.session.commit()
+    return {product_id: {'id': cart_id, 'q': quantity, 't': added_at.isoformat(), 'p': price}
+            for cart_id, product_id, quantity, added_at, price in rows}
+
+
+def cart_line_dict(user_id: int, product_id: int, line: dict, product: Optional[dict] = None) -> dict:
+    """将购物车项转换为与 Cart.to_dict 相同的格式
+
+    Args:
+        user_id: 用户ID
+        product_id: 商品ID
+        line: 购物车项
+        product: 商品摘要，提供时附加到 product 字段
+
+    Returns:
+        dict: 购物车项信息
+    """
+    data = {
+        'id': line['id'],
+        'quantity': line['q'],
+        'price': line.get('p'),
+        'added_at': line['t'],
+        'user_id': user_id,
+        'product_id': product_id,
+        'is_deleted': False
+    }
+    if product is not None:
+        data['product'] = product
+    return data
+
+
+def cart_items(user_id: int, lines: Dict[int, dict], cards: Dict[int, dict]) -> List[dict]:
+    """按添加时间排列购物车项并附加商品摘要，已删除的商品不返回"""
+    ordered = sorted(lines.items(), key=lambda item: item[1]['t'])
+    return [cart_line_dict(user_id, pid, line, cards[pid]) for pid, line in ordered if pid in cards]
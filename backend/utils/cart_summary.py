@@ -0,0 +1,125 @@
+from .redis_client import get_redis_client
+from .cart_store import load_cart, CART_SUMMARY_KEY, SUMMARY_WATCHERS_KEY
+from .product_cache import get_product_cards
+from .stock import STOCK_KEY
+from typing import Dict, List, Optional
+import json
+import redis
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SUMMARY_TTL = 600  # 变更时主动删除，过期时间只是兜底
+
+
+def _unavailable_reason(card: Optional[dict], quantity: int, stock: int) -> Optional[str]:
+    """购物车项不可购买的原因，可购买时为 None"""
+    if card is None:
+        return '商品不存在'
+    if card['status'] != '已通过' or not card['is_available']:
+        return '商品已下架'
+    if stock < quantity:
+        return f'库存不足，当前库存: {stock}'
+    return None
+
+
+def build_cart_summary(user_id: int) -> dict:
+    """计算购物车汇总：一次读取购物车、一次商品摘要 MGET、一次库存 MGET，不查询数据库（缓存命中时）
+
+    Args:
+        user_id: 用户ID
+
+    Returns:
+        dict: {'groups': 按卖家分组的购物车项与小计, 'unavailable': 不可购买的项, 'price_changed': 降价或涨价的项,
+               'total_quantity': 可购买商品总件数, 'total_amount': 可购买商品总金额}
+    """
+    lines = load_cart(user_id)
+    cards = get_product_cards(lines)
+    product_ids = list(lines)
+    try:
+        cached = get_redis_client().mget([STOCK_KEY.format(pid) for pid in product_ids]) if product_ids else []
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read cached stock: {str(e)}")
+        cached = [None] * len(product_ids)
+    stock = {pid: int(value) if value is not None else cards.get(pid, {}).get('quantity', 0)
+             for pid, value in zip(product_ids, cached)}
+
+    groups: Dict[Optional[int], dict] = {}
+    unavailable: List[dict] = []
+    price_changed: List[dict] = []
+    total_quantity = 0
+    total_amount = 0.0
+    for product_id, line in sorted(lines.items(), key=lambda item: item[1]['t']):
+        card = cards.get(product_id)
+        reason = _unavailable_reason(card, line['q'], stock[product_id])
+        price = card['price'] if card else line.get('p')
+        item = {
+            'cart_id': line['id'],
+            'product_id': product_id,
+            'name': card['name'] if card else None,
+            'image': card['images'][0] if card and card['images'] else None,
+            'quantity': line['q'],
+            'price': price,
+            'added_price': line.get('p'),
+            'line_total': round(price * line['q'], 2) if price is not None else None,
+            'available': reason is None
+        }
+        if reason is not None:
+            unavailable.append({'cart_id': line['id'], 'product_id': product_id, 'reason': reason})
+        if card and line.get('p') is not None and line['p'] != price:
+            price_changed.append({'cart_id': line['id'], 'product_id': product_id,
+                                  'added_price': line['p'], 'price': price})
+
+        seller_id = card.get('seller_id') if card else None
+        group = groups.setdefault(seller_id, {'seller_id': seller_id, 'items': [], 'quantity': 0, 'subtotal': 0.0})
+        group['items'].append(item)
+        if reason is None:
+            group['quantity'] += line['q']
+            group['subtotal'] = round(group['subtotal'] + item['line_total'], 2)
+            total_quantity += line['q']
+            total_amount += item['line_total']
+
+    return {
+        'groups': list(groups.values()),
+        'unavailable': unavailable,
+        'price_changed': price_changed,
+        'total_quantity': total_quantity,
+        'total_amount': round(total_amount, 2)
+    }
+
+
+def get_cart_summary(user_id: int) -> dict:
+    """读取购物车汇总，未缓存时计算并缓存
+
+    缓存在购物车变更（cart_store 写入时）或其中任一商品变更（invalidate_product_cards、库存预占与归还）时删除。
+
+    Args:
+        user_id: 用户ID
+
+    Returns:
+        dict: 购物车汇总，见 build_cart_summary
+    """
+    key = CART_SUMMARY_KEY.format(user_id)
+    redis_client = get_redis_client()
+    try:
+        cached = redis_client.get(key)
+        if cached:
+            return json.loads(cached)
+    except (redis.RedisError, ValueError) as e:
+        logger.warning(f"Failed to read cart summary for user {user_id}: {str(e)}")
+
+    summary = build_cart_summary(user_id)
+    product_ids = [item['product_id'] for group in summary['groups'] for item in group['items']]
+    try:
+        with redis_client.pipeline() as pipe:
+            pipe.setex(key, SUMMARY_TTL, json.dumps(summary, ensure_ascii=False))
+            for product_id in product_ids:
+                watch_key = SUMMARY_WATCHERS_KEY.format(product_id)
+                pipe.sadd(watch_key, user_id)
+                pipe.expire(watch_key, SUMMARY_TTL)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to cache cart summary for user {user_id}: {str(e)}")
+    return summary
@@ -1,5 +1,5 @@
 from functools import wraps
-from flask import request, jsonify, current_app
+from flask import request, jsonify, current_app, g
 import jwt
 from typing import Optional, Union, Callable
 import logging
@@ -61,6 +61,25 @@ def verify_token(token: str) -> dict:
         raise ValueError(f'令牌验证失败: {str(e)}')
 
 
+def get_optional_user_id() -> Optional[int]:
+    """可选登录的接口中获取普通用户ID：令牌有效时返回用户ID（只校验签名，不查询数据库），否则返回 None
+
+    同一请求内的结果缓存在 g 中，多个装饰器调用时只解码一次。
+    """
+    if 'optional_user_id' not in g:
+        user_id = None
+        token = get_token_from_header()
+        if token:
+            try:
+                payload = verify_token(token)
+                if payload.get('type') == 'user':
+                    user_id = payload.get('user_id')
+            except ValueError:
+                pass
+        g.optional_user_id = user_id
+    return g.optional_user_id
+
+
 def get_current_user(payload: dict) -> Union[User, Admin]:
     """根据令牌载荷获取当前用户（带缓存）"""
     redis_client = get_redis_client()
@@ -0,0 +1,109 @@
+from flask import current_app
+from .redis_client import get_redis_client
+from typing import Dict, Iterable, List
+import threading
+import time
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DELAY_QUEUE_KEY = 'delay:{}'  # 队列名；成员按到期时间排序
+PROCESSING_KEY = 'delay:{}:processing'  # 已取出未确认的成员，按重新投递时间排序
+VISIBILITY_TIMEOUT = 60  # 取出后未确认（处理进程异常退出）的成员在此时间后重新投递
+
+
+class RedisDelayQueue:
+    """基于有序集合的延时队列，多个工作进程并发取出时每个成员只交给其中一个，确认前异常退出会重新投递"""
+
+    # 先将超时未确认的成员放回队列，再原子地取出到期成员并移入处理中集合
+    POP_SCRIPT = """
+    local now = tonumber(ARGV[1])
+    for _, member in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+        redis.call('ZREM', KEYS[2], member)
+        redis.call('ZADD', KEYS[1], now, member)
+    end
+    local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, tonumber(ARGV[2]))
+    for _, member in ipairs(due) do
+        redis.call('ZREM', KEYS[1], member)
+        redis.call('ZADD', KEYS[2], now + tonumber(ARGV[3]), member)
+    end
+    return due
+    """
+
+    def __init__(self, client, name: str):
+        self.client = client
+        self.key = DELAY_QUEUE_KEY.format(name)
+        self.processing_key = PROCESSING_KEY.format(name)
+        self._pop = client.register_script(self.POP_SCRIPT)
+
+    def add(self, members: Iterable[str], due: float):
+        mapping = {member: due for member in members}
+        if mapping:
+            self.client.zadd(self.key, mapping)
+
+    def pop_due(self, limit: int, visibility: float = VISIBILITY_TIMEOUT) -> List[str]:
+        due = self._pop(keys=[self.key, self.processing_key], args=[time.time(), limit, visibility])
+        return [member.decode() for member in due]
+
+    def ack(self, members: Iterable[str]):
+        members = list(members)
+        if members:
+            self.client.zrem(self.processing_key, *members)
+
+    def size(self) -> int:
+        return self.client.zcard(self.key)
+
+
+class MemoryDelayQueue:
+    """进程内延时队列，接口与 RedisDelayQueue 相同，仅用于测试和单进程开发"""
+
+    def __init__(self):
+        self._due: Dict[str, float] = {}
+        self._processing: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, members: Iterable[str], due: float):
+        with self._lock:
+            for member in members:
+                self._due[member] = due
+
+    def pop_due(self, limit: int, visibility: float = VISIBILITY_TIMEOUT) -> List[str]:
+        now = time.time()
+        with self._lock:
+            for member in [m for m, at in self._processing.items() if at <= now]:
+                del self._processing[member]
+                self._due[member] = now
+            due = sorted((at, member) for member, at in self._due.items() if at <= now)[:limit]
+            for _, member in due:
+                del self._due[member]
+                self._processing[member] = now + visibility
+            return [member for _, member in due]
+
+    def ack(self, members: Iterable[str]):
+        with self._lock:
+            for member in members:
+                self._processing.pop(member, None)
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._due)
+
+
+def get_delay_queue(name: str):
+    """获取当前应用的延时队列（与任务队列使用相同的 JOBS_BACKEND 配置），每个应用每个队列只创建一次
+
+    Args:
+        name: 队列名
+
+    Returns:
+        RedisDelayQueue | MemoryDelayQueue: 延时队列
+    """
+    queues = current_app.extensions.setdefault('delay_queues', {})
+    if name not in queues:
+        if current_app.config.get('JOBS_BACKEND', 'redis') == 'memory':
+            queues[name] = MemoryDelayQueue()
+        else:
+            queues[name] = RedisDelayQueue(get_redis_client(), name)
+    return queues[name]
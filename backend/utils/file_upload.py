@@ -1,16 +1,62 @@
 import os
-import uuid
+import re
+import hashlib
 import mimetypes
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
+from typing import List, NamedTuple, Optional
 from flask import current_app
+from sqlalchemy import case
+from sqlalchemy.exc import IntegrityError
 from werkzeug.utils import secure_filename
-import io
+from ..models import db, StoredFile
 import logging
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 内容寻址文件URL：/static/uploads/<folder>/ab/cd/<sha256>.<ext>
+CONTENT_ADDRESSED_URL = re.compile(
+    r'^/static/uploads/.+/(?P<shard1>[0-9a-f]{2})/(?P<shard2>[0-9a-f]{2})/'
+    r'(?P<digest>(?P=shard1)(?P=shard2)[0-9a-f]{60})(\.[a-z0-9]+)?$'
+)
+
+DEFAULT_ALLOWED_FILE_TYPES = {
+    'image/jpeg': ['.jpg', '.jpeg'],
+    'image/png': ['.png'],
+    'image/gif': ['.gif'],
+    'image/svg+xml': ['.svg'],
+    'application/pdf': ['.pdf'],
+    'text/plain': ['.txt'],
+    'application/msword': ['.doc'],
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': ['.docx'],
+    'application/vnd.ms-excel': ['.xls'],
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': ['.xlsx'],
+    'application/zip': ['.zip'],
+    'application/x-rar-compressed': ['.rar']
+}
+
+# 文件头魔数签名
+MAGIC_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+    (b'PK\x03\x04', 'application/zip'),
+    (b'Rar!\x1a\x07', 'application/x-rar-compressed'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/msword'),
+]
+ZIP_BASED_TYPES = {
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+OLE_BASED_TYPES = {'application/vnd.ms-excel'}
+SIGNATURE_REQUIRED_TYPES = {mime_type for _, mime_type in MAGIC_SIGNATURES} | ZIP_BASED_TYPES | OLE_BASED_TYPES
+
 
 def get_safe_path(base_path: str, file_path: str) -> str:
     """确保文件路径安全，防止路径遍历攻击
@@ -50,30 +96,28 @@ def get_mime_type(filename: str) -> str:
     return mime_type or 'application/octet-stream'
 
 
-def allowed_file(filename: str, mime_type: str) -> bool:
+def get_allowed_file_types() -> dict:
+    """获取允许上传的MIME类型及对应扩展名
+
+    Returns:
+        dict: MIME类型到扩展名列表的映射
+    """
+    return current_app.config.get('ALLOWED_FILE_TYPES', DEFAULT_ALLOWED_FILE_TYPES)
+
+
+def allowed_file(filename: str, mime_type: str, allowed_types: Optional[dict] = None) -> bool:
     """检查文件类型和MIME类型是否允许
 
     Args:
         filename: 文件名
         mime_type: MIME类型
+        allowed_types: 允许的类型映射，默认读取应用配置
 
     Returns:
         bool: 是否允许
     """
-    allowed_types = current_app.config.get('ALLOWED_FILE_TYPES', {
-        'image/jpeg': ['.jpg', '.jpeg'],
-        'image/png': ['.png'],
-        'image/gif': ['.gif'],
-        'image/svg+xml': ['.svg'],
-        'application/pdf': ['.pdf'],
-        'text/plain': ['.txt'],
-        'application/msword': ['.doc'],
-        'application/vnd.openxmlformats-officedocument.wordprocessingml.document': ['.docx'],
-        'application/vnd.ms-excel': ['.xls'],
-        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': ['.xlsx'],
-        'application/zip': ['.zip'],
-        'application/x-rar-compressed': ['.rar']
-    })
+    if allowed_types is None:
+        allowed_types = get_allowed_file_types()
 
     if not filename or '.' not in filename:
         return False
@@ -82,8 +126,279 @@ def allowed_file(filename: str, mime_type: str) -> bool:
     return mime_type in allowed_types and ext in allowed_types[mime_type]
 
 
+def sniff_mime_type(header: bytes, declared_type: Optional[str] = None) -> Optional[str]:
+    """根据文件头魔数识别MIME类型
+
+    无法识别的格式（如纯文本）沿用客户端声明的类型；Office文档本质是ZIP，
+    识别为ZIP时若声明类型为Office格式则以声明为准。
+
+    Args:
+        header: 文件开头的字节
+        declared_type: 客户端声明的MIME类型
+
+    Returns:
+        Optional[str]: 识别出的MIME类型
+    """
+    for signature, mime_type in MAGIC_SIGNATURES:
+        if header.startswith(signature):
+            if mime_type == 'application/zip' and declared_type in ZIP_BASED_TYPES:
+                return declared_type
+            if mime_type == 'application/msword' and declared_type in OLE_BASED_TYPES:
+                return declared_type
+            return mime_type
+    if declared_type in SIGNATURE_REQUIRED_TYPES:
+        # 声明为二进制格式但文件头不匹配，视为伪造类型
+        return None
+    return declared_type
+
+
+def build_content_path(folder: str, digest: str, ext: str) -> str:
+    """根据内容摘要生成分片存储路径
+
+    采用两级目录扇出（如 ab/cd/abcd...），避免单个目录下文件过多。
+
+    Args:
+        folder: 保存的子文件夹名称
+        digest: 文件内容的SHA-256十六进制摘要
+        ext: 文件扩展名（含点号）
+
+    Returns:
+        str: 相对上传目录的存储路径
+    """
+    return f"{folder}/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def is_content_addressed_url(url: str) -> bool:
+    """判断URL是否指向内容寻址存储的文件（内容不可变，可长期缓存）
+
+    Args:
+        url: 文件URL路径
+
+    Returns:
+        bool: 是否为内容寻址文件
+    """
+    return bool(url) and CONTENT_ADDRESSED_URL.match(url) is not None
+
+
+class StoredBlob(NamedTuple):
+    """已写入磁盘的上传内容"""
+    digest: str
+    path: str
+    size: int
+    mime_type: str
+    created: bool
+
+
+def write_upload(file, upload_folder: str, folder: str = 'uploads', max_size: int = 10 * 1024 * 1024,
+                 allowed_types: Optional[dict] = None, chunk_size: int = 64 * 1024) -> StoredBlob:
+    """单次流式写入上传文件
+
+    边读取边计算SHA-256、校验大小并根据文件头识别MIME类型，先写入临时文件，
+    完成后原子重命名到内容寻址路径。该函数只操作文件系统，可在线程池中并发调用。
+
+    Args:
+        file: 上传的文件对象
+        upload_folder: 上传根目录
+        folder: 保存的子文件夹名称
+        max_size: 最大文件大小（字节）
+        allowed_types: 允许的类型映射
+        chunk_size: 每次读取的字节数
+
+    Returns:
+        StoredBlob: 写入结果
+
+    Raises:
+        ValueError: 当文件类型不支持、大小超限或MIME类型不匹配时抛出
+    """
+    if not file:
+        raise ValueError('未上传文件')
+    if allowed_types is None:
+        allowed_types = DEFAULT_ALLOWED_FILE_TYPES
+
+    filename = secure_filename(file.filename)
+    ext = os.path.splitext(filename)[1].lower()
+    declared_type = file.content_type or get_mime_type(filename)
+
+    tmp_folder = get_safe_path(upload_folder, '.tmp')
+    os.makedirs(tmp_folder, exist_ok=True)
+    tmp = tempfile.NamedTemporaryFile(dir=tmp_folder, delete=False)
+    hasher = hashlib.sha256()
+    file_size = 0
+    mime_type = None
+    try:
+        with tmp:
+            while True:
+                chunk = file.stream.read(chunk_size)
+                if not chunk:
+                    break
+                if mime_type is None:
+                    mime_type = sniff_mime_type(chunk, declared_type)
+                    if not allowed_file(filename, mime_type, allowed_types):
+                        raise ValueError('不支持的文件类型或MIME类型不匹配')
+                file_size += len(chunk)
+                if file_size > max_size:
+                    raise ValueError(f'文件大小超过限制（最大{max_size / 1024 / 1024:.1f}MB）')
+                hasher.update(chunk)
+                tmp.write(chunk)
+        if mime_type is None:
+            raise ValueError('上传文件为空')
+
+        digest = hasher.hexdigest()
+        relative_path = build_content_path(folder, digest, ext)
+        file_path = get_safe_path(upload_folder, relative_path)
+        if os.path.exists(file_path):
+            # 相同内容已存在，丢弃临时文件
+            os.remove(tmp.name)
+            return StoredBlob(digest, relative_path, file_size, mime_type, False)
+
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(tmp.name, file_path)
+        logger.info(f"File saved: {file_path}")
+        return StoredBlob(digest, relative_path, file_size, mime_type, True)
+    except BaseException:
+        if os.path.exists(tmp.name):
+            os.remove(tmp.name)
+        raise
+
+
+def write_uploads(files, upload_folder: str, folder: str = 'uploads', max_size: int = 10 * 1024 * 1024,
+                  allowed_types: Optional[dict] = None, max_workers: int = 4) -> List[StoredBlob]:
+    """使用小型线程池并发写入多个上传文件
+
+    任一文件失败时删除本批新写入的文件并抛出异常。
+
+    Args:
+        files: 上传的文件对象列表
+        upload_folder: 上传根目录
+        folder: 保存的子文件夹名称
+        max_size: 单个文件最大大小（字节）
+        allowed_types: 允许的类型映射
+        max_workers: 最大并发线程数
+
+    Returns:
+        List[StoredBlob]: 与输入顺序一致的写入结果
+    """
+    if not files:
+        return []
+
+    def write(file):
+        return write_upload(file, upload_folder, folder, max_size, allowed_types)
+
+    if len(files) == 1 or max_workers <= 1:
+        blobs = []
+        try:
+            for file in files:
+                blobs.append(write(file))
+        except Exception:
+            _discard_blobs(upload_folder, blobs)
+            raise
+        return blobs
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(files))) as executor:
+        futures = [executor.submit(write, file) for file in files]
+        wait(futures)
+
+    blobs = [future.result() for future in futures if future.exception() is None]
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        _discard_blobs(upload_folder, blobs)
+        raise errors[0]
+    return blobs
+
+
+def _discard_blobs(upload_folder: str, blobs: List[StoredBlob]):
+    """删除本次新写入、尚未登记的文件"""
+    for blob in blobs:
+        if blob.created:
+            try:
+                os.remove(get_safe_path(upload_folder, blob.path))
+            except OSError as e:
+                logger.warning(f"Failed to discard upload {blob.path}: {str(e)}")
+
+
+def discard_unregistered_blobs(blobs: List[StoredBlob]):
+    """登记或提交失败并回滚后，删除本次新写入、没有文件记录指向的文件
+
+    并发上传相同内容的请求可能已登记并提交了指向本次写入文件的记录，此时保留文件。
+
+    Args:
+        blobs: write_uploads 的结果
+    """
+    created = [blob for blob in blobs if blob.created]
+    if not created:
+        return
+    try:
+        registered = set(db.session.query(StoredFile.sha256, StoredFile.path).filter(
+            StoredFile.sha256.in_([blob.digest for blob in created])
+        ).all())
+    except Exception as e:
+        logger.warning(f"Failed to check registered uploads, keeping {len(created)} files: {str(e)}")
+        return
+    _discard_blobs(current_app.config['UPLOAD_FOLDER'],
+                   [blob for blob in created if (blob.digest, blob.path) not in registered])
+
+
+def register_stored_files(blobs: List[StoredBlob]) -> List[StoredFile]:
+    """登记文件引用，内容相同的文件只保存一份
+
+    已存在相同摘要的记录时仅增加引用计数（并删除重复写入的副本），否则新建记录。
+    调用方负责提交事务。
+
+    Args:
+        blobs: 已写入磁盘的上传内容
+
+    Returns:
+        List[StoredFile]: 与输入顺序一致的文件记录
+    """
+    if not blobs:
+        return []
+
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    ref_counts = Counter(blob.digest for blob in blobs)
+    existing = {
+        stored.sha256: stored
+        for stored in StoredFile.query.filter(StoredFile.sha256.in_(list(ref_counts))).all()
+    }
+
+    records = {}
+    for blob in blobs:
+        if blob.digest in records:
+            continue
+        stored = existing.get(blob.digest)
+        if stored is None:
+            stored = StoredFile(sha256=blob.digest, path=blob.path, size=blob.size,
+                                mime_type=blob.mime_type, ref_count=ref_counts[blob.digest])
+            try:
+                with db.session.begin_nested():
+                    db.session.add(stored)
+                records[blob.digest] = stored
+                continue
+            except IntegrityError:
+                # 并发上传了相同内容，转为增加已有记录的引用计数
+                stored = StoredFile.query.filter_by(sha256=blob.digest).first()
+
+        if stored.path != blob.path:
+            stored_path = get_safe_path(upload_folder, stored.path)
+            if os.path.exists(stored_path):
+                if blob.created:
+                    os.remove(get_safe_path(upload_folder, blob.path))
+            else:
+                # 原文件丢失，改用本次写入的文件
+                stored.path = blob.path
+        StoredFile.query.filter_by(id=stored.id).update(
+            {StoredFile.ref_count: StoredFile.ref_count + ref_counts[blob.digest]}, synchronize_session=False
+        )
+        db.session.refresh(stored)
+        logger.info(f"Deduplicated upload {blob.digest}, refs={stored.ref_count}")
+        records[blob.digest] = stored
+
+    return [records[blob.digest] for blob in blobs]
+
+
 def save_file(file, folder='uploads', max_size=10 * 1024 * 1024):
-    """保存上传的文件
+    """保存上传的文件（按内容寻址去重）
+
+    文件以内容的SHA-256命名，相同内容只在磁盘上保存一份，并在数据库中记录引用计数。
 
     Args:
         file: 上传的文件对象
@@ -96,65 +411,114 @@ def save_file(file, folder='uploads', max_size=10 * 1024 * 1024):
     Raises:
         ValueError: 当文件类型不支持、大小超限或MIME类型不匹配时抛出
     """
-    if not file:
+    return save_files([file], folder, max_size)[0]
+
+
+def save_files(files, folder='uploads', max_size=10 * 1024 * 1024, max_workers=4):
+    """并发保存多个上传文件（按内容寻址去重）
+
+    Args:
+        files: 上传的文件对象列表
+        folder: 保存的子文件夹名称
+        max_size: 单个文件最大大小（字节），默认10MB
+        max_workers: 最大并发线程数
+
+    Returns:
+        List[str]: 与输入顺序一致的文件URL路径（登记后未提交，提交失败时调用方应使用
+        write_uploads 与 register_stored_files 并在回滚后调用 discard_unregistered_blobs）
+
+    Raises:
+        ValueError: 当文件类型不支持、大小超限或MIME类型不匹配时抛出
+    """
+    if not files or not all(files):
         raise ValueError('未上传文件')
 
-    # 使用 BufferedReader 防止大文件阻塞
-    file = io.BufferedReader(file)
-    file_size = 0
-    chunk_size = 8192  # 8KB chunks
-    while True:
-        chunk = file.read(chunk_size)
-        if not chunk:
-            break
-        file_size += len(chunk)
-        if file_size > max_size:
-            file.seek(0)
-            raise ValueError(f'文件大小超过限制（最大{max_size / 1024 / 1024:.1f}MB）')
-    file.seek(0)
+    blobs = write_uploads(files, current_app.config['UPLOAD_FOLDER'], folder, max_size,
+                          get_allowed_file_types(), max_workers)
+    try:
+        return [stored.url for stored in register_stored_files(blobs)]
+    except Exception:
+        db.session.rollback()
+        discard_unregistered_blobs(blobs)
+        raise
 
-    filename = secure_filename(file.filename)
-    mime_type = file.content_type or get_mime_type(filename)
 
-    if not allowed_file(filename, mime_type):
-        raise ValueError('不支持的文件类型或MIME类型不匹配')
+def delete_files(file_urls: List[str]) -> int:
+    """释放多个文件的引用并提交，提交后再从磁盘删除不再被引用的文件
 
-    unique_filename = f"{uuid.uuid4().hex}_{filename}"
-    target_folder = get_safe_path(current_app.config['UPLOAD_FOLDER'], folder)
-    os.makedirs(target_folder, exist_ok=True)
+    内容寻址的文件引用计数减一，归零时删除记录；旧版随机命名的文件直接删除。先提交再删除文件，
+    避免事务回滚后记录仍引用已删除的文件。调用方应在自身的数据变更提交之后调用。
 
-    file_path = get_safe_path(target_folder, unique_filename)
-    file.save(file_path)
-    logger.info(f"File saved: {file_path}")
+    Args:
+        file_urls: 文件的URL路径
 
-    return f"/static/uploads/{folder}/{unique_filename}"
+    Returns:
+        int: 从磁盘删除的文件数
+
+    Raises:
+        ValueError: 当文件路径不安全时抛出
+    """
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    urls = [url for url in file_urls if url and url.startswith('/static/uploads/')]
+    for url in urls:
+        get_safe_path(upload_folder, url.replace('/static/uploads/', '', 1))  # 路径不安全时在修改前抛出
+    released = Counter(CONTENT_ADDRESSED_URL.match(url).group('digest') for url in urls
+                       if is_content_addressed_url(url))
+    legacy = [url.replace('/static/uploads/', '', 1) for url in urls if not is_content_addressed_url(url)]
+
+    orphaned = []
+    if released:
+        try:
+            for digest, count in released.items():
+                StoredFile.query.filter(StoredFile.sha256 == digest, StoredFile.ref_count > 0).update(
+                    {StoredFile.ref_count: case((StoredFile.ref_count > count, StoredFile.ref_count - count), else_=0)},
+                    synchronize_session=False
+                )
+            # 仅删除引用计数已归零的记录，其他商品仍在使用的文件保留
+            orphaned = db.session.query(StoredFile.sha256, StoredFile.path).filter(
+                StoredFile.sha256.in_(list(released)), StoredFile.ref_count == 0
+            ).all()
+            if orphaned:
+                StoredFile.query.filter(StoredFile.sha256.in_([digest for digest, _ in orphaned]),
+                                        StoredFile.ref_count == 0).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        logger.info(f"Released {sum(released.values())} file references, {len(orphaned)} orphaned")
+        # 提交后到删除前可能有相同内容被重新上传并登记
+        reused = {digest for (digest,) in db.session.query(StoredFile.sha256).filter(
+            StoredFile.sha256.in_([digest for digest, _ in orphaned])
+        ).all()} if orphaned else set()
+        orphaned = [path for digest, path in orphaned if digest not in reused]
+
+    removed = 0
+    for relative_path in orphaned + legacy:
+        file_path = get_safe_path(upload_folder, relative_path)
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                removed += 1
+                logger.info(f"File deleted: {file_path}")
+        except OSError as e:
+            logger.warning(f"Failed to delete file {file_path}: {str(e)}")
+    return removed
 
 
 def delete_file(file_url):
-    """删除文件
+    """删除文件（释放一次引用并提交，见 delete_files）
 
     Args:
         file_url: 文件的URL路径
 
     Returns:
-        bool: 是否删除成功
+        bool: 是否从磁盘删除了文件
 
     Raises:
         ValueError: 当文件路径不安全时抛出
     """
-    if not file_url or not file_url.startswith('/static/uploads/'):
-        return False
-
     try:
-        relative_path = file_url.replace('/static/uploads/', '', 1)
-        file_path = get_safe_path(current_app.config['UPLOAD_FOLDER'], relative_path)
-
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            logger.info(f"File deleted: {file_path}")
-            return True
-
-        return False
+        return delete_files([file_url]) > 0
     except ValueError as e:
         logger.error(f"File deletion failed: {str(e)}")
-        raise ValueError(f'文件删除失败：{str(e)}')
\ No newline at end of file
+        raise ValueError(f'文件删除失败：{str(e)}')
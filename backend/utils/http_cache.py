@@ -0,0 +1,194 @@
+from functools import wraps
+from flask import request, make_response, current_app
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Optional, Tuple
+import hashlib
+import time
+import redis
+import logging
+from .redis_client import get_redis_client
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'http_cache:gen:{}'
+
+
+def make_etag(*parts) -> str:
+    """根据版本信息生成ETag值
+
+    Args:
+        *parts: 参与计算的版本信息（如行更新时间、缓存代数、查询参数）
+
+    Returns:
+        str: ETag值（不含引号）
+    """
+    raw = '|'.join(str(part) for part in parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def get_generation(namespace: str) -> Tuple[Optional[int], Optional[datetime]]:
+    """获取缓存代数及其最后变更时间
+
+    代数键不存在时（如 Redis 被清空）以当前时间初始化，避免与旧的ETag碰撞。
+
+    Args:
+        namespace: 缓存命名空间，如 products、tags、comments:<商品ID>
+
+    Returns:
+        Tuple[Optional[int], Optional[datetime]]: (代数, 最后变更时间)，Redis 不可用时返回 (None, None)
+    """
+    key = GENERATION_KEY.format(namespace)
+    now = time.time()
+    try:
+        with get_redis_client().pipeline() as pipe:
+            pipe.hsetnx(key, 'v', int(now * 1000))
+            pipe.hsetnx(key, 'ts', now)
+            pipe.hmget(key, 'v', 'ts')
+            _, _, (version, changed_at) = pipe.execute()
+        return int(version), datetime.fromtimestamp(float(changed_at), tz=timezone.utc)
+    except (redis.RedisError, TypeError, ValueError) as e:
+        logger.warning(f"Failed to read cache generation {namespace}: {str(e)}")
+        return None, None
+
+
+def bump_generation(*namespaces: str):
+    """数据变更后递增缓存代数，使相关ETag与视图缓存失效
+
+    Args:
+        *namespaces: 缓存命名空间
+    """
+    now = time.time()
+    try:
+        with get_redis_client().pipeline() as pipe:
+            for namespace in namespaces:
+                key = GENERATION_KEY.format(namespace)
+                pipe.hincrby(key, 'v', 1)
+                pipe.hset(key, 'ts', now)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"Failed to bump cache generation {namespaces}: {str(e)}")
+
+
+def generation_cache_key(namespace: str) -> Callable:
+    """生成带缓存代数的视图缓存键函数，供 cache.cached(make_cache_key=...) 使用
+
+    代数变化后旧缓存自然失效，无需逐个删除。
+
+    Args:
+        namespace: 缓存命名空间
+
+    Returns:
+        Callable: 缓存键函数
+    """
+    def make_cache_key(*args, **kwargs):
+        version, _ = get_generation(namespace)
+        query = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+        return f'view:{request.path}:{version}:{query}'
+
+    return make_cache_key
+
+
+def generation_validator(namespace: str, include_query: bool = True) -> Callable:
+    """基于缓存代数的校验器，命中时无需访问数据库
+
+    Args:
+        namespace: 缓存命名空间，可以是接收视图参数并返回命名空间的函数
+        include_query: ETag是否包含查询参数
+
+    Returns:
+        Callable: 返回 (ETag, 最后修改时间) 的校验器
+    """
+    def validator(*args, **kwargs):
+        name = namespace(*args, **kwargs) if callable(namespace) else namespace
+        version, changed_at = get_generation(name)
+        if version is None:
+            return None, None
+        query = sorted(request.args.items(multi=True)) if include_query else ''
+        return make_etag(request.path, version, query), changed_at
+
+    return validator
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """将数据库中的UTC时间转换为带时区的时间，并去掉HTTP日期无法表示的微秒"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0)
+
+
+def latest(values: Iterable[Optional[datetime]]) -> Optional[datetime]:
+    """取多个更新时间中最新的一个
+
+    Args:
+        values: 更新时间列表
+
+    Returns:
+        Optional[datetime]: 最新的更新时间
+    """
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def _is_not_modified(etag: str, weak: bool, last_modified: Optional[datetime]) -> bool:
+    """判断条件请求是否命中（If-None-Match 优先于 If-Modified-Since）"""
+    if request.if_none_match:
+        if weak:
+            return request.if_none_match.contains_weak(etag)
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def conditional(validator: Callable, weak: bool = False, private: bool = False) -> Callable:
+    """为只读接口添加 ETag / Last-Modified 条件请求支持
+
+    校验器接收视图参数，返回 (ETag, 最后修改时间)；应只读取版本信息（行更新时间或缓存代数），
+    不做序列化。条件请求命中时直接返回 304，不执行视图函数。
+
+    Args:
+        validator: 返回 (ETag, 最后修改时间) 的函数，ETag 为 None 时跳过条件处理
+        weak: 是否使用弱ETag（响应中包含浏览量等不影响语义的易变字段时使用）
+        private: 响应内容随登录用户变化时使用，禁止共享缓存并按 Authorization 区分
+
+    Returns:
+        Callable: 装饰器
+    """
+    def decorator(f: Callable) -> Callable:
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return f(*args, **kwargs)
+
+            try:
+                etag, last_modified = validator(*args, **kwargs)
+            except Exception as e:
+                logger.warning(f"Conditional validator failed for {request.path}: {str(e)}")
+                etag, last_modified = None, None
+            if etag is None:
+                return f(*args, **kwargs)
+            last_modified = _as_utc(last_modified)
+
+            if _is_not_modified(etag, weak, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=weak)
+            if last_modified:
+                response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            if private:
+                response.cache_control.private = True
+                response.vary.add('Authorization')
+            return response
+
+        return decorated
+
+    return decorator
@@ -0,0 +1,242 @@
+from functools import wraps
+from flask import current_app, request, jsonify
+from ..models import db, IdempotencyKey
+from .redis_client import get_redis_client
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from typing import Callable, Optional
+import hashlib
+import json
+import time
+import uuid
+import redis
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+RESPONSE_KEY = 'idem:{}:{}:{}'  # 用户ID、端点、客户端键 -> {"hash", "status", "body", "mimetype"}
+LOCK_KEY = 'idem:lock:{}:{}:{}'
+RESPONSE_TTL = 86400
+LOCK_TTL = 30  # 大于请求的最长处理时间，持有者异常退出时锁自动释放
+WAIT_TIMEOUT = 3.0  # 并发的重复请求等待首个请求完成的时间，超时返回409
+WAIT_INTERVAL = 0.05
+MAX_KEY_LENGTH = 64
+
+# 锁的值为请求摘要加随机后缀，仍由自己持有时才删除（处理超过 LOCK_TTL 后锁可能已被重复请求获得）
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+def _error(message: str, status: int):
+    return jsonify({'success': False, 'message': message, 'data': None}), status
+
+
+def _fingerprint() -> str:
+    """请求方法、路径与请求体的摘要，同一个键用于不同请求时拒绝重放"""
+    hasher = hashlib.sha256(f'{request.method} {request.path}\n'.encode('utf-8'))
+    hasher.update(request.get_data())
+    return hasher.hexdigest()
+
+
+def _replay(record: dict, fingerprint: str):
+    if record['hash'] != fingerprint:
+        return _error('同一 Idempotency-Key 不能用于不同的请求', 422)
+    response = current_app.response_class(record['body'], status=record['status'], mimetype=record['mimetype'])
+    response.headers[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def _load_redis(key: str) -> Optional[dict]:
+    value = get_redis_client().get(key)
+    return json.loads(value) if value else None
+
+
+def _load_db(user_id: int, endpoint: str, client_key: str) -> Optional[dict]:
+    """读取数据库中未过期且已完成的记录"""
+    row = IdempotencyKey.query.filter(
+        IdempotencyKey.user_id == user_id,
+        IdempotencyKey.endpoint == endpoint,
+        IdempotencyKey.key == client_key,
+        IdempotencyKey.expires_at > datetime.utcnow(),
+        IdempotencyKey.status_code.isnot(None)
+    ).first()
+    if row is None:
+        return None
+    body = json.loads(row.response_body)
+    return {'hash': row.request_hash, 'status': row.status_code, 'body': body['body'], 'mimetype': body['mimetype']}
+
+
+def _claim_db(user_id: int, endpoint: str, client_key: str, fingerprint: str) -> bool:
+    """Redis 不可用时以数据库唯一约束加锁：插入处理中的记录，已存在且未过期时失败"""
+    now = datetime.utcnow()
+    try:
+        db.session.add(IdempotencyKey(user_id=user_id, endpoint=endpoint, key=client_key, request_hash=fingerprint,
+                                      expires_at=now + timedelta(seconds=RESPONSE_TTL)))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+    # 已过期的旧记录可以被接管
+    claimed = IdempotencyKey.query.filter(
+        IdempotencyKey.user_id == user_id,
+        IdempotencyKey.endpoint == endpoint,
+        IdempotencyKey.key == client_key,
+        IdempotencyKey.expires_at <= now
+    ).update({IdempotencyKey.request_hash: fingerprint, IdempotencyKey.status_code: None,
+              IdempotencyKey.response_body: None, IdempotencyKey.created_at: now,
+              IdempotencyKey.expires_at: now + timedelta(seconds=RESPONSE_TTL)}, synchronize_session=False)
+    db.session.commit()
+    return bool(claimed)
+
+
+def _save(user_id: int, endpoint: str, client_key: str, record: dict):
+    """保存响应：Redis 记录供重放，数据库记录在 Redis 丢失时兜底"""
+    try:
+        get_redis_client().setex(RESPONSE_KEY.format(user_id, endpoint, client_key), RESPONSE_TTL, json.dumps(record))
+    except redis.RedisError as e:
+        logger.warning(f"Failed to cache idempotent response {endpoint} {client_key}: {str(e)}")
+    try:
+        row = IdempotencyKey.query.filter_by(user_id=user_id, endpoint=endpoint, key=client_key).first()
+        if row is None:
+            row = IdempotencyKey(user_id=user_id, endpoint=endpoint, key=client_key)
+            db.session.add(row)
+        row.request_hash = record['hash']
+        row.status_code = record['status']
+        row.response_body = json.dumps({'body': record['body'], 'mimetype': record['mimetype']}, ensure_ascii=False)
+        row.expires_at = datetime.utcnow() + timedelta(seconds=RESPONSE_TTL)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Failed to persist idempotent response {endpoint} {client_key}: {str(e)}")
+
+
+def _unlock(lock_key: str, token: str):
+    get_redis_client().register_script(RELEASE_SCRIPT)(keys=[lock_key], args=[token])
+
+
+def _release(user_id: int, endpoint: str, client_key: str, token: str, locked_in_redis: bool):
+    """请求未完成（异常或5xx）时释放锁，允许客户端重试"""
+    try:
+        if locked_in_redis:
+            _unlock(LOCK_KEY.format(user_id, endpoint, client_key), token)
+        else:
+            IdempotencyKey.query.filter_by(user_id=user_id, endpoint=endpoint, key=client_key,
+                                           status_code=None).delete(synchronize_session=False)
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Failed to release idempotency lock {endpoint} {client_key}: {str(e)}")
+
+
+def _lock_redis(response_key: str, lock_key: str, fingerprint: str, token: str):
+    """获取 Redis 锁；等待期间首个请求完成时返回重放响应，等待超时返回409，获得锁时返回 None
+
+    Raises:
+        redis.RedisError: Redis 不可用（调用方改用数据库加锁）
+    """
+    redis_client = get_redis_client()
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while not redis_client.set(lock_key, token, nx=True, ex=LOCK_TTL):
+        if time.monotonic() >= deadline:
+            return _error('相同请求正在处理中，请稍后重试', 409)
+        time.sleep(WAIT_INTERVAL)
+        record = _load_redis(response_key)
+        if record:
+            return _replay(record, fingerprint)
+    # 获得锁前首个请求可能刚好完成并释放锁
+    record = _load_redis(response_key)
+    if record:
+        _unlock(lock_key, token)
+        return _replay(record, fingerprint)
+    return None
+
+
+def idempotent(f: Callable) -> Callable:
+    """幂等接口装饰器，放在 token_required 之后
+
+    请求带 Idempotency-Key 时：已完成的请求直接重放保存的响应（响应头 Idempotent-Replayed: true），
+    不再执行业务逻辑；处理中的重复请求等待首个请求完成，超时返回409；同一个键用于不同请求体返回422。
+    2xx 与 4xx 响应保存 RESPONSE_TTL 秒，5xx 与异常不保存，客户端可用同一个键重试。
+    不带请求头的请求照常执行。
+    """
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        client_key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not client_key:
+            return f(current_user, *args, **kwargs)
+        if len(client_key) > MAX_KEY_LENGTH:
+            return _error(f'{IDEMPOTENCY_HEADER} 长度不能超过{MAX_KEY_LENGTH}', 400)
+
+        user_id, endpoint, fingerprint = current_user.id, request.endpoint, _fingerprint()
+        token = f'{fingerprint}:{uuid.uuid4().hex}'
+        response_key = RESPONSE_KEY.format(user_id, endpoint, client_key)
+        try:
+            record = _load_redis(response_key)
+            redis_available = True
+        except redis.RedisError as e:
+            logger.warning(f"Idempotency store unavailable, falling back to database: {str(e)}")
+            record, redis_available = None, False
+        record = record or _load_db(user_id, endpoint, client_key)
+        if record:
+            return _replay(record, fingerprint)
+
+        if redis_available:
+            try:
+                result = _lock_redis(response_key, LOCK_KEY.format(user_id, endpoint, client_key), fingerprint, token)
+            except redis.RedisError as e:
+                logger.warning(f"Idempotency store failed while locking, falling back to database: {str(e)}")
+                redis_available, result = False, None
+            if result is not None:
+                return result
+        if not redis_available and not _claim_db(user_id, endpoint, client_key, fingerprint):
+            record = _load_db(user_id, endpoint, client_key)
+            return _replay(record, fingerprint) if record else _error('相同请求正在处理中，请稍后重试', 409)
+
+        try:
+            response = current_app.make_response(f(current_user, *args, **kwargs))
+        except Exception:
+            _release(user_id, endpoint, client_key, token, redis_available)
+            raise
+        if response.status_code >= 500:
+            _release(user_id, endpoint, client_key, token, redis_available)
+            return response
+
+        _save(user_id, endpoint, client_key, {'hash': fingerprint, 'status': response.status_code,
+                                              'body': response.get_data(as_text=True), 'mimetype': response.mimetype})
+        if redis_available:
+            try:
+                _unlock(LOCK_KEY.format(user_id, endpoint, client_key), token)
+            except redis.RedisError as e:
+                logger.warning(f"Failed to release idempotency lock {endpoint} {client_key}: {str(e)}")
+        return response
+
+    return decorated
+
+
+def purge_expired_keys(batch_size: int = 1000) -> int:
+    """删除过期的幂等记录（由任务工作进程周期执行）
+
+    Args:
+        batch_size: 每批删除的记录数
+
+    Returns:
+        int: 删除的记录数
+    """
+    deleted = 0
+    while True:
+        ids = [row.id for row in db.session.query(IdempotencyKey.id).filter(
+            IdempotencyKey.expires_at <= datetime.utcnow()
+        ).limit(batch_size).all()]
+        if not ids:
+            break
+        IdempotencyKey.query.filter(IdempotencyKey.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+    logger.info(f"Purged {deleted} expired idempotency keys")
+    return deleted
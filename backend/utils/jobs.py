@@ -0,0 +1,556 @@
+from flask import current_app
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from .redis_client import get_redis_client
+import heapq
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+import redis
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'jobs:queue:{}'
+DELAYED_KEY = 'jobs:delayed'
+DEAD_KEY = 'jobs:dead'
+STATS_KEY = 'jobs:stats:{}'
+SCHEDULE_KEY = 'jobs:schedule'
+LEADER_KEY = 'jobs:leader'
+PENDING_KEY = 'jobs:pending:{}'  # 周期任务已入队、尚未执行结束的标记
+DEFAULT_QUEUE = 'default'
+LEADER_TTL = 30
+DEAD_LETTER_LIMIT = 1000
+PENDING_TTL = 600  # 执行进程崩溃导致标记未清除时，周期任务在此时间后恢复调度
+
+
+@dataclass
+class JobSpec:
+    func: Callable
+    max_retries: int = 3
+    backoff: float = 5.0
+    queue: str = DEFAULT_QUEUE
+
+
+@dataclass
+class PeriodicSpec:
+    job_name: str
+    every: Optional[float] = None
+    cron: Optional['CronSchedule'] = None
+
+    def next_run(self, after: float) -> float:
+        if self.cron is not None:
+            return self.cron.next_after(datetime.fromtimestamp(after)).timestamp()
+        return after + self.every
+
+
+_jobs: Dict[str, JobSpec] = {}
+_periodic: Dict[str, PeriodicSpec] = {}
+
+
+class CronSchedule:
+    """五段式 cron 表达式（分 时 日 月 周），支持 *、*/n、a-b、a-b/n 与逗号列表；周日为0"""
+
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'cron 表达式必须包含5段: {expression}')
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.RANGES)
+        )
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int) -> set:
+        values = set()
+        for part in field.split(','):
+            body, _, step = part.partition('/')
+            if body == '*':
+                start, end = low, high
+            elif '-' in body:
+                start, end = (int(v) for v in body.split('-'))
+            else:
+                start = end = int(body)
+            if start < low or end > high or start > end:
+                raise ValueError(f'cron 字段超出范围: {field}')
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday  # 与标准 cron 一致：日与周都指定时满足其一即可
+
+    def next_after(self, moment: datetime) -> datetime:
+        """计算严格晚于给定时间的下一次触发时间（本地时间）"""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 4)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f'cron 表达式没有可触发的时间: {self.expression}')
+
+
+def job(name: Optional[str] = None, max_retries: int = 3, backoff: float = 5.0, queue: str = DEFAULT_QUEUE):
+    """注册后台任务
+
+    Args:
+        name: 任务名称，默认为函数名
+        max_retries: 失败后最多重试次数
+        backoff: 首次重试延迟（秒），之后按指数增长
+        queue: 队列名称
+
+    Returns:
+        Callable: 装饰器
+    """
+    def decorator(func: Callable) -> Callable:
+        _jobs[name or func.__name__] = JobSpec(func, max_retries, backoff, queue)
+        return func
+    return decorator
+
+
+def periodic_job(name: Optional[str] = None, every: Optional[float] = None, cron: Optional[str] = None, **options):
+    """注册周期任务（由调度主节点按时入队，集群内每次只执行一次）
+
+    Args:
+        name: 任务名称，默认为函数名
+        every: 执行间隔（秒）
+        cron: cron 表达式，与 every 二选一
+        **options: 传给 job 的重试与队列参数
+
+    Returns:
+        Callable: 装饰器
+    """
+    if (every is None) == (cron is None):
+        raise ValueError('every 与 cron 必须且只能指定一个')
+
+    def decorator(func: Callable) -> Callable:
+        job_name = name or func.__name__
+        job(job_name, **options)(func)
+        _periodic[job_name] = PeriodicSpec(job_name, every, CronSchedule(cron) if cron else None)
+        return func
+    return decorator
+
+
+def registered_jobs() -> Dict[str, JobSpec]:
+    return dict(_jobs)
+
+
+def periodic_jobs() -> Dict[str, PeriodicSpec]:
+    return dict(_periodic)
+
+
+class RedisJobBackend:
+    """基于 Redis 的任务存储：队列为列表，延迟任务为按执行时间排序的有序集合"""
+
+    # 原子地将到期的延迟任务移入各自队列，多个工作进程同时调用也不会重复
+    PROMOTE_SCRIPT = """
+    local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+    for _, payload in ipairs(due) do
+        if redis.call('ZREM', KEYS[1], payload) == 1 then
+            local queue = cjson.decode(payload)['queue']
+            redis.call('LPUSH', ARGV[3] .. queue, payload)
+        end
+    end
+    return #due
+    """
+    MAX_SCRIPT = """
+    local current = tonumber(redis.call('HGET', KEYS[1], 'max_ms') or '0')
+    if tonumber(ARGV[1]) > current then redis.call('HSET', KEYS[1], 'max_ms', ARGV[1]) end
+    """
+    LEADER_SCRIPT = """
+    if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then return 1 end
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._promote = client.register_script(self.PROMOTE_SCRIPT)
+        self._max = client.register_script(self.MAX_SCRIPT)
+        self._leader = client.register_script(self.LEADER_SCRIPT)
+
+    def push(self, queue: str, payload: str):
+        self.client.lpush(QUEUE_KEY.format(queue), payload)
+
+    def pop(self, queues: List[str], timeout: float) -> Optional[str]:
+        result = self.client.brpop([QUEUE_KEY.format(q) for q in queues], timeout=max(1, int(timeout)))
+        return result[1].decode() if result else None
+
+    def schedule(self, payload: str, run_at: float):
+        self.client.zadd(DELAYED_KEY, {payload: run_at})
+
+    def promote_due(self, now: float, limit: int = 500) -> int:
+        return self._promote(keys=[DELAYED_KEY], args=[now, limit, QUEUE_KEY.format('')])
+
+    def dead_letter(self, payload: str):
+        with self.client.pipeline() as pipe:
+            pipe.lpush(DEAD_KEY, payload)
+            pipe.ltrim(DEAD_KEY, 0, DEAD_LETTER_LIMIT - 1)
+            pipe.execute()
+
+    def record(self, name: str, elapsed_ms: float, outcome: str):
+        key = STATS_KEY.format(name)
+        with self.client.pipeline() as pipe:
+            pipe.hincrby(key, outcome, 1)
+            pipe.hincrbyfloat(key, 'total_ms', elapsed_ms)
+            pipe.hset(key, mapping={'last_ms': round(elapsed_ms, 2), 'last_run_at': time.time(),
+                                    'last_outcome': outcome})
+            pipe.execute()
+        self._max(keys=[key], args=[round(elapsed_ms, 2)])
+
+    def stats(self, name: str) -> Dict[str, str]:
+        return {k.decode(): v.decode() for k, v in self.client.hgetall(STATS_KEY.format(name)).items()}
+
+    def acquire_leader(self, node_id: str, ttl: int) -> bool:
+        return bool(self._leader(keys=[LEADER_KEY], args=[node_id, ttl]))
+
+    def release_leader(self, node_id: str):
+        if self.client.get(LEADER_KEY) == node_id.encode():
+            self.client.delete(LEADER_KEY)
+
+    def next_runs(self) -> Dict[str, float]:
+        return {k.decode(): float(v) for k, v in self.client.hgetall(SCHEDULE_KEY).items()}
+
+    def set_next_run(self, name: str, run_at: float):
+        self.client.hset(SCHEDULE_KEY, name, run_at)
+
+    def queue_length(self, queue: str) -> int:
+        return self.client.llen(QUEUE_KEY.format(queue))
+
+    def mark_pending(self, name: str, ttl: int) -> bool:
+        return bool(self.client.set(PENDING_KEY.format(name), time.time(), nx=True, ex=ttl))
+
+    def clear_pending(self, name: str):
+        self.client.delete(PENDING_KEY.format(name))
+
+
+class MemoryJobBackend:
+    """进程内任务存储，接口与 RedisJobBackend 相同，用于测试和单进程开发环境"""
+
+    def __init__(self):
+        self._queues: Dict[str, List[str]] = {}
+        self._delayed: List[tuple] = []
+        self._dead: List[str] = []
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._schedule: Dict[str, float] = {}
+        self._leader: Optional[tuple] = None
+        self._pending: Dict[str, float] = {}
+        self._condition = threading.Condition()
+
+    def push(self, queue: str, payload: str):
+        with self._condition:
+            self._queues.setdefault(queue, []).insert(0, payload)
+            self._condition.notify()
+
+    def pop(self, queues: List[str], timeout: float) -> Optional[str]:
+        deadline = time.time() + timeout
+        with self._condition:
+            while True:
+                for queue in queues:
+                    if self._queues.get(queue):
+                        return self._queues[queue].pop()
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def schedule(self, payload: str, run_at: float):
+        with self._condition:
+            heapq.heappush(self._delayed, (run_at, payload))
+
+    def promote_due(self, now: float, limit: int = 500) -> int:
+        promoted = 0
+        with self._condition:
+            while self._delayed and self._delayed[0][0] <= now and promoted < limit:
+                _, payload = heapq.heappop(self._delayed)
+                self._queues.setdefault(json.loads(payload)['queue'], []).insert(0, payload)
+                promoted += 1
+            if promoted:
+                self._condition.notify_all()
+        return promoted
+
+    def dead_letter(self, payload: str):
+        with self._condition:
+            self._dead.insert(0, payload)
+            del self._dead[DEAD_LETTER_LIMIT:]
+
+    def record(self, name: str, elapsed_ms: float, outcome: str):
+        with self._condition:
+            stats = self._stats.setdefault(name, {})
+            stats[outcome] = stats.get(outcome, 0) + 1
+            stats['total_ms'] = stats.get('total_ms', 0) + elapsed_ms
+            stats['max_ms'] = max(stats.get('max_ms', 0), round(elapsed_ms, 2))
+            stats.update(last_ms=round(elapsed_ms, 2), last_run_at=time.time(), last_outcome=outcome)
+
+    def stats(self, name: str) -> Dict[str, str]:
+        with self._condition:
+            return {k: str(v) for k, v in self._stats.get(name, {}).items()}
+
+    def acquire_leader(self, node_id: str, ttl: int) -> bool:
+        with self._condition:
+            now = time.time()
+            if self._leader is None or self._leader[0] == node_id or self._leader[1] < now:
+                self._leader = (node_id, now + ttl)
+                return True
+            return False
+
+    def release_leader(self, node_id: str):
+        with self._condition:
+            if self._leader and self._leader[0] == node_id:
+                self._leader = None
+
+    def next_runs(self) -> Dict[str, float]:
+        with self._condition:
+            return dict(self._schedule)
+
+    def set_next_run(self, name: str, run_at: float):
+        with self._condition:
+            self._schedule[name] = run_at
+
+    def queue_length(self, queue: str) -> int:
+        with self._condition:
+            return len(self._queues.get(queue, []))
+
+    def mark_pending(self, name: str, ttl: int) -> bool:
+        with self._condition:
+            now = time.time()
+            if self._pending.get(name, 0) > now:
+                return False
+            self._pending[name] = now + ttl
+            return True
+
+    def clear_pending(self, name: str):
+        with self._condition:
+            self._pending.pop(name, None)
+
+
+def get_job_backend():
+    """获取当前应用的任务存储（JOBS_BACKEND = 'redis' 或 'memory'），每个应用只创建一次"""
+    backend = current_app.extensions.get('job_backend')
+    if backend is None:
+        if current_app.config.get('JOBS_BACKEND', 'redis') == 'memory':
+            backend = MemoryJobBackend()
+        else:
+            backend = RedisJobBackend(get_redis_client())
+        current_app.extensions['job_backend'] = backend
+    return backend
+
+
+def enqueue(name: str, *args, delay: float = 0, **kwargs) -> str:
+    """将任务加入队列
+
+    Args:
+        name: 已注册的任务名称
+        *args: 任务位置参数（需可JSON序列化）
+        delay: 延迟执行的秒数
+        **kwargs: 任务关键字参数（需可JSON序列化）
+
+    Returns:
+        str: 任务ID
+
+    Raises:
+        KeyError: 任务未注册
+    """
+    spec = _jobs[name]
+    job_id = uuid.uuid4().hex
+    payload = json.dumps({'id': job_id, 'name': name, 'args': list(args), 'kwargs': kwargs, 'queue': spec.queue,
+                          'attempt': 0, 'enqueued_at': time.time()})
+    backend = get_job_backend()
+    if delay > 0:
+        backend.schedule(payload, time.time() + delay)
+    else:
+        backend.push(spec.queue, payload)
+    return job_id
+
+
+def job_stats() -> Dict[str, dict]:
+    """汇总所有已注册任务的执行统计
+
+    Returns:
+        Dict[str, dict]: 任务名称到统计（成功/重试/失败次数、平均/最近/最大耗时）的映射
+    """
+    backend = get_job_backend()
+    result = {}
+    for name, spec in _jobs.items():
+        raw = backend.stats(name)
+        runs = sum(int(float(raw.get(outcome, 0))) for outcome in ('succeeded', 'retried', 'failed'))
+        result[name] = {
+            'queue': spec.queue,
+            'periodic': name in _periodic,
+            'succeeded': int(float(raw.get('succeeded', 0))),
+            'retried': int(float(raw.get('retried', 0))),
+            'failed': int(float(raw.get('failed', 0))),
+            'avg_ms': round(float(raw.get('total_ms', 0)) / runs, 2) if runs else 0,
+            'last_ms': float(raw.get('last_ms', 0)),
+            'max_ms': float(raw.get('max_ms', 0)),
+            'last_run_at': float(raw['last_run_at']) if 'last_run_at' in raw else None,
+            'last_outcome': raw.get('last_outcome')
+        }
+    return result
+
+
+class Worker:
+    """任务工作进程：多个线程从队列取任务执行，失败按指数退避重试；可同时担任周期任务调度器
+
+    调度器通过 Redis 租约选主，只有主节点为周期任务入队，因此多节点部署时每个周期任务只执行一次。
+    """
+
+    def __init__(self, app, queues: Optional[List[str]] = None, concurrency: int = 2, scheduler: bool = True,
+                 poll_interval: float = 1.0):
+        self.app = app
+        self.queues = queues or [DEFAULT_QUEUE]
+        self.concurrency = concurrency
+        self.scheduler = scheduler
+        self.poll_interval = poll_interval
+        self.node_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.is_leader = False
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        with app.app_context():
+            self.backend = get_job_backend()
+
+    def start(self):
+        """启动执行线程与调度线程（非阻塞）"""
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._work_loop, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._schedule_loop, name='job-scheduler', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        logger.info(f"Worker {self.node_id} started: queues={self.queues} concurrency={self.concurrency} "
+                    f"scheduler={self.scheduler}")
+
+    def run(self):
+        """启动并阻塞直到收到中断信号"""
+        self.start()
+        try:
+            while not self._stopping.is_set():
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self, timeout: float = 10):
+        """停止取新任务，等待正在执行的任务结束并释放主节点租约"""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        if self.is_leader:
+            try:
+                self.backend.release_leader(self.node_id)
+            except redis.RedisError:
+                pass
+        logger.info(f"Worker {self.node_id} stopped")
+
+    def _work_loop(self):
+        while not self._stopping.is_set():
+            try:
+                payload = self.backend.pop(self.queues, self.poll_interval)
+            except redis.RedisError as e:
+                logger.error(f"Failed to fetch job: {str(e)}")
+                time.sleep(self.poll_interval)
+                continue
+            if payload:
+                try:
+                    self.execute(payload)
+                except Exception as e:
+                    # 重新排期、死信写入失败或载荷无法解析时不能让执行线程退出
+                    logger.exception(f"Failed to process job payload: {str(e)}")
+
+    def execute(self, payload: str):
+        """执行一个任务并记录耗时；失败时按指数退避重新排期，超过重试次数后进入死信列表"""
+        data = json.loads(payload)
+        spec = _jobs.get(data['name'])
+        if spec is None:
+            logger.error(f"Unknown job {data['name']}, moving to dead letter")
+            self.backend.dead_letter(payload)
+            return
+
+        start = time.perf_counter()
+        try:
+            with self.app.app_context():
+                spec.func(*data['args'], **data['kwargs'])
+            outcome = 'succeeded'
+        except Exception as e:
+            attempt = data['attempt'] + 1
+            data.update(attempt=attempt, last_error=str(e))
+            if attempt <= spec.max_retries:
+                delay = spec.backoff * 2 ** (attempt - 1) * random.uniform(0.8, 1.2)
+                self.backend.schedule(json.dumps(data), time.time() + delay)
+                outcome = 'retried'
+                logger.warning(f"Job {data['name']} failed (attempt {attempt}), retrying in {delay:.1f}s: {str(e)}")
+            else:
+                self.backend.dead_letter(json.dumps(data))
+                outcome = 'failed'
+                logger.error(f"Job {data['name']} failed after {attempt} attempts: {str(e)}")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        try:
+            self.backend.record(data['name'], elapsed_ms, outcome)
+            if outcome != 'retried' and data['name'] in _periodic:
+                self.backend.clear_pending(data['name'])
+        except redis.RedisError as e:
+            logger.warning(f"Failed to record stats for job {data['name']}: {str(e)}")
+
+    def tick(self, now: Optional[float] = None):
+        """调度一次：移动到期的延迟任务；主节点为到期的周期任务入队并计算下次时间
+
+        上一次入队的周期任务仍在排队、执行或等待重试时跳过本次，避免工作进程繁忙时同一任务堆积。
+        """
+        now = now or time.time()
+        self.backend.promote_due(now)
+        if not self.scheduler:
+            return
+        self.is_leader = self.backend.acquire_leader(self.node_id, LEADER_TTL)
+        if not self.is_leader:
+            return
+        next_runs = self.backend.next_runs()
+        for name, spec in _periodic.items():
+            next_run = next_runs.get(name)
+            if next_run is None:
+                # 首次部署：间隔任务立即执行一次，cron 任务等到下一个触发点
+                next_run = now if spec.every is not None else spec.next_run(now)
+                self.backend.set_next_run(name, next_run)
+            if next_run <= now:
+                if self.backend.mark_pending(name, PENDING_TTL):
+                    with self.app.app_context():
+                        enqueue(name)
+                    logger.info(f"Scheduled periodic job {name}")
+                else:
+                    logger.info(f"Periodic job {name} still pending, skipped this run")
+                self.backend.set_next_run(name, spec.next_run(now))
+
+    def _schedule_loop(self):
+        while not self._stopping.is_set():
+            try:
+                self.tick()
+            except redis.RedisError as e:
+                self.is_leader = False
+                logger.error(f"Scheduler tick failed: {str(e)}")
+            self._stopping.wait(self.poll_interval)
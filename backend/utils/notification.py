@@ -1,6 +1,8 @@
-from flask import current_app
 from ..models import db, Message
+from .redis_client import get_redis_client
 from datetime import datetime
+from sqlalchemy import insert
+from typing import Iterable, Tuple
 import redis
 import logging
 
@@ -8,11 +10,8 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# 初始化Redis连接池
-redis_pool = redis.ConnectionPool.from_url(
-    current_app.config.get('REDIS_URL', 'redis://localhost:6379/0')
-)
-redis_client = redis.Redis(connection_pool=redis_pool)
+UNREAD_KEY = 'unread_messages:{}'
+MESSAGE_TYPES = {'system': '系统', 'trade': '交易'}
 
 
 def send_system_message(user_id, title, content, message_type='system'):
@@ -29,18 +28,15 @@ def send_system_message(user_id, title, content, message_type='system'):
     """
     message = Message(
         user_id=user_id,
-        title=title,
-        content=content,
-        type=message_type,
-        create_time=datetime.utcnow()
+        content=f'【{title}】{content}',
+        type=MESSAGE_TYPES.get(message_type, message_type)
     )
 
     try:
         db.session.add(message)
         db.session.commit()
 
-        unread_key = f'unread_messages:{user_id}'
-        redis_client.incr(unread_key)
+        get_redis_client().incr(UNREAD_KEY.format(user_id))
         logger.info(f"System message sent to user {user_id}: {title}")
         return message
     except Exception as e:
@@ -63,19 +59,15 @@ def send_trade_message(user_id, title, content, order_id=None):
     """
     message = Message(
         user_id=user_id,
-        title=title,
-        content=content,
-        type='trade',
-        order_id=order_id,
-        create_time=datetime.utcnow()
+        content=f'【{title}】{content}',
+        type='交易'
     )
 
     try:
         db.session.add(message)
         db.session.commit()
 
-        unread_key = f'unread_messages:{user_id}'
-        redis_client.incr(unread_key)
+        get_redis_client().incr(UNREAD_KEY.format(user_id))
         logger.info(f"Trade message sent to user {user_id}: {title}")
         return message
     except Exception as e:
@@ -93,7 +85,8 @@ def get_unread_count(user_id):
     Returns:
         int: 未读消息数量
     """
-    unread_key = f'unread_messages:{user_id}'
+    unread_key = UNREAD_KEY.format(user_id)
+    redis_client = get_redis_client()
     count = redis_client.get(unread_key)
 
     if count is None:
@@ -112,9 +105,45 @@ def reset_unread_count(user_id):
     Args:
         user_id: 用户ID
     """
-    unread_key = f'unread_messages:{user_id}'
+    unread_key = UNREAD_KEY.format(user_id)
     try:
-        redis_client.delete(unread_key)
+        get_redis_client().delete(unread_key)
         logger.info(f"Reset unread count for user {user_id}")
     except redis.RedisError as e:
-        logger.error(f"Failed to reset unread count for user {user_id}: {str(e)}")
\ No newline at end of file
+        logger.error(f"Failed to reset unread count for user {user_id}: {str(e)}")
+
+
+def send_trade_messages(messages: Iterable[Tuple[int, str, str]]) -> int:
+    """批量发送交易消息：一条多行 INSERT，一次 pipeline 更新未读计数
+
+    Args:
+        messages: (用户ID, 标题, 内容) 列表
+
+    Returns:
+        int: 发送的消息数
+    """
+    now = datetime.utcnow()
+    rows = [{'user_id': user_id, 'content': f'【{title}】{content}', 'type': '交易', 'is_read': False,
+             'created_at': now, 'updated_at': now} for user_id, title, content in messages]
+    if not rows:
+        return 0
+    try:
+        db.session.execute(insert(Message), rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Failed to send {len(rows)} trade messages: {str(e)}")
+        raise
+
+    unread = {}
+    for row in rows:
+        unread[row['user_id']] = unread.get(row['user_id'], 0) + 1
+    try:
+        with get_redis_client().pipeline(transaction=False) as pipe:
+            for user_id, count in unread.items():
+                pipe.incrby(UNREAD_KEY.format(user_id), count)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to update unread counts: {str(e)}")
+    logger.info(f"Sent {len(rows)} trade messages to {len(unread)} users")
+    return len(rows)
@@ -0,0 +1,127 @@
+from flask import current_app
+from typing import Callable, Optional
+import threading
+import time
+import uuid
+import redis
+import logging
+from .redis_client import get_redis_client
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+META_KEY = '{}:meta'
+LOCK_KEY = '{}:rebuild_lock'
+LOCK_TIMEOUT = 3600
+
+# 锁仍由本次执行持有时才删除；执行超过 LOCK_TIMEOUT 后锁可能已被下一个执行者获得
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+def mark_built(name: str, size: int, pipe=None):
+    """记录离线任务的完成时间与数据量
+
+    Args:
+        name: 任务名称，如 similar、recommend
+        size: 本次处理的数据量
+        pipe: 可选的 Redis pipeline，与结果写入一起提交
+    """
+    (pipe or get_redis_client()).hset(META_KEY.format(name), mapping={'built_at': time.time(), 'size': size})
+
+
+def built_at(name: str) -> Optional[float]:
+    """读取离线任务上次完成的时间戳，从未运行过时返回 None"""
+    value = get_redis_client().hget(META_KEY.format(name), 'built_at')
+    return float(value) if value else None
+
+
+def _acquire(lock_key: str, timeout: int) -> Optional[str]:
+    """获取锁，成功时返回释放锁所需的令牌"""
+    token = uuid.uuid4().hex
+    return token if get_redis_client().set(lock_key, token, nx=True, ex=timeout) else None
+
+
+def _release(name: str, lock_key: str, token: str):
+    try:
+        if not get_redis_client().register_script(RELEASE_SCRIPT)(keys=[lock_key], args=[token]):
+            logger.warning(f"Offline job {name} outlived its lock, left the current holder's lock in place")
+    except redis.RedisError:
+        pass
+
+
+def _run_in_background(app, name: str, job: Callable, lock_key: str, token: str):
+    with app.app_context():
+        try:
+            job()
+        except Exception as e:
+            logger.error(f"Offline job {name} failed: {str(e)}")
+        finally:
+            _release(name, lock_key, token)
+
+
+def start_locked(name: str, job: Callable, lock_key: str, timeout: int = LOCK_TIMEOUT) -> bool:
+    """获取 Redis 锁后在后台线程执行任务，任务结束后释放锁；锁已被占用时不执行
+
+    Args:
+        name: 任务名称（用于日志和线程名）
+        job: 无参数的任务函数，在应用上下文中执行
+        lock_key: 锁的键名
+        timeout: 锁的过期时间（秒），防止进程崩溃后锁无法释放
+
+    Returns:
+        bool: 是否启动了任务
+    """
+    token = _acquire(lock_key, timeout)
+    if token is None:
+        return False
+    threading.Thread(target=_run_in_background,
+                     args=(current_app._get_current_object(), name, job, lock_key, token),
+                     name=f'{name}-job', daemon=True).start()
+    return True
+
+
+def run_locked(name: str, job: Callable, timeout: int = LOCK_TIMEOUT) -> bool:
+    """在当前线程中持有与 schedule_if_stale 相同的锁执行离线任务（供任务工作进程调用）
+
+    Args:
+        name: 任务名称
+        job: 无参数的任务函数
+        timeout: 锁的过期时间（秒）
+
+    Returns:
+        bool: 是否执行了任务；其他进程正在执行时返回 False
+    """
+    lock_key = LOCK_KEY.format(name)
+    token = _acquire(lock_key, timeout)
+    if token is None:
+        logger.info(f"Offline job {name} is already running, skipped")
+        return False
+    try:
+        job()
+    finally:
+        _release(name, lock_key, token)
+    return True
+
+
+def schedule_if_stale(name: str, job: Callable, interval: float) -> bool:
+    """结果过期时在后台线程执行离线任务（通过 Redis 锁保证只有一个进程执行）
+
+    正常情况下由任务工作进程（backend.tasks）按周期重建；未部署工作进程或其停止运行导致结果过期时，
+    由读请求顺带触发作为兜底；任务执行期间继续使用旧结果。
+
+    Args:
+        name: 任务名称
+        job: 无参数的任务函数，在应用上下文中执行
+        interval: 结果有效期（秒）
+
+    Returns:
+        bool: 是否启动了新的任务
+    """
+    last_built = built_at(name)
+    if last_built and time.time() - last_built < interval:
+        return False
+    return start_locked(name, job, LOCK_KEY.format(name))
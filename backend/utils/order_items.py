@@ -0,0 +1,70 @@
+from ..models import db, Order, OrderItem, Product
+import json
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def parse_products_info(products_info: str) -> list:
+    """解析旧订单的商品信息JSON
+
+    Args:
+        products_info: 订单的商品信息JSON
+
+    Returns:
+        list: 包含 product_id、quantity、price 的字典列表，解析失败时为空
+    """
+    try:
+        products = json.loads(products_info or '[]')
+        return [item for item in products if all(k in item for k in ('product_id', 'quantity', 'price'))]
+    except (json.JSONDecodeError, TypeError) as e:
+        logger.warning(f"Failed to parse order products: {str(e)}")
+        return []
+
+
+def backfill_order_items(batch_size: int = 1000) -> int:
+    """将尚无订单明细的旧订单的JSON商品信息回填到 order_items 表
+
+    按订单ID分批处理并逐批提交，可重复执行（已有明细的订单会被跳过）。
+
+    Args:
+        batch_size: 每批订单数
+
+    Returns:
+        int: 写入的订单明细数量
+    """
+    written = 0
+    last_id = 0
+    while True:
+        orders = db.session.query(Order.id, Order.products_info).outerjoin(
+            OrderItem, OrderItem.order_id == Order.id
+        ).filter(
+            Order.id > last_id,
+            OrderItem.id == None
+        ).order_by(Order.id).limit(batch_size).all()
+        if not orders:
+            break
+
+        parsed = [(order_id, parse_products_info(products_info)) for order_id, products_info in orders]
+        product_ids = {int(item['product_id']) for _, products in parsed for item in products}
+        sellers = dict(db.session.query(Product.id, Product.seller_id).filter(
+            Product.id.in_(product_ids)
+        ).all()) if product_ids else {}
+
+        try:
+            for order_id, products in parsed:
+                for item in Order.build_items(products, sellers):
+                    item.order_id = order_id
+                    db.session.add(item)
+                    written += 1
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to backfill order items after order {last_id}: {str(e)}")
+            raise
+        last_id = orders[-1][0]
+        logger.info(f"Backfilled order items up to order {last_id} ({written} items)")
+
+    return written
@@ -0,0 +1,171 @@
+from flask import current_app
+from .redis_client import get_redis_client
+from datetime import datetime, timezone
+from typing import Optional
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+import redis
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 雪花ID：41位毫秒时间戳 | 10位节点ID | 12位序号，单节点每毫秒最多4096个
+EPOCH_MS = 1704067200000  # 2024-01-01 UTC
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+NODE_LEASE_KEY = 'order_no:node:{}'  # 节点ID -> 持有者标识
+NODE_LEASE_TTL = 60  # 租约在 TTL/3 后的下一次生成时续期
+
+# 从随机位置开始依次尝试租用空闲节点ID，一次往返完成；全部被占用时返回 -1
+# KEYS 不固定（键由ARGV拼出），仅用于单实例 Redis
+ACQUIRE_SCRIPT = """
+local size = tonumber(ARGV[4])
+for i = 0, size - 1 do
+    local node = (tonumber(ARGV[3]) + i) % size
+    if redis.call('SET', ARGV[1] .. node, ARGV[2], 'NX', 'EX', ARGV[5]) then return node end
+end
+return -1
+"""
+
+# 仍持有租约时续期，租约已过期但节点ID空闲时重新占用；被其他进程占用时返回 0
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then return 1 end
+return 0
+"""
+
+
+class SnowflakeGenerator:
+    """线程安全的雪花ID生成器，不访问数据库或 Redis
+
+    同一毫秒内序号用尽时等待下一毫秒；系统时钟回拨时沿用上次的时间戳继续递增，保证单调。
+    """
+
+    def __init__(self, node_id: int):
+        if not 0 <= node_id <= MAX_NODE_ID:
+            raise ValueError(f'节点ID必须在0-{MAX_NODE_ID}之间')
+        self.node_id = node_id
+        self._node_bits = node_id << SEQUENCE_BITS
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        """生成下一个ID"""
+        with self._lock:
+            now = time.time_ns() // 1000000
+            if now > self._last_ms:
+                self._last_ms = now
+                self._sequence = 0
+            else:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    while now <= self._last_ms:
+                        now = time.time_ns() // 1000000
+                    self._last_ms = now
+            return ((self._last_ms - EPOCH_MS) << (NODE_BITS + SEQUENCE_BITS)) | self._node_bits | self._sequence
+
+
+DAY_MS = 86400000
+_day_prefix = (0, '')  # (当天起始毫秒, 日期前缀)，避免每次格式化日期
+
+
+def format_order_no(snowflake_id: int) -> str:
+    """雪花ID转换为订单号：UTC日期（8位）+ 补齐到19位的ID，共27位，字典序与生成顺序一致
+
+    Args:
+        snowflake_id: 雪花ID
+
+    Returns:
+        str: 订单号
+    """
+    global _day_prefix
+    timestamp = (snowflake_id >> (NODE_BITS + SEQUENCE_BITS)) + EPOCH_MS
+    day_start, prefix = _day_prefix
+    if not day_start <= timestamp < day_start + DAY_MS:
+        day_start = timestamp - timestamp % DAY_MS
+        prefix = datetime.fromtimestamp(day_start / 1000, timezone.utc).strftime('%Y%m%d')
+        _day_prefix = (day_start, prefix)
+    return f'{prefix}{snowflake_id:019d}'
+
+
+class _NodeLease:
+    """进程持有的节点ID：配置固定值，或从 Redis 租用并定期续期"""
+
+    def __init__(self, node_id: Optional[int]):
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.pid = os.getpid()
+        self.fixed = node_id is not None
+        self.generator = SnowflakeGenerator(node_id if self.fixed else self._acquire())
+        self.renew_at = time.monotonic() + NODE_LEASE_TTL / 3
+
+    def _acquire(self) -> int:
+        try:
+            node_id = get_redis_client().register_script(ACQUIRE_SCRIPT)(
+                args=[NODE_LEASE_KEY.format(''), self.owner, random.randint(0, MAX_NODE_ID), MAX_NODE_ID + 1,
+                      NODE_LEASE_TTL]
+            )
+        except redis.RedisError as e:
+            node_id = -1
+            logger.error(f"Failed to lease order number node id: {str(e)}")
+        if node_id < 0:
+            # Redis 不可用或节点ID耗尽：按主机与进程派生，存在极小的重复概率，请配置 ORDER_NODE_ID
+            node_id = hash((socket.gethostname(), os.getpid())) % (MAX_NODE_ID + 1)
+            logger.warning(f"Falling back to derived order number node id {node_id}")
+        else:
+            logger.info(f"Leased order number node id {node_id}")
+        return node_id
+
+    def renew(self):
+        """续期租约；节点ID已被其他进程占用时重新租用"""
+        self.renew_at = time.monotonic() + NODE_LEASE_TTL / 3
+        try:
+            held = get_redis_client().register_script(RENEW_SCRIPT)(
+                keys=[NODE_LEASE_KEY.format(self.generator.node_id)], args=[self.owner, NODE_LEASE_TTL]
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Failed to renew order number node id {self.generator.node_id}: {str(e)}")
+            return
+        if not held:
+            logger.warning(f"Order number node id {self.generator.node_id} taken by another process, re-leasing")
+            self.generator = SnowflakeGenerator(self._acquire())
+
+
+_lease_lock = threading.Lock()
+
+
+def _get_lease() -> _NodeLease:
+    """当前进程的节点租约（按进程ID区分，fork 出的子进程重新获取）"""
+    lease = current_app.extensions.get('order_no_lease')
+    if lease is None or lease.pid != os.getpid():
+        with _lease_lock:
+            lease = current_app.extensions.get('order_no_lease')
+            if lease is None or lease.pid != os.getpid():
+                lease = _NodeLease(current_app.config.get('ORDER_NODE_ID'))
+                current_app.extensions['order_no_lease'] = lease
+    if not lease.fixed and time.monotonic() >= lease.renew_at:
+        with _lease_lock:
+            if time.monotonic() >= lease.renew_at:
+                lease.renew()
+    return lease
+
+
+def new_order_no() -> str:
+    """生成订单号：唯一、按时间有序、27位，不访问数据库
+
+    Returns:
+        str: 订单号
+    """
+    return format_order_no(_get_lease().generator.next_id())
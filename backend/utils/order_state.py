@@ -0,0 +1,151 @@
+from ..models import db, Order
+from .jobs import job, enqueue
+from .stock import order_quantities, restore_product_stock, release_stock, confirm_stock
+from .recommender import on_order_completed
+from .preferences import record_purchase_preferences
+from .notification import send_trade_messages
+from .http_cache import bump_generation
+from datetime import datetime
+from sqlalchemy import update
+from typing import Callable, Dict, Iterable, List, Optional
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 单个订单的转换结果
+OK = 'ok'
+NOT_FOUND = 'not_found'
+INVALID_TRANSITION = 'invalid_transition'
+
+NOTIFY_JOB = 'notify_order_transitions'
+MAX_ATTEMPTS = 3
+STATUS_MESSAGES = {
+    '已付款': ('订单已付款', '订单 {} 已付款，等待卖家发货'),
+    '已发货': ('订单已发货', '订单 {} 已发货，请注意查收'),
+    '已完成': ('订单已完成', '订单 {} 已完成，欢迎评价'),
+    '已取消': ('订单已取消', '订单 {} 已取消，库存已释放'),
+    'payment_timeout': ('订单已取消', '订单 {} 超时未支付，已自动取消'),
+}
+
+
+def transition_orders(order_ids: Iterable[int], status: str, user_id: Optional[int] = None,
+                      sources: Optional[Iterable[str]] = None, notify: bool = True,
+                      notice: Optional[str] = None,
+                      on_change: Optional[Callable[[List[int]], None]] = None) -> Dict[int, str]:
+    """按 Order.TRANSITIONS 批量转换订单状态
+
+    一次查询锁定订单，按当前状态分组，每组一条带当前状态条件的 UPDATE；取消时一条 UPDATE 归还全部商品库存，
+    与状态变更在同一事务中提交。数据库不支持行锁导致条件更新未全部命中时回滚并重试，
+    重试时已被并发修改的订单按新状态判定。
+
+    Args:
+        order_ids: 订单ID
+        status: 目标状态（数据库状态值）
+        user_id: 只转换该用户的订单，为空时不限（管理员）
+        sources: 只转换处于这些状态的订单，默认为状态机中可转换到目标状态的全部状态
+        notify: 是否异步向买家发送消息
+        notice: 消息模板（STATUS_MESSAGES 的键），默认按目标状态
+        on_change: 条件更新全部命中后、提交前以变更的订单ID调用，其写入与状态变更在同一事务中提交；
+            抛出异常时整个事务回滚（没有订单变更时不调用）
+
+    Returns:
+        Dict[int, str]: 订单ID到结果（OK、NOT_FOUND、INVALID_TRANSITION）的映射
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    allowed = [source for source in (Order.sources_of(status) if sources is None else sources)
+               if status in Order.TRANSITIONS.get(source, ())]
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        changed = _apply(order_ids, status, allowed, user_id, on_change)
+        if changed is not None:
+            break
+        logger.warning(f"Concurrent update while moving orders to {status}, retrying (attempt {attempt})")
+    else:
+        raise RuntimeError('订单状态被并发修改，请稍后重试')
+
+    results, changed_rows = changed
+    if changed_rows:
+        _after_transition(changed_rows, status)
+        if notify:
+            try:
+                enqueue(NOTIFY_JOB, [row.id for row in changed_rows], notice or status)
+            except Exception as e:
+                logger.error(f"Failed to enqueue notifications for {len(changed_rows)} orders: {str(e)}")
+    logger.info(f"Moved {len(changed_rows)}/{len(order_ids)} orders to {status}")
+    return results
+
+
+def _apply(order_ids: List[int], status: str, allowed: List[str], user_id: Optional[int],
+           on_change: Optional[Callable[[List[int]], None]] = None):
+    """执行一次转换事务；条件更新未全部命中时回滚并返回 None"""
+    query = db.session.query(Order.id, Order.status, Order.user_id, Order.order_no).filter(
+        Order.id.in_(order_ids), Order.is_deleted == False
+    )
+    if user_id is not None:
+        query = query.filter(Order.user_id == user_id)
+    rows = query.with_for_update().all()
+
+    results = {order_id: NOT_FOUND for order_id in order_ids}
+    groups: Dict[str, List[int]] = {}
+    for row in rows:
+        if row.status in allowed:
+            groups.setdefault(row.status, []).append(row.id)
+        else:
+            results[row.id] = INVALID_TRANSITION
+
+    values = {Order.status: status}
+    if status in Order.STATUS_TIME_FIELDS:
+        values[getattr(Order, Order.STATUS_TIME_FIELDS[status])] = datetime.utcnow()
+    try:
+        for source, ids in groups.items():
+            result = db.session.execute(
+                update(Order).where(Order.id.in_(ids), Order.status == source).values(values)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != len(ids):
+                db.session.rollback()
+                return None
+        changed_ids = [order_id for ids in groups.values() for order_id in ids]
+        if status == '已取消' and changed_ids:
+            totals: Dict[int, int] = {}
+            for quantities in order_quantities(changed_ids).values():
+                for product_id, quantity in quantities.items():
+                    totals[product_id] = totals.get(product_id, 0) + quantity
+            restore_product_stock(totals)
+        if on_change and changed_ids:
+            on_change(changed_ids)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    changed_rows = [row for row in rows if row.status in groups]
+    for row in changed_rows:
+        results[row.id] = OK
+    return results, changed_rows
+
+
+def _after_transition(rows: list, status: str):
+    """提交后的 Redis 副作用：取消时归还库存预占并使商品列表缓存失效，付款时确认预占，订单完成时更新推荐与偏好"""
+    if status == '已取消':
+        bump_generation('products')
+        for row in rows:
+            release_stock(row.order_no)
+    elif status == '已付款':
+        for row in rows:
+            confirm_stock(row.order_no)
+    elif status == '已完成':
+        quantities = order_quantities([row.id for row in rows])
+        for row in rows:
+            product_ids = list(quantities.get(row.id, {}))
+            on_order_completed(row.user_id, product_ids)
+            record_purchase_preferences(row.user_id, product_ids)
+
+
+@job(NOTIFY_JOB, max_retries=3, backoff=10)
+def notify_order_transitions(order_ids: List[int], notice: str):
+    """向买家批量发送订单状态变更消息"""
+    title, template = STATUS_MESSAGES[notice]
+    rows = db.session.query(Order.user_id, Order.order_no).filter(Order.id.in_(order_ids)).all()
+    send_trade_messages((user_id, title, template.format(order_no)) for user_id, order_no in rows)
@@ -0,0 +1,84 @@
+from flask import current_app
+from ..models import db, Order
+from .delay_queue import get_delay_queue
+from .order_state import transition_orders, OK
+from .stock import release_stock, PAYMENT_TIMEOUT
+from datetime import datetime, timedelta
+from typing import Optional
+import time
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PAYMENT_QUEUE = 'order_payment'  # 成员为订单号，按支付截止时间排序
+BATCH_SIZE = 200
+MAX_BATCHES = 20  # 单轮最多处理的批数，积压时留给下一轮，避免单个任务长时间占用工作进程
+SWEEP_GRACE = 300  # 超过支付截止时间仍为待付款的订单视为队列记录丢失
+
+
+def _timeout() -> int:
+    return current_app.config.get('ORDER_PAYMENT_TIMEOUT', PAYMENT_TIMEOUT)
+
+
+def schedule_payment_timeout(order_no: str, timeout: Optional[int] = None):
+    """将订单加入支付超时队列（下单时在预占库存前调用，下单失败时由超时处理归还预占）
+
+    Args:
+        order_no: 订单号
+        timeout: 支付超时时间（秒），默认 ORDER_PAYMENT_TIMEOUT
+    """
+    get_delay_queue(PAYMENT_QUEUE).add([order_no], time.time() + (timeout or _timeout()))
+
+
+def cancel_expired_orders(batch_size: int = BATCH_SIZE, max_batches: int = MAX_BATCHES) -> int:
+    """取消超过支付截止时间的待付款订单（由任务工作进程周期执行）
+
+    按批从队列取出到期订单号，每批一次 transition_orders：带状态条件的 UPDATE 取消，一条 UPDATE 归还库存，
+    提交后归还 Redis 预占并批量发送消息。已付款或已取消的订单不受影响；订单不存在（下单事务未提交）时
+    只归还 Redis 预占。处理成功后才确认出队，工作进程异常退出时队列记录会重新投递，多个工作进程可并发执行。
+
+    Args:
+        batch_size: 每批处理的订单数
+        max_batches: 本轮最多处理的批数
+
+    Returns:
+        int: 取消的订单数
+    """
+    queue = get_delay_queue(PAYMENT_QUEUE)
+    cancelled = 0
+    for _ in range(max_batches):
+        order_nos = queue.pop_due(batch_size)
+        if not order_nos:
+            break
+        orders = dict(db.session.query(Order.order_no, Order.id).filter(Order.order_no.in_(order_nos)).all())
+        if orders:
+            results = transition_orders(orders.values(), '已取消', sources=['待付款'], notice='payment_timeout')
+            cancelled += sum(result == OK for result in results.values())
+        for order_no in order_nos:
+            if order_no not in orders:
+                release_stock(order_no)
+        queue.ack(order_nos)
+    if cancelled:
+        logger.info(f"Cancelled {cancelled} orders past their payment deadline")
+    return cancelled
+
+
+def requeue_overdue_orders(limit: int = 1000) -> int:
+    """将超过支付截止时间仍为待付款的订单重新加入队列（Redis 故障导致队列记录丢失时的兜底，周期执行）
+
+    Args:
+        limit: 本轮最多加入的订单数
+
+    Returns:
+        int: 加入队列的订单数
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=_timeout() + SWEEP_GRACE)
+    order_nos = [row.order_no for row in db.session.query(Order.order_no).filter(
+        Order.status == '待付款', Order.create_time < cutoff, Order.is_deleted == False
+    ).limit(limit).all()]
+    if order_nos:
+        get_delay_queue(PAYMENT_QUEUE).add(order_nos, time.time())
+        logger.warning(f"Requeued {len(order_nos)} overdue unpaid orders")
+    return len(order_nos)
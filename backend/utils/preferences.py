@@ -0,0 +1,119 @@
+from flask import current_app
+from ..models import db, Product, Order, OrderItem
+from .redis_client import get_redis_client
+from sqlalchemy import func
+from typing import Dict, List
+import redis
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+USER_PREFS_KEY = 'recommend:prefs:{}'
+PREFS_TTL = 86400  # 增量更新不续期，商品改分类等未跟踪的变化最多滞后一天
+EMPTY_FIELD = '_'  # 占位字段，使没有购买记录的用户也能被缓存
+
+# 缓存存在时才累加，检查与累加原子执行，避免键在两者之间过期后只留下部分计数
+INCREMENT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+for _, tag_id in ipairs(ARGV) do redis.call('HINCRBY', KEYS[1], tag_id, 1) end
+return 1
+"""
+
+
+def aggregate_user_preferences(user_id: int) -> Dict[int, int]:
+    """一次分组查询统计用户在各分类下购买的商品数
+
+    Args:
+        user_id: 用户ID
+
+    Returns:
+        Dict[int, int]: 分类ID到购买次数的映射
+    """
+    rows = db.session.query(Product.tag_id, func.count(OrderItem.id)).join(
+        Order, OrderItem.order_id == Order.id
+    ).join(
+        Product, OrderItem.product_id == Product.id
+    ).filter(
+        Order.user_id == user_id,
+        Order.status == '已完成',
+        Order.is_deleted == False,
+        Product.tag_id != None
+    ).group_by(Product.tag_id).all()
+    return {tag_id: count for tag_id, count in rows}
+
+
+def get_user_preferences(user_id: int) -> Dict[int, int]:
+    """获取用户分类偏好（一次 HGETALL；未缓存时分组查询后写入缓存）
+
+    Args:
+        user_id: 用户ID
+
+    Returns:
+        Dict[int, int]: 分类ID到购买次数的映射
+    """
+    key = USER_PREFS_KEY.format(user_id)
+    try:
+        cached = get_redis_client().hgetall(key)
+    except redis.RedisError as e:
+        logger.error(f"Failed to read preferences for user {user_id}: {str(e)}")
+        return aggregate_user_preferences(user_id)
+    if cached:
+        return {int(tag_id): int(count) for tag_id, count in cached.items() if tag_id != EMPTY_FIELD.encode()}
+
+    preferences = aggregate_user_preferences(user_id)
+    try:
+        with get_redis_client().pipeline() as pipe:
+            pipe.hset(key, mapping={EMPTY_FIELD: 0, **preferences})
+            pipe.expire(key, current_app.config.get('USER_PREFS_TTL', PREFS_TTL))
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"Failed to cache preferences for user {user_id}: {str(e)}")
+    return preferences
+
+
+def preference_vector(preferences: Dict[int, int]) -> List[dict]:
+    """将购买次数归一化为权重（和为1），按权重降序
+
+    Args:
+        preferences: 分类ID到购买次数的映射
+
+    Returns:
+        List[dict]: [{'tag_id', 'count', 'weight'}]
+    """
+    total = sum(preferences.values())
+    return [{'tag_id': tag_id, 'count': count, 'weight': round(count / total, 4)}
+            for tag_id, count in sorted(preferences.items(), key=lambda x: x[1], reverse=True)] if total else []
+
+
+def record_purchase_preferences(user_id: int, product_ids: List[int]):
+    """订单完成后增量累加用户分类偏好；未缓存的用户不处理，下次读取时聚合
+
+    Args:
+        user_id: 用户ID
+        product_ids: 订单中的商品ID
+    """
+    if not product_ids:
+        return
+    tags = db.session.query(Product.tag_id).filter(Product.id.in_(product_ids), Product.tag_id != None).all()
+    if not tags:
+        return
+    try:
+        get_redis_client().register_script(INCREMENT_SCRIPT)(
+            keys=[USER_PREFS_KEY.format(user_id)], args=[tag_id for (tag_id,) in tags]
+        )
+    except redis.RedisError as e:
+        logger.error(f"Failed to update preferences for user {user_id}: {str(e)}")
+
+
+def invalidate_user_preferences(user_id: int):
+    """用户的已完成订单被删除后清除偏好缓存
+
+    Args:
+        user_id: 用户ID
+    """
+    try:
+        get_redis_client().delete(USER_PREFS_KEY.format(user_id))
+    except redis.RedisError as e:
+        logger.error(f"Failed to invalidate preferences for user {user_id}: {str(e)}")
@@ -0,0 +1,69 @@
+from ..models import Product
+from .redis_client import get_redis_client
+from .cart_store import invalidate_cart_summaries
+from typing import Dict, Iterable, List
+import json
+import redis
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PRODUCT_CARD_KEY = 'product:card:{}'
+PRODUCT_CARD_TTL = 600  # 浏览量、库存等高频变化字段最多滞后10分钟，编辑类变更通过 invalidate_product_cards 立即生效
+
+
+def get_product_cards(product_ids: Iterable[int]) -> Dict[int, dict]:
+    """批量获取商品摘要（Product.to_dict()），一次 MGET，未命中的一次 IN 查询后回填
+
+    Args:
+        product_ids: 商品ID
+
+    Returns:
+        Dict[int, dict]: 商品ID到商品摘要的映射，已删除或不存在的商品不包含在内
+    """
+    product_ids = list(dict.fromkeys(int(pid) for pid in product_ids))
+    if not product_ids:
+        return {}
+
+    cards: Dict[int, dict] = {}
+    try:
+        values = get_redis_client().mget([PRODUCT_CARD_KEY.format(pid) for pid in product_ids])
+        for pid, value in zip(product_ids, values):
+            if value:
+                cards[pid] = json.loads(value)
+    except (redis.RedisError, ValueError) as e:
+        logger.warning(f"Failed to read product cards: {str(e)}")
+
+    missing = [pid for pid in product_ids if pid not in cards]
+    if missing:
+        products = Product.query.filter(Product.id.in_(missing), Product.is_deleted == False).all()
+        loaded = {product.id: product.to_dict() for product in products}
+        cards.update(loaded)
+        if loaded:
+            try:
+                with get_redis_client().pipeline(transaction=False) as pipe:
+                    for pid, card in loaded.items():
+                        pipe.setex(PRODUCT_CARD_KEY.format(pid), PRODUCT_CARD_TTL, json.dumps(card, ensure_ascii=False))
+                    pipe.execute()
+            except redis.RedisError as e:
+                logger.warning(f"Failed to cache product cards: {str(e)}")
+    return cards
+
+
+def invalidate_product_cards(product_ids: Iterable[int]):
+    """商品信息变更后删除其摘要缓存，以及包含这些商品的购物车汇总
+
+    Args:
+        product_ids: 商品ID
+    """
+    product_ids = list(product_ids)
+    invalidate_cart_summaries(product_ids)
+    keys: List[str] = [PRODUCT_CARD_KEY.format(pid) for pid in product_ids]
+    if not keys:
+        return
+    try:
+        get_redis_client().delete(*keys)
+    except redis.RedisError as e:
+        logger.error(f"Failed to invalidate product cards {keys}: {str(e)}")
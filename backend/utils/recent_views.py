@@ -0,0 +1,69 @@
+from functools import wraps
+from flask import current_app
+from .decorators import get_optional_user_id
+from .redis_client import get_redis_client
+from typing import Callable, List
+import redis
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RECENT_VIEWS_KEY = 'recent:user:{}'
+RECENT_VIEWS_LIMIT = 50
+RECENT_VIEWS_TTL = 30 * 86400
+
+
+def record_recent_view(user_id: int, product_id: int):
+    """将商品放到用户最近浏览列表头部（去重并截断到固定长度），只写 Redis
+
+    Args:
+        user_id: 用户ID
+        product_id: 商品ID
+    """
+    key = RECENT_VIEWS_KEY.format(user_id)
+    limit = current_app.config.get('RECENT_VIEWS_LIMIT', RECENT_VIEWS_LIMIT)
+    try:
+        with get_redis_client().pipeline() as pipe:
+            pipe.lrem(key, 0, product_id)
+            pipe.lpush(key, product_id)
+            pipe.ltrim(key, 0, limit - 1)
+            pipe.expire(key, RECENT_VIEWS_TTL)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to record recent view of product {product_id} for user {user_id}: {str(e)}")
+
+
+def get_recent_view_ids(user_id: int, limit: int) -> List[int]:
+    """读取用户最近浏览的商品ID（最近的在前）
+
+    Args:
+        user_id: 用户ID
+        limit: 返回数量
+
+    Returns:
+        List[int]: 商品ID列表
+    """
+    try:
+        return [int(pid) for pid in get_redis_client().lrange(RECENT_VIEWS_KEY.format(user_id), 0, limit - 1)]
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read recent views for user {user_id}: {str(e)}")
+        return []
+
+
+def track_recent_view(f: Callable) -> Callable:
+    """商品详情接口的装饰器：请求成功（含304）且携带用户令牌时记录最近浏览
+
+    应放在 conditional 之外，使条件请求命中时同样记录。
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        response = current_app.make_response(f(*args, **kwargs))
+        if response.status_code in (200, 304):
+            user_id = get_optional_user_id()
+            if user_id:
+                record_recent_view(user_id, kwargs['product_id'])
+        return response
+
+    return decorated
@@ -1,17 +1,42 @@
-from ..models import Product, Order, User
-from sqlalchemy import func, and_
+from flask import current_app
+from ..models import db, Product, Order, OrderItem
+from .redis_client import get_redis_client
+from .offline_jobs import mark_built, schedule_if_stale, start_locked
+from .similarity import pack_neighbors, unpack_neighbors
+from .user_similarity import build_user_index, similar_users, update_user_signature
+from .unique_views import get_hot_ranking
 from collections import defaultdict
-import json
-from typing import List, Dict, Set
+from scipy import sparse
+from typing import Iterable, List, Optional, Set, Tuple
+import numpy as np
+import threading
+import time
+import redis
 import logging
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+RECOMMEND_JOB = 'recommend'
+ITEM_NEIGHBORS_KEY = 'recommend:item_neighbors'
+TOP_K = 50
+MAX_SEED_ITEMS = 50
+USER_NEIGHBORS = 30
+USER_CF_WEIGHT = 1.0
+REBUILD_INTERVAL = 3600
+
+USER_CACHE_KEY = 'recommend:user:{}'
+USER_REFRESH_LOCK_KEY = 'recommend:user:{}:refreshing'
+CACHE_STATS_KEY = 'recommend:cache_stats'
+USER_CACHE_TTL = 1800  # 超过后仍返回旧结果，同时后台刷新
+USER_CACHE_MAX_AGE = 86400  # 键的过期时间，超过后同步重算
+CACHED_CANDIDATES = 100
+STATS_FLUSH_INTERVAL = 10
+
 
 def get_hot_products(limit: int = 10) -> List[Product]:
-    """获取热门商品
+    """获取热门商品：优先按最近7天独立访客数排行，排行未生成或不足时按浏览量补齐
 
     Args:
         limit: 返回数量限制
@@ -19,88 +44,428 @@ def get_hot_products(limit: int = 10) -> List[Product]:
     Returns:
         List[Product]: 热门商品列表
     """
-    return Product.query.filter_by(
-        status='approved',
-        is_deleted=False
-    ).order_by(
-        Product.views.desc(),
-        Product.created_at.desc()
-    ).limit(limit).all()
+    products = []
+    ranked_ids = get_hot_ranking(limit * 2)  # 多取一些，抵消已下架或删除的商品
+    if ranked_ids:
+        ranked = Product.query.filter(
+            Product.id.in_(ranked_ids),
+            Product.status == '已通过',
+            Product.is_deleted == False
+        ).all()
+        by_id = {product.id: product for product in ranked}
+        products = [by_id[pid] for pid in ranked_ids if pid in by_id][:limit]
+    if len(products) < limit:
+        query = Product.query.filter_by(status='已通过', is_deleted=False)
+        if products:
+            query = query.filter(Product.id.notin_([product.id for product in products]))
+        products += query.order_by(
+            Product.views.desc(),
+            Product.created_at.desc()
+        ).limit(limit - len(products)).all()
+    return products
+
+
+def get_user_purchase_history(user_id: int) -> List[int]:
+    """获取用户购买过的商品ID（一次查询，最近购买的在前，已去重）
 
+    Args:
+        user_id: 用户ID
+
+    Returns:
+        List[int]: 商品ID列表
+    """
+    rows = db.session.query(OrderItem.product_id).join(Order, OrderItem.order_id == Order.id).filter(
+        Order.user_id == user_id,
+        Order.status == '已完成',
+        Order.is_deleted == False
+    ).order_by(Order.create_time.desc(), OrderItem.id).all()
+    return list(dict.fromkeys(product_id for (product_id,) in rows))
 
-def get_user_preferences(user_id: int) -> Dict[int, int]:
-    """获取用户偏好
+
+def get_user_purchased_products(user_id: int) -> Set[int]:
+    """获取用户购买过的商品ID集合
 
     Args:
         user_id: 用户ID
 
     Returns:
-        Dict[int, int]: 分类ID到购买次数的映射
+        Set[int]: 商品ID集合
+    """
+    return set(get_user_purchase_history(user_id))
+
+
+def load_purchase_matrix() -> Tuple[np.ndarray, np.ndarray, sparse.csr_matrix]:
+    """一次查询所有已完成订单的明细，构建 用户 x 商品 的0/1稀疏矩阵
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, sparse.csr_matrix]: (行对应的用户ID, 列对应的商品ID, 购买矩阵)
     """
-    category_counts = defaultdict(int)
-    orders = Order.query.filter(
-        and_(
-            Order.user_id == user_id,
-            Order.status == 'completed',
-            Order.is_deleted == False
-        )
+    rows = db.session.query(Order.user_id, OrderItem.product_id).join(Order, OrderItem.order_id == Order.id).filter(
+        Order.status == '已完成',
+        Order.is_deleted == False
     ).all()
+    user_rows = [user_id for user_id, _ in rows]
+    product_ids = [product_id for _, product_id in rows]
 
-    for order in orders:
-        try:
-            products = json.loads(order.products)
-            product_ids = [p['product_id'] for p in products]
-            products_db = Product.query.filter(Product.id.in_(product_ids)).all()
-            for product in products_db:
-                if product and product.category_id:
-                    category_counts[product.category_id] += 1
-        except (json.JSONDecodeError, KeyError) as e:
-            logger.warning(f"Failed to parse order {order.id} products: {str(e)}")
+    if not product_ids:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), sparse.csr_matrix((0, 0), dtype=np.float32)
+    users, user_index = np.unique(np.array(user_rows, dtype=np.int64), return_inverse=True)
+    items, item_index = np.unique(np.array(product_ids, dtype=np.int64), return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(item_index), dtype=np.float32), (user_index, item_index)),
+        shape=(len(users), len(items))
+    )
+    matrix.data[:] = 1  # 同一用户多次购买同一商品只计一次
+    return users, items, matrix
+
+
+def compute_item_neighbors(matrix: sparse.csr_matrix, k: int = TOP_K,
+                           block_size: int = 2048) -> sparse.csr_matrix:
+    """计算商品之间的余弦相似度（共同购买用户数 / sqrt(两商品购买人数之积)）并保留每行前K个
+
+    按商品分块做稀疏矩阵乘法，块内用一次 lexsort 向量化地选出每行前K个，不逐行循环。
+
+    Args:
+        matrix: 用户 x 商品 的0/1购买矩阵
+        k: 每个商品保留的近邻数量
+        block_size: 每块商品数，控制峰值内存
+
+    Returns:
+        sparse.csr_matrix: 商品 x 商品 的近邻相似度矩阵（每行至多K个非零元素）
+    """
+    n_items = matrix.shape[1]
+    norms = np.sqrt(np.asarray(matrix.sum(axis=0)).ravel())
+    norms[norms == 0] = 1
+    normalized = sparse.csc_matrix(matrix @ sparse.diags(1 / norms), dtype=np.float32)
+    transposed = normalized.T.tocsr()
+
+    rows, cols, values = [], [], []
+    for start in range(0, n_items, block_size):
+        block = (transposed[start:start + block_size] @ normalized).tocoo()
+        keep = block.row + start != block.col  # 排除自身
+        row, col, value = block.row[keep] + start, block.col[keep], block.data[keep]
+        order = np.lexsort((-value, row))
+        row, col, value = row[order], col[order], value[order]
+        rank = np.arange(len(row)) - np.searchsorted(row, row, side='left')
+        top = rank < k
+        rows.append(row[top])
+        cols.append(col[top])
+        values.append(value[top])
+
+    if not rows:
+        return sparse.csr_matrix((n_items, n_items), dtype=np.float32)
+    return sparse.csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n_items, n_items)
+    )
+
+
+def rebuild_recommend_index(k: int = TOP_K) -> int:
+    """全量重建商品共同购买近邻与用户 MinHash 签名并写入 Redis（共用一次购买矩阵加载）
+
+    Args:
+        k: 每个商品保存的近邻数量
+
+    Returns:
+        int: 有购买记录的商品数量
+    """
+    start = time.perf_counter()
+    users, items, matrix = load_purchase_matrix()
+    neighbors = compute_item_neighbors(matrix, k)
+    build_user_index(users, items, matrix)
+
+    # 先写入临时键再原子重命名，避免重建期间读到不完整的数据
+    building_key = f'{ITEM_NEIGHBORS_KEY}:building'
+    written = 0
+    with get_redis_client().pipeline(transaction=False) as pipe:
+        pipe.delete(building_key)
+        for row in range(neighbors.shape[0]):
+            begin, end = neighbors.indptr[row], neighbors.indptr[row + 1]
+            if begin == end:
+                continue
+            order = np.argsort(-neighbors.data[begin:end])
+            pipe.hset(building_key, int(items[row]),
+                      pack_neighbors(items[neighbors.indices[begin:end][order]], neighbors.data[begin:end][order]))
+            written += 1
+            if written % 1000 == 0:
+                pipe.execute()
+        if written:
+            pipe.rename(building_key, ITEM_NEIGHBORS_KEY)
+        else:
+            pipe.delete(ITEM_NEIGHBORS_KEY)
+        mark_built(RECOMMEND_JOB, len(items), pipe)
+        pipe.execute()
+
+    logger.info(f"Rebuilt item neighbors for {len(items)} products from {matrix.shape[0]} users "
+                f"in {time.perf_counter() - start:.2f}s")
+    return len(items)
+
+
+def schedule_rebuild_if_stale():
+    """近邻数据过期时在后台重建"""
+    interval = current_app.config.get('RECOMMEND_REBUILD_INTERVAL', REBUILD_INTERVAL)
+    schedule_if_stale(RECOMMEND_JOB, rebuild_recommend_index, interval)
+
+
+def score_candidates(seed_ids: List[int]) -> dict:
+    """合并已购商品的近邻列表（一次 HMGET），得到候选商品得分
+
+    Args:
+        seed_ids: 已购商品ID
+
+    Returns:
+        dict: 商品ID到得分的映射
+    """
+    scores = defaultdict(float)
+    if not seed_ids:
+        return scores
+    for data in get_redis_client().hmget(ITEM_NEIGHBORS_KEY, seed_ids):
+        if not data:
             continue
+        neighbor_ids, neighbor_scores = unpack_neighbors(data)
+        for product_id, score in zip(neighbor_ids.tolist(), neighbor_scores.tolist()):
+            scores[product_id] += score
+    return scores
+
 
-    return dict(category_counts)
+def user_cf_scores(user_id: int) -> dict:
+    """基于相似用户的候选得分：LSH 查找相似用户后一次查询他们购买的商品，按估计相似度累加
 
+    Args:
+        user_id: 用户ID
 
-def get_user_similarity(user_products: Set[int], other_products: Set[int]) -> float:
-    """计算两个用户的相似度
+    Returns:
+        dict: 商品ID到得分的映射
+    """
+    scores = defaultdict(float)
+    neighbors = dict(similar_users(user_id, USER_NEIGHBORS))
+    if not neighbors:
+        return scores
+    rows = db.session.query(Order.user_id, OrderItem.product_id).join(Order, OrderItem.order_id == Order.id).filter(
+        Order.user_id.in_(list(neighbors)),
+        Order.status == '已完成',
+        Order.is_deleted == False
+    ).distinct().all()
+    for neighbor_id, product_id in rows:
+        scores[product_id] += neighbors[neighbor_id]
+    return scores
+
+
+def rank_candidates(scores: dict, purchased: Set[int]) -> Tuple[List[int], List[float]]:
+    """按得分排序候选商品并排除已购商品，保留前 CACHED_CANDIDATES 个"""
+    ranked = sorted(((score, product_id) for product_id, score in scores.items() if product_id not in purchased),
+                    reverse=True)[:CACHED_CANDIDATES]
+    return [product_id for _, product_id in ranked], [score for score, _ in ranked]
+
+
+def store_user_recommendations(user_id: int, purchased: Iterable[int], candidate_ids: List[int],
+                               scores: List[float]):
+    """写入用户推荐缓存：候选商品及得分、已购商品、生成时间
 
     Args:
-        user_products: 用户购买的商品集合
-        other_products: 其他用户购买的商品集合
+        user_id: 用户ID
+        purchased: 已购商品ID
+        candidate_ids: 按得分降序的候选商品ID
+        scores: 对应的得分
+    """
+    key = USER_CACHE_KEY.format(user_id)
+    with get_redis_client().pipeline() as pipe:
+        pipe.delete(key)
+        pipe.hset(key, mapping={
+            'items': pack_neighbors(np.array(candidate_ids, dtype=np.int64), np.array(scores, dtype=np.float32)),
+            'purchased': np.array(sorted(purchased), dtype='<i4').tobytes(),
+            'built_at': time.time()
+        })
+        pipe.expire(key, current_app.config.get('RECOMMEND_USER_CACHE_MAX_AGE', USER_CACHE_MAX_AGE))
+        pipe.execute()
+
+
+def load_user_recommendations(user_id: int) -> Optional[Tuple[List[int], List[float], Set[int], float]]:
+    """读取用户推荐缓存（一次 HGETALL）
+
+    Args:
+        user_id: 用户ID
 
     Returns:
-        float: Jaccard相似度
+        Optional[Tuple]: (候选商品ID, 得分, 已购商品ID, 生成时间)，未缓存时返回 None
     """
-    intersection = len(user_products & other_products)
-    union = len(user_products | other_products)
-    return intersection / union if union > 0 else 0
+    data = get_redis_client().hgetall(USER_CACHE_KEY.format(user_id))
+    if not data or b'built_at' not in data:
+        return None
+    candidate_ids, scores = unpack_neighbors(data.get(b'items', b''))
+    purchased = set(np.frombuffer(data.get(b'purchased', b''), dtype='<i4').tolist())
+    return candidate_ids.tolist(), scores.tolist(), purchased, float(data[b'built_at'])
 
 
-def get_user_purchased_products(user_id: int) -> Set[int]:
-    """获取用户购买过的商品ID集合
+def refresh_user_recommendations(user_id: int, history: Optional[List[int]] = None) -> Tuple[List[int], Set[int]]:
+    """全量重算并缓存用户的推荐候选
 
     Args:
         user_id: 用户ID
+        history: 已查询的购买记录，为空时重新查询
 
     Returns:
-        Set[int]: 商品ID集合
+        Tuple[List[int], Set[int]]: (候选商品ID, 已购商品ID)
     """
-    purchased_products = set()
-    orders = Order.query.filter_by(user_id=user_id, status='completed').all()
+    if history is None:
+        history = get_user_purchase_history(user_id)
+    purchased = set(history)
+    candidate_ids, scores = [], []
+    if history:
+        schedule_rebuild_if_stale()
+        combined = score_candidates(history[:MAX_SEED_ITEMS])
+        for product_id, score in user_cf_scores(user_id).items():
+            combined[product_id] += USER_CF_WEIGHT * score
+        candidate_ids, scores = rank_candidates(combined, purchased)
+    store_user_recommendations(user_id, purchased, candidate_ids, scores)
+    return candidate_ids, purchased
 
-    for order in orders:
+
+def on_order_completed(user_id: int, product_ids: List[int]):
+    """订单完成后增量更新：用户 MinHash 签名取逐分量最小值，推荐缓存合并新购商品的近邻并排除新购商品
+
+    未缓存推荐的用户只更新签名，下次请求时全量计算。
+
+    Args:
+        user_id: 用户ID
+        product_ids: 订单中的商品ID
+    """
+    try:
+        update_user_signature(user_id, product_ids)
+        cached = load_user_recommendations(user_id)
+        if cached is None:
+            return
+        candidate_ids, scores, purchased, _ = cached
+        merged = defaultdict(float, zip(candidate_ids, scores))
+        for product_id, score in score_candidates([pid for pid in product_ids if pid not in purchased]).items():
+            merged[product_id] += score
+        purchased.update(product_ids)
+        candidate_ids, scores = rank_candidates(merged, purchased)
+        store_user_recommendations(user_id, purchased, candidate_ids, scores)
+    except redis.RedisError as e:
+        logger.error(f"Failed to update recommendations for user {user_id}: {str(e)}")
+
+
+def invalidate_user_recommendations(user_id: int):
+    """用户的已完成订单被取消或删除后清除推荐缓存
+
+    Args:
+        user_id: 用户ID
+    """
+    try:
+        get_redis_client().delete(USER_CACHE_KEY.format(user_id))
+    except redis.RedisError as e:
+        logger.error(f"Failed to invalidate recommendations for user {user_id}: {str(e)}")
+
+
+class CacheStats:
+    """推荐缓存命中率与陈旧度统计：进程内累加，定期合并到 Redis，避免每次请求多一次写入"""
+
+    FIELDS = ('hit', 'stale', 'miss', 'served_age', 'stale_age')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = dict.fromkeys(self.FIELDS, 0)
+        self._flushed_at = time.time()
+
+    def record(self, kind: str, age: float = 0.0):
+        """记录一次读取
+
+        Args:
+            kind: hit（新鲜命中）、stale（返回旧结果并后台刷新）或 miss（同步计算）
+            age: 返回的缓存已生成的秒数
+        """
+        with self._lock:
+            self._pending[kind] += 1
+            if kind != 'miss':
+                self._pending['served_age'] += age
+            if kind == 'stale':
+                self._pending['stale_age'] += age
+            due = time.time() - self._flushed_at >= STATS_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        """将进程内的统计合并到 Redis"""
+        with self._lock:
+            pending, self._pending = self._pending, dict.fromkeys(self.FIELDS, 0)
+            self._flushed_at = time.time()
         try:
-            products = json.loads(order.products)
-            purchased_products.update(p['product_id'] for p in products)
-        except (json.JSONDecodeError, KeyError) as e:
-            logger.warning(f"Failed to parse order {order.id} products: {str(e)}")
-            continue
+            with get_redis_client().pipeline(transaction=False) as pipe:
+                for field, value in pending.items():
+                    if value:
+                        pipe.hincrbyfloat(CACHE_STATS_KEY, field, value)
+                pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Failed to flush recommendation cache stats: {str(e)}")
+
+    def summary(self) -> dict:
+        """汇总所有进程的统计
+
+        Returns:
+            dict: 请求数、命中率、陈旧返回率、平均缓存年龄与平均陈旧时长（秒）
+        """
+        self.flush()
+        raw = get_redis_client().hgetall(CACHE_STATS_KEY)
+        values = {field: float(raw.get(field.encode(), 0)) for field in self.FIELDS}
+        served = values['hit'] + values['stale']
+        total = served + values['miss']
+        return {
+            'requests': int(total),
+            'hits': int(values['hit']),
+            'stale_hits': int(values['stale']),
+            'misses': int(values['miss']),
+            'hit_rate': round(served / total, 4) if total else 0,
+            'stale_rate': round(values['stale'] / total, 4) if total else 0,
+            'avg_age_seconds': round(values['served_age'] / served, 1) if served else 0,
+            'avg_staleness_seconds': round(values['stale_age'] / values['stale'], 1) if values['stale'] else 0
+        }
+
+
+cache_stats = CacheStats()
+
+
+def get_user_candidates(user_id: int) -> Tuple[List[int], Set[int]]:
+    """读取用户推荐候选：新鲜缓存直接返回；过期缓存先返回旧结果并后台刷新；无缓存时同步计算
 
-    return purchased_products
+    Args:
+        user_id: 用户ID
+
+    Returns:
+        Tuple[List[int], Set[int]]: (候选商品ID, 已购商品ID)
+    """
+    try:
+        cached = load_user_recommendations(user_id)
+    except redis.RedisError as e:
+        logger.error(f"Failed to read recommendations for user {user_id}: {str(e)}")
+        return [], get_user_purchased_products(user_id)
+
+    if cached is None:
+        cache_stats.record('miss')
+        try:
+            return refresh_user_recommendations(user_id)
+        except redis.RedisError as e:
+            logger.error(f"Failed to refresh recommendations for user {user_id}: {str(e)}")
+            return [], get_user_purchased_products(user_id)
+
+    candidate_ids, _, purchased, built_at = cached
+    age = time.time() - built_at
+    if age > current_app.config.get('RECOMMEND_USER_CACHE_TTL', USER_CACHE_TTL):
+        cache_stats.record('stale', age)
+        try:
+            start_locked(f'recommend-user-{user_id}', lambda: refresh_user_recommendations(user_id),
+                         USER_REFRESH_LOCK_KEY.format(user_id), timeout=60)
+        except redis.RedisError as e:
+            logger.error(f"Failed to schedule recommendation refresh for user {user_id}: {str(e)}")
+    else:
+        cache_stats.record('hit', age)
+    return candidate_ids, purchased
 
 
 def get_recommended_products(user_id: int, limit: int = 10) -> List[Product]:
-    """基于用户协同过滤的商品推荐（批量查询优化）
+    """基于商品共同购买的协同过滤推荐
+
+    候选商品按用户缓存，命中时请求内只有一次 Redis 读取和一次商品批量查询。
 
     Args:
         user_id: 用户ID
@@ -109,74 +474,27 @@ def get_recommended_products(user_id: int, limit: int = 10) -> List[Product]:
     Returns:
         List[Product]: 推荐商品列表
     """
-    user_products = get_user_purchased_products(user_id)
-    if not user_products:
-        return get_hot_products(limit)
-
-    active_users = User.query.join(Order).filter(
-        and_(
-            Order.status == 'completed',
-            User.id != user_id,
-            Order.create_time >= func.date_sub(func.now(), func.interval('3 MONTH'))
-        )
-    ).distinct().limit(100).all()
-
-    user_similarities = []
-    for other_user in active_users:
-        other_products = get_user_purchased_products(other_user.id)
-        if other_products:
-            similarity = get_user_similarity(user_products, other_products)
-            if similarity > 0.1:
-                user_similarities.append((other_user.id, similarity))
-
-    user_similarities.sort(key=lambda x: x[1], reverse=True)
-    similar_users = user_similarities[:10]
-
-    product_scores = defaultdict(float)
-    product_categories = set()
-
-    for similar_user_id, similarity in similar_users:
-        orders = Order.query.filter_by(
-            user_id=similar_user_id,
-            status='completed'
-        ).order_by(Order.create_time.desc()).limit(10).all()
-
-        product_ids = set()
-        for order in orders:
-            try:
-                products = json.loads(order.products)
-                product_ids.update(p['product_id'] for p in products)
-            except (json.JSONDecodeError, KeyError) as e:
-                logger.warning(f"Failed to parse order {order.id} products: {str(e)}")
-                continue
+    candidate_ids, purchased = get_user_candidates(user_id)
 
+    # 多取一些候选，抵消已下架或已删除的商品（商品状态在此处过滤，缓存无需随商品状态失效）
+    candidate_ids = candidate_ids[:limit * 2]
+    recommended_products = []
+    if candidate_ids:
         products = Product.query.filter(
-            Product.id.in_(product_ids),
-            Product.status == 'approved',
+            Product.id.in_(candidate_ids),
+            Product.status == '已通过',
             Product.is_deleted == False
         ).all()
-
-        for product in products:
-            diversity_weight = 1.2 if product.category_id not in product_categories else 0.8
-            product_scores[product.id] += similarity * diversity_weight
-            product_categories.add(product.category_id)
-
-    recommended_products = []
-    sorted_products = sorted(product_scores.items(), key=lambda x: x[1], reverse=True)
-
-    for product_id, _ in sorted_products:
-        if len(recommended_products) >= limit:
-            break
-        if product_id not in user_products:
-            product = Product.query.get(product_id)
-            if product:
-                recommended_products.append(product)
+        products_by_id = {product.id: product for product in products}
+        recommended_products = [products_by_id[pid] for pid in candidate_ids if pid in products_by_id][:limit]
 
     if len(recommended_products) < limit:
-        hot_products = get_hot_products(limit - len(recommended_products))
-        for product in hot_products:
-            if product.id not in user_products and product not in recommended_products:
+        recommended_ids = {product.id for product in recommended_products}
+        for product in get_hot_products(limit + min(len(purchased), MAX_SEED_ITEMS)):
+            if len(recommended_products) >= limit:
+                break
+            if product.id not in purchased and product.id not in recommended_ids:
                 recommended_products.append(product)
 
     logger.info(f"Recommended {len(recommended_products)} products for user {user_id}")
-    return recommended_products[:limit]
\ No newline at end of file
+    return recommended_products
@@ -0,0 +1,22 @@
+from flask import current_app
+import redis
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def get_redis_client():
+    """获取当前应用共享的 Redis 客户端
+
+    每个应用只创建一次连接池并缓存在 app.extensions 中，避免每次调用都新建连接池。
+
+    Returns:
+        redis.Redis: Redis 客户端
+    """
+    client = current_app.extensions.get('redis_client')
+    if client is None:
+        client = redis.Redis.from_url(current_app.config.get('REDIS_URL', 'redis://localhost:6379/0'))
+        current_app.extensions['redis_client'] = client
+    return client
@@ -0,0 +1,332 @@
+from flask import current_app
+from ..models import db, Product, Tag
+from .redis_client import get_redis_client
+from .offline_jobs import mark_built, built_at, schedule_if_stale
+from .jobs import job, enqueue
+from .suggest import normalize
+from scipy import sparse
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import re
+import threading
+import time
+import redis
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SIMILAR_KEY = 'similar:neighbors'
+SIMILAR_JOB = 'similar'
+INDEX_JOB = 'index_similar_product'
+TOP_K = 20
+REBUILD_INTERVAL = 6 * 3600
+NAME_WEIGHT = 2
+# 转置矩阵稠密化的内存上限：不超过时用 稀疏块 x 稠密矩阵 计算，比稀疏 x 稀疏快数倍
+DENSE_LIMIT_BYTES = 512 * 1024 * 1024
+LATIN_TOKEN = re.compile(r'[a-z0-9]+')
+CJK_RUN = re.compile(r'[㐀-鿿豈-﫿]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """分词：拉丁字母按单词，中日韩文字取单字和相邻二元组
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        List[str]: 词项列表
+    """
+    text = normalize(text)
+    tokens = LATIN_TOKEN.findall(text)
+    for run in CJK_RUN.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def document_tokens(name: str, description: Optional[str], tag_name: Optional[str]) -> List[str]:
+    """商品文档的词项：名称加权，描述与标签名各计一次"""
+    tokens = tokenize(name) * NAME_WEIGHT + tokenize(description or '')
+    if tag_name:
+        tokens.append(f'tag:{normalize(tag_name)}')
+    return tokens
+
+
+class TfidfIndex:
+    """TF-IDF 稀疏矩阵（行已L2归一化，点积即余弦相似度）"""
+
+    def __init__(self, product_ids: np.ndarray, matrix: sparse.csr_matrix, vocabulary: Dict[str, int],
+                 idf: np.ndarray):
+        self.product_ids = product_ids
+        self.matrix = matrix
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.built_at = time.time()
+
+    @classmethod
+    def build(cls, product_ids, documents: List[List[str]]) -> 'TfidfIndex':
+        """由分词后的文档构建索引
+
+        Args:
+            product_ids: 商品ID列表
+            documents: 与商品ID一一对应的词项列表
+
+        Returns:
+            TfidfIndex: 索引
+        """
+        vocabulary: Dict[str, int] = {}
+        indptr, indices = [0], []
+        for tokens in documents:
+            for token in tokens:
+                indices.append(vocabulary.setdefault(token, len(vocabulary)))
+            indptr.append(len(indices))
+
+        counts = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr)),
+            shape=(len(documents), max(len(vocabulary), 1))
+        )
+        counts.sum_duplicates()
+        df = np.bincount(counts.indices, minlength=counts.shape[1])
+
+        # 只出现在一个商品中的词项不影响商品之间的相似度，去掉以缩小矩阵
+        if counts.shape[0] > 1:
+            keep = np.flatnonzero(df > 1)
+            remap = np.full(counts.shape[1], -1, dtype=np.int64)
+            remap[keep] = np.arange(len(keep))
+            vocabulary = {token: int(remap[column]) for token, column in vocabulary.items() if remap[column] >= 0}
+            counts = counts[:, keep] if len(keep) else sparse.csr_matrix((counts.shape[0], 1), dtype=np.float32)
+            df = df[keep] if len(keep) else np.zeros(1, dtype=df.dtype)
+
+        idf = (np.log((1 + counts.shape[0]) / (1 + df)) + 1).astype(np.float32)
+        return cls(np.asarray(product_ids, dtype=np.int64), cls._weight(counts, idf), vocabulary, idf)
+
+    @staticmethod
+    def _weight(counts: sparse.csr_matrix, idf: np.ndarray) -> sparse.csr_matrix:
+        """次线性TF乘以IDF并按行L2归一化"""
+        weighted = counts.copy()
+        weighted.data = (1 + np.log(weighted.data)) * idf[weighted.indices]
+        norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sparse.csr_matrix(sparse.diags(1 / norms).dot(weighted), dtype=np.float32)
+
+    def vectorize(self, tokens: List[str]) -> sparse.csr_matrix:
+        """按现有词表和IDF将新文档向量化（未登录词忽略）"""
+        columns = [self.vocabulary[token] for token in tokens if token in self.vocabulary]
+        counts = sparse.csr_matrix(
+            (np.ones(len(columns), dtype=np.float32), (np.zeros(len(columns), dtype=np.int32), columns)),
+            shape=(1, self.matrix.shape[1])
+        )
+        counts.sum_duplicates()
+        return self._weight(counts, self.idf)
+
+    def top_k(self, k: int = TOP_K, block_size: int = 256) -> Tuple[np.ndarray, np.ndarray]:
+        """分块计算所有商品的前K个相似商品
+
+        每块做一次矩阵乘法得到稠密相似度块，再用 argpartition 向量化选出前K个。
+        转置矩阵稠密化后不超过 DENSE_LIMIT_BYTES 时用稠密右操作数，否则保持稀疏。
+
+        Args:
+            k: 近邻数量
+            block_size: 每块行数，控制峰值内存（block_size x 商品数 x 4字节）
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (近邻行号 int32[n, k], 相似度 float16[n, k])
+        """
+        n = self.matrix.shape[0]
+        k = max(0, min(k, n - 1))
+        neighbors = np.zeros((n, k), dtype=np.int32)
+        scores = np.zeros((n, k), dtype=np.float16)
+        if k == 0:
+            return neighbors, scores
+
+        if self.matrix.shape[1] * n * 4 <= DENSE_LIMIT_BYTES:
+            transposed = np.ascontiguousarray(self.matrix.T.toarray())
+        else:
+            transposed = self.matrix.T.tocsc()
+        for start in range(0, n, block_size):
+            end = min(start + block_size, n)
+            block = self.matrix[start:end] @ transposed
+            if sparse.issparse(block):
+                block = block.toarray()
+            block[np.arange(end - start), np.arange(start, end)] = -1  # 排除自身
+            top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(block, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            neighbors[start:end] = np.take_along_axis(top, order, axis=1)
+            scores[start:end] = np.take_along_axis(top_scores, order, axis=1)
+        return neighbors, scores
+
+    def neighbors_of(self, vector: sparse.csr_matrix, k: int = TOP_K) -> Tuple[np.ndarray, np.ndarray]:
+        """计算单个向量与全部商品的前K个近邻"""
+        similarities = (self.matrix @ vector.T).toarray().ravel()
+        k = min(k, similarities.shape[0])
+        if k == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float16)
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return top.astype(np.int32), similarities[top].astype(np.float16)
+
+    def append(self, product_id: int, vector: sparse.csr_matrix):
+        """追加新商品到矩阵（用于增量添加）"""
+        self.matrix = sparse.vstack([self.matrix, vector], format='csr')
+        self.product_ids = np.append(self.product_ids, product_id)
+
+
+def pack_neighbors(product_ids: np.ndarray, scores: np.ndarray) -> bytes:
+    """紧凑编码近邻列表：K个int32商品ID + K个float16相似度"""
+    return product_ids.astype('<i4').tobytes() + scores.astype('<f2').tobytes()
+
+
+def unpack_neighbors(data: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """解码 pack_neighbors 的结果"""
+    k = len(data) // 6
+    return np.frombuffer(data[:4 * k], dtype='<i4'), np.frombuffer(data[4 * k:], dtype='<f2')
+
+
+_index: Dict[str, Optional[TfidfIndex]] = {'current': None}
+_index_lock = threading.Lock()
+
+
+def load_product_documents() -> Tuple[List[int], List[List[str]]]:
+    """一次查询加载所有在售商品的名称、描述与标签名"""
+    rows = db.session.query(Product.id, Product.name, Product.description, Tag.name).outerjoin(
+        Tag, Product.tag_id == Tag.id
+    ).filter(
+        Product.status == '已通过',
+        Product.is_deleted == False
+    ).all()
+    return [row[0] for row in rows], [document_tokens(row[1], row[2], row[3]) for row in rows]
+
+
+def rebuild_similar_index(k: int = TOP_K) -> int:
+    """全量重建 TF-IDF 矩阵并批量预计算所有商品的相似商品，写入 Redis
+
+    Args:
+        k: 每个商品保存的近邻数量
+
+    Returns:
+        int: 参与计算的商品数量
+    """
+    start = time.perf_counter()
+    product_ids, documents = load_product_documents()
+    index = TfidfIndex.build(product_ids, documents)
+    neighbors, scores = index.top_k(k)
+
+    # 先写入临时键再原子重命名，避免重建期间读到不完整的数据
+    building_key = f'{SIMILAR_KEY}:building'
+    redis_client = get_redis_client()
+    with redis_client.pipeline(transaction=False) as pipe:
+        pipe.delete(building_key)
+        for row, product_id in enumerate(index.product_ids):
+            valid = scores[row] > 0
+            pipe.hset(building_key, int(product_id),
+                      pack_neighbors(index.product_ids[neighbors[row][valid]], scores[row][valid]))
+            if row % 1000 == 999:
+                pipe.execute()
+        if len(product_ids):
+            pipe.rename(building_key, SIMILAR_KEY)
+        else:
+            pipe.delete(SIMILAR_KEY)
+        mark_built(SIMILAR_JOB, len(product_ids), pipe)
+        pipe.execute()
+
+    index.built_at = time.time()  # 不早于写入的 built_at，增量任务不会因此重新构建
+    _index['current'] = index
+    logger.info(f"Rebuilt similar index for {len(product_ids)} products in {time.perf_counter() - start:.2f}s")
+    return len(product_ids)
+
+
+def _current_index() -> Optional[TfidfIndex]:
+    """获取本进程的索引；未加载或早于最近一次全量重建时从数据库重新构建矩阵（不重算全部近邻）
+
+    Returns:
+        Optional[TfidfIndex]: 索引，尚未全量重建过时为 None
+    """
+    stored_at = built_at(SIMILAR_JOB)
+    if stored_at is None:
+        return None
+    with _index_lock:
+        index = _index['current']
+        if index is None or index.built_at < stored_at:
+            index = TfidfIndex.build(*load_product_documents())
+            _index['current'] = index
+    return index
+
+
+def add_product_to_index(product: Product, k: int = TOP_K):
+    """增量添加新上架商品：按现有词表向量化并计算其近邻
+
+    由任务工作进程执行；本进程没有索引或索引早于最近一次全量重建时先按数据库重新构建矩阵。
+    已有商品的近邻列表在下次全量重建时才会包含新商品。
+
+    Args:
+        product: 商品对象
+        k: 近邻数量
+    """
+    if product.status != '已通过' or product.is_deleted:
+        return
+    index = _current_index()
+    if index is None:
+        return
+    tag_name = product.tag.name if product.tag else None
+    vector = index.vectorize(document_tokens(product.name, product.description, tag_name))
+    rows, scores = index.neighbors_of(vector, k)
+    valid = (scores > 0) & (index.product_ids[rows] != product.id)
+    try:
+        get_redis_client().hset(SIMILAR_KEY, product.id, pack_neighbors(index.product_ids[rows[valid]], scores[valid]))
+    except redis.RedisError as e:
+        logger.error(f"Failed to store similar products for {product.id}: {str(e)}")
+        return
+    with _index_lock:
+        if product.id not in index.product_ids:
+            index.append(product.id, vector)
+
+
+@job(INDEX_JOB, max_retries=2, backoff=30)
+def index_similar_product(product_id: int):
+    """计算新上架商品的相似商品"""
+    product = Product.query.get(product_id)
+    if product:
+        add_product_to_index(product)
+
+
+def schedule_product_index(product_id: int):
+    """商品状态变更后将增量索引任务加入队列（Web 进程不持有索引，由任务工作进程计算）
+
+    Args:
+        product_id: 商品ID
+    """
+    try:
+        enqueue(INDEX_JOB, product_id)
+    except redis.RedisError as e:
+        logger.error(f"Failed to enqueue similar index for product {product_id}: {str(e)}")
+
+
+def schedule_rebuild_if_stale():
+    """索引过期时在后台重建"""
+    interval = current_app.config.get('SIMILAR_REBUILD_INTERVAL', REBUILD_INTERVAL)
+    schedule_if_stale(SIMILAR_JOB, rebuild_similar_index, interval)
+
+
+def get_similar_product_ids(product_id: int, limit: int = 10) -> List[int]:
+    """读取预计算的相似商品ID（一次 Redis 读取）
+
+    Args:
+        product_id: 商品ID
+        limit: 返回数量
+
+    Returns:
+        List[int]: 按相似度降序的商品ID
+    """
+    try:
+        schedule_rebuild_if_stale()
+        data = get_redis_client().hget(SIMILAR_KEY, product_id)
+    except redis.RedisError as e:
+        logger.error(f"Failed to read similar products for {product_id}: {str(e)}")
+        return []
+    if not data:
+        return []
+    product_ids, _ = unpack_neighbors(data)
+    return [int(pid) for pid in product_ids[:limit]]
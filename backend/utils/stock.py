@@ -0,0 +1,288 @@
+from flask import current_app
+from ..models import db, Product, Order, OrderItem
+from .redis_client import get_redis_client
+from .cart_store import invalidate_cart_summaries
+from .order_items import parse_products_info
+from sqlalchemy import case, update
+from typing import Dict, Iterable, List, Optional
+import redis
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STOCK_KEY = 'stock:{}'  # 可售库存，与 products.quantity 一致（下单时两者同时扣减）
+HOLD_KEY = 'stock:hold:{}'  # 订单号 -> {商品ID: 数量}
+DRIFT_KEY = 'stock:drift'  # 上一轮对账发现的差异，连续两轮一致才修正
+PAYMENT_TIMEOUT = 1800
+HOLD_GRACE = 86400  # 预占记录在支付截止后保留的时间，超时取消积压时仍能归还
+
+# 原子地检查并扣减一个订单的全部商品库存，任一商品不足时不做任何修改
+# KEYS: 预占记录、各商品库存键；ARGV: 预占记录过期时间、商品数、商品ID...、数量...、数据库库存...
+RESERVE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return -1 end
+local n = tonumber(ARGV[2])
+for i = 1, n do
+    redis.call('SET', KEYS[i + 1], ARGV[2 + n + n + i], 'NX')
+    if tonumber(redis.call('GET', KEYS[i + 1])) < tonumber(ARGV[2 + n + i]) then return i end
+end
+for i = 1, n do
+    redis.call('DECRBY', KEYS[i + 1], ARGV[2 + n + i])
+    redis.call('HSET', KEYS[1], ARGV[2 + i], ARGV[2 + n + i])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 0
+"""
+
+# 归还预占的库存并删除预占记录，返回涉及的商品ID；记录不存在（已确认或已归还）时不做任何修改
+# 库存键不存在时跳过，下次预占会按数据库库存（已归还）重新初始化
+RELEASE_SCRIPT = """
+local hold = redis.call('HGETALL', KEYS[1])
+local released = {}
+for i = 1, #hold, 2 do
+    local key = ARGV[1] .. hold[i]
+    if redis.call('EXISTS', key) == 1 then redis.call('INCRBY', key, hold[i + 1]) end
+    table.insert(released, hold[i])
+end
+redis.call('DEL', KEYS[1])
+return released
+"""
+
+# 库存值仍为上次读取的值时才覆盖，避免覆盖对账期间发生的预占
+COMPARE_AND_SET_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
+class InsufficientStock(Exception):
+    """预占失败：商品库存不足"""
+
+    def __init__(self, product_id: int):
+        super().__init__(f'商品 {product_id} 库存不足')
+        self.product_id = product_id
+
+
+def _script(source: str):
+    scripts = current_app.extensions.setdefault('stock_scripts', {})
+    if source not in scripts:
+        scripts[source] = get_redis_client().register_script(source)
+    return scripts[source]
+
+
+def reserve_stock(order_no: str, quantities: Dict[int, int], db_stock: Dict[int, int],
+                  timeout: Optional[int] = None) -> bool:
+    """在 Redis 中原子地预占订单的全部商品库存
+
+    库存键不存在时以 db_stock 初始化。库存争用在 Redis 中完成，数据库只处理预占成功的订单。
+    超时取消由订单支付超时队列负责（见 order_timeout），预占记录在支付截止后再保留 HOLD_GRACE 秒。
+
+    Args:
+        order_no: 订单号
+        quantities: 商品ID到购买数量的映射
+        db_stock: 商品ID到数据库库存的映射
+        timeout: 支付超时时间（秒），默认 ORDER_PAYMENT_TIMEOUT
+
+    Returns:
+        bool: 是否已预占；Redis 不可用时返回 False，由数据库条件更新兜底
+
+    Raises:
+        InsufficientStock: 任一商品库存不足
+        ValueError: 订单号已有预占记录
+    """
+    product_ids = list(quantities)
+    timeout = timeout or current_app.config.get('ORDER_PAYMENT_TIMEOUT', PAYMENT_TIMEOUT)
+    try:
+        result = _script(RESERVE_SCRIPT)(
+            keys=[HOLD_KEY.format(order_no)] + [STOCK_KEY.format(pid) for pid in product_ids],
+            args=[timeout + HOLD_GRACE, len(product_ids)] + product_ids
+                 + [quantities[pid] for pid in product_ids] + [db_stock[pid] for pid in product_ids]
+        )
+    except redis.RedisError as e:
+        logger.error(f"Failed to reserve stock for order {order_no}: {str(e)}")
+        return False
+    if result == -1:
+        raise ValueError(f'订单 {order_no} 已存在库存预占')
+    if result > 0:
+        raise InsufficientStock(product_ids[result - 1])
+    invalidate_cart_summaries(product_ids)
+    return True
+
+
+def release_stock(order_no: str) -> bool:
+    """归还订单预占的 Redis 库存（取消、超时或下单失败时调用，可重复调用）
+
+    Args:
+        order_no: 订单号
+
+    Returns:
+        bool: 是否归还了库存
+    """
+    try:
+        released = _script(RELEASE_SCRIPT)(keys=[HOLD_KEY.format(order_no)], args=[STOCK_KEY.format('')])
+    except redis.RedisError as e:
+        logger.error(f"Failed to release stock for order {order_no}: {str(e)}")
+        return False
+    invalidate_cart_summaries(int(pid) for pid in released)
+    return bool(released)
+
+
+def confirm_stock(order_no: str):
+    """订单支付后确认预占：删除预占记录，库存不再归还
+
+    Args:
+        order_no: 订单号
+    """
+    try:
+        get_redis_client().delete(HOLD_KEY.format(order_no))
+    except redis.RedisError as e:
+        logger.error(f"Failed to confirm stock hold for order {order_no}: {str(e)}")
+
+
+def forget_stock(product_ids: Iterable[int]):
+    """商品库存在订单流程之外被修改（如卖家编辑）后删除 Redis 库存，下次预占时按数据库重新初始化
+
+    Args:
+        product_ids: 商品ID
+    """
+    keys = [STOCK_KEY.format(pid) for pid in product_ids]
+    if not keys:
+        return
+    try:
+        get_redis_client().delete(*keys)
+    except redis.RedisError as e:
+        logger.error(f"Failed to reset cached stock {keys}: {str(e)}")
+
+
+def deduct_product_stock(quantities: Dict[int, int]):
+    """条件扣减多个商品的数据库库存（不提交，与订单写入在同一事务中）
+
+    一条 UPDATE ... WHERE quantity >= 扣减量，库存检查与扣减由数据库原子完成，并发下单不会丢失更新或超卖。
+    影响行数少于商品数说明有商品库存不足，此时由调用方回滚。提交后调用方需 bump_generation('products')，
+    使商品列表的缓存与ETag随库存更新。
+
+    Args:
+        quantities: 商品ID到扣减数量的映射
+
+    Raises:
+        InsufficientStock: 任一商品库存不足
+    """
+    if not quantities:
+        return
+    amount = case(quantities, value=Product.id, else_=0)
+    result = db.session.execute(
+        update(Product).where(Product.id.in_(list(quantities)), Product.quantity >= amount).values(
+            quantity=Product.quantity - amount
+        ).execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(quantities):
+        stock = dict(db.session.query(Product.id, Product.quantity).filter(Product.id.in_(list(quantities))).all())
+        raise InsufficientStock(next(pid for pid, n in quantities.items() if stock.get(pid, 0) < n))
+
+
+def restore_product_stock(quantities: Dict[int, int]):
+    """一条 UPDATE 归还多个商品的数据库库存（不提交，与订单状态变更在同一事务中）
+
+    提交后调用方需 bump_generation('products')，使商品列表的缓存与ETag随库存更新。
+
+    Args:
+        quantities: 商品ID到归还数量的映射
+    """
+    if not quantities:
+        return
+    db.session.execute(
+        update(Product).where(Product.id.in_(list(quantities))).values(
+            quantity=Product.quantity + case(quantities, value=Product.id, else_=0)
+        ).execution_options(synchronize_session=False)
+    )
+
+
+def order_quantities(order_ids: Iterable[int]) -> Dict[int, Dict[int, int]]:
+    """一次查询多个订单的商品数量；尚未回填 order_items 的旧订单退回解析JSON商品信息
+
+    Args:
+        order_ids: 订单ID
+
+    Returns:
+        Dict[int, Dict[int, int]]: 订单ID到 {商品ID: 数量} 的映射
+    """
+    order_ids = list(order_ids)
+    result: Dict[int, Dict[int, int]] = {}
+    rows = db.session.query(OrderItem.order_id, OrderItem.product_id, OrderItem.quantity).filter(
+        OrderItem.order_id.in_(order_ids)
+    ).all()
+    for order_id, product_id, quantity in rows:
+        result.setdefault(order_id, {})[product_id] = quantity
+
+    legacy = [order_id for order_id in order_ids if order_id not in result]
+    if legacy:
+        for order_id, products_info in db.session.query(Order.id, Order.products_info).filter(
+            Order.id.in_(legacy)
+        ).all():
+            quantities = result.setdefault(order_id, {})
+            for item in parse_products_info(products_info):
+                product_id = int(item['product_id'])
+                quantities[product_id] = quantities.get(product_id, 0) + int(item['quantity'])
+    return result
+
+
+def reconcile_stock(batch_size: int = 1000) -> int:
+    """对账 Redis 库存与 products.quantity
+
+    正常流程中两者同时扣减与归还，差异只来自故障或流程外的修改。进行中的下单会造成短暂差异，
+    因此只有连续两轮观察到相同差异、且 Redis 值在此期间未变时才以数据库为准修正。
+
+    Args:
+        batch_size: 每批处理的商品数
+
+    Returns:
+        int: 修正的商品数
+    """
+    redis_client = get_redis_client()
+    previous = {int(k): v.decode() for k, v in redis_client.hgetall(DRIFT_KEY).items()}
+    drift: Dict[int, str] = {}
+    fixed = 0
+
+    batch: List[int] = []
+    keys = redis_client.scan_iter(match=STOCK_KEY.format('[0-9]*'), count=batch_size)
+    for key in keys:
+        batch.append(int(key.decode().split(':')[1]))
+        if len(batch) >= batch_size:
+            fixed += _reconcile_batch(batch, previous, drift)
+            batch = []
+    if batch:
+        fixed += _reconcile_batch(batch, previous, drift)
+
+    with redis_client.pipeline() as pipe:
+        pipe.delete(DRIFT_KEY)
+        if drift:
+            pipe.hset(DRIFT_KEY, mapping=drift)
+        pipe.execute()
+    logger.info(f"Stock reconciliation: {len(drift)} drifting, {fixed} fixed")
+    return fixed
+
+
+def _reconcile_batch(product_ids: List[int], previous: Dict[int, str], drift: Dict[int, str]) -> int:
+    cached = get_redis_client().mget([STOCK_KEY.format(pid) for pid in product_ids])
+    quantities = dict(db.session.query(Product.id, Product.quantity).filter(Product.id.in_(product_ids)).all())
+    fixed = 0
+    for product_id, value in zip(product_ids, cached):
+        if value is None:
+            continue
+        if product_id not in quantities:
+            forget_stock([product_id])
+            continue
+        observed = f'{value.decode()}:{quantities[product_id]}'
+        if int(value) == quantities[product_id]:
+            continue
+        if previous.get(product_id) == observed:
+            fixed += _script(COMPARE_AND_SET_SCRIPT)(keys=[STOCK_KEY.format(product_id)],
+                                                    args=[value, quantities[product_id]])
+            logger.warning(f"Reset stock of product {product_id} from {value.decode()} to {quantities[product_id]}")
+        else:
+            drift[product_id] = observed
+    return fixed
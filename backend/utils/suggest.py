@@ -0,0 +1,398 @@
+from flask import current_app
+from ..models import db, Product, Tag
+from .redis_client import get_redis_client
+from sqlalchemy import func
+from typing import Dict, List, Tuple
+import heapq
+import json
+import re
+import threading
+import time
+import unicodedata
+import uuid
+import redis
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SUGGEST_CHANNEL = 'suggest:events'
+TOP_K = 10
+# 拉丁字母按空白和标点切词；中日韩文字不切词，直接按字符前缀匹配，无需拼音转换
+TOKEN_SPLIT = re.compile(r'[\s\-_/,.，。、·|()（）\[\]【】]+')
+
+
+def normalize(text: str) -> str:
+    """统一全角/半角与大小写，便于前缀匹配
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        str: 规范化后的文本
+    """
+    return unicodedata.normalize('NFKC', text or '').casefold().strip()
+
+
+def index_terms(name: str) -> List[str]:
+    """生成名称的索引词：完整名称及其中每个词开始的后缀
+
+    Args:
+        name: 商品或标签名称
+
+    Returns:
+        List[str]: 去重后的索引词
+    """
+    text = normalize(name)
+    if not text:
+        return []
+    terms = [text]
+    for match in TOKEN_SPLIT.finditer(text):
+        suffix = text[match.end():]
+        if suffix and suffix not in terms:
+            terms.append(suffix)
+    return terms
+
+
+class _Node:
+    __slots__ = ('children', 'entries', 'top')
+
+    def __init__(self):
+        self.children: Dict[str, Tuple[str, '_Node']] = {}
+        self.entries: Dict[tuple, float] = {}
+        self.top: List[tuple] = []
+
+
+class SuggestTrie:
+    """压缩前缀树（基数树），每个节点缓存子树内权重最高的 TOP_K 条目
+
+    查询只需沿前缀下行并返回节点缓存的结果，与词条总数无关；写操作在锁内完成并
+    自底向上更新路径上的缓存，读操作无需加锁。
+    """
+
+    def __init__(self, top_k: int = TOP_K):
+        self.top_k = top_k
+        self.root = _Node()
+        self._items: Dict[tuple, Tuple[List[str], float, str]] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def upsert(self, key: tuple, name: str, weight: float):
+        """新增或更新词条
+
+        Args:
+            key: 条目标识，如 ('product', 1)
+            name: 显示名称
+            weight: 热度权重
+        """
+        with self._lock:
+            self._remove(key)
+            self._add(key, name, weight, refresh=True)
+
+    def bulk_load(self, items):
+        """批量载入词条，全部插入后再一次性自底向上计算各节点的 TOP_K
+
+        Args:
+            items: (key, name, weight) 可迭代对象
+        """
+        with self._lock:
+            for key, name, weight in items:
+                self._remove(key)
+                self._add(key, name, weight, refresh=False)
+            self._rebuild(self.root)
+
+    def _add(self, key: tuple, name: str, weight: float, refresh: bool):
+        terms = index_terms(name)
+        if not terms:
+            return
+        self._items[key] = (terms, weight, name)
+        for term in terms:
+            self._insert(term, key, weight, refresh)
+
+    def remove(self, key: tuple):
+        """删除词条
+
+        Args:
+            key: 条目标识
+        """
+        with self._lock:
+            self._remove(key)
+
+    def search(self, prefix: str, limit: int = TOP_K) -> List[dict]:
+        """按前缀查询权重最高的条目
+
+        Args:
+            prefix: 查询前缀
+            limit: 返回数量
+
+        Returns:
+            List[dict]: 建议列表
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        node = self.root
+        while prefix:
+            edge = node.children.get(prefix[0])
+            if edge is None:
+                return []
+            label, child = edge
+            if prefix.startswith(label):
+                prefix = prefix[len(label):]
+            elif label.startswith(prefix):
+                prefix = ''
+            else:
+                return []
+            node = child
+        results = []
+        for _, key in node.top[:limit]:
+            item = self._items.get(key)
+            if item:
+                results.append({'type': key[0], 'id': key[1], 'name': item[2]})
+        return results
+
+    def _insert(self, term: str, key: tuple, weight: float, refresh: bool = True):
+        path = [self.root]
+        node = self.root
+        rest = term
+        while rest:
+            edge = node.children.get(rest[0])
+            if edge is None:
+                child = _Node()
+                node.children[rest[0]] = (rest, child)
+                node = child
+                path.append(node)
+                break
+            label, child = edge
+            common = 0
+            while common < min(len(label), len(rest)) and label[common] == rest[common]:
+                common += 1
+            if common < len(label):
+                # 拆分边：label = 公共前缀 + 剩余部分
+                middle = _Node()
+                middle.children[label[common]] = (label[common:], child)
+                middle.top = list(child.top)
+                node.children[rest[0]] = (label[:common], middle)
+                child = middle
+            node = child
+            path.append(node)
+            rest = rest[common:]
+        node.entries[key] = weight
+        if refresh:
+            # 新增条目只可能挤入路径上各节点的 TOP_K，无需重算整棵子树
+            for path_node in path:
+                if any(existing == key for _, existing in path_node.top):
+                    continue
+                if len(path_node.top) < self.top_k or weight > path_node.top[-1][0]:
+                    top = path_node.top + [(weight, key)]
+                    top.sort(key=lambda c: c[0], reverse=True)
+                    path_node.top = top[:self.top_k]
+
+    def _remove(self, key: tuple):
+        item = self._items.pop(key, None)
+        if not item:
+            return
+        for term in item[0]:
+            path = [self.root]
+            node = self.root
+            rest = term
+            while rest and node is not None:
+                edge = node.children.get(rest[0])
+                if edge is None or not rest.startswith(edge[0]):
+                    node = None
+                    break
+                rest = rest[len(edge[0]):]
+                node = edge[1]
+                path.append(node)
+            if node is None:
+                continue
+            node.entries.pop(key, None)
+            # 只有 TOP_K 中包含该条目的节点需要重算
+            self._refresh([path_node for path_node in path if any(k == key for _, k in path_node.top)])
+
+    def _refresh(self, path: List[_Node]):
+        for node in reversed(path):
+            self._compute_top(node)
+
+    def _rebuild(self, root: _Node):
+        stack, order = [root], []
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(child for _, child in node.children.values())
+        for node in reversed(order):
+            self._compute_top(node)
+
+    def _compute_top(self, node: _Node):
+        candidates = [(weight, key) for key, weight in node.entries.items()]
+        for _, child in node.children.values():
+            candidates.extend(child.top)
+        top, seen = [], set()
+        for weight, key in heapq.nlargest(self.top_k * 2, candidates, key=lambda c: c[0]):
+            if key not in seen:
+                seen.add(key)
+                top.append((weight, key))
+                if len(top) >= self.top_k:
+                    break
+        node.top = top
+
+
+_trie = SuggestTrie()
+_state = {'built': False, 'listener': None}
+_build_lock = threading.Lock()
+WORKER_ID = uuid.uuid4().hex
+
+
+def build_suggest_index() -> SuggestTrie:
+    """从数据库全量构建建议索引（商品按浏览量、标签按在售商品数加权）
+
+    Returns:
+        SuggestTrie: 新构建的前缀树
+    """
+    trie = SuggestTrie()
+    products = db.session.query(Product.id, Product.name, Product.views).filter(
+        Product.status == '已通过',
+        Product.is_deleted == False
+    ).all()
+    tag_counts = dict(db.session.query(Product.tag_id, func.count(Product.id)).filter(
+        Product.status == '已通过',
+        Product.is_deleted == False
+    ).group_by(Product.tag_id).all())
+    tags = db.session.query(Tag.id, Tag.name).filter(Tag.is_deleted == False).all()
+
+    trie.bulk_load([(('product', product_id), name, views or 0) for product_id, name, views in products] +
+                   [(('tag', tag_id), name, tag_counts.get(tag_id, 0)) for tag_id, name in tags])
+    logger.info(f"Built suggest index with {len(trie)} entries")
+    return trie
+
+
+def ensure_suggest_index():
+    """首次使用时（或同步中断后）构建索引并启动跨进程同步监听"""
+    global _trie
+    if _state['built']:
+        return
+    with _build_lock:
+        if _state['built']:
+            return
+        _trie = build_suggest_index()
+        _state['built'] = True
+        _start_listener(current_app._get_current_object())
+
+
+def get_suggestions(prefix: str, limit: int = TOP_K) -> List[dict]:
+    """查询自动补全建议（索引构建后不访问数据库）
+
+    Args:
+        prefix: 查询前缀
+        limit: 返回数量
+
+    Returns:
+        List[dict]: 建议列表
+    """
+    ensure_suggest_index()
+    return _trie.search(prefix, limit)
+
+
+def _apply_event(event: dict):
+    key = (event['type'], event['id'])
+    if event['action'] == 'upsert':
+        _trie.upsert(key, event['name'], event.get('weight', 0))
+    else:
+        _trie.remove(key)
+
+
+def _publish(events: List[dict]):
+    """本进程立即生效，并通过 Redis 发布通知其他进程"""
+    for event in events:
+        _apply_event(event)
+    try:
+        client = get_redis_client()
+        for event in events:
+            client.publish(SUGGEST_CHANNEL, json.dumps(dict(event, origin=WORKER_ID)))
+    except redis.RedisError as e:
+        logger.error(f"Failed to publish suggest events: {str(e)}")
+
+
+def sync_products(products):
+    """商品写入后同步建议索引：已通过审核的商品写入，其余移除
+
+    Args:
+        products: 商品对象或包含 id/name/views/status/is_deleted 的行
+    """
+    events = []
+    for product in products:
+        if product.status == '已通过' and not product.is_deleted:
+            events.append({'action': 'upsert', 'type': 'product', 'id': product.id,
+                           'name': product.name, 'weight': product.views or 0})
+        else:
+            events.append({'action': 'remove', 'type': 'product', 'id': product.id})
+    if events:
+        _publish(events)
+
+
+def sync_product_ids(product_ids):
+    """批量更新商品后按ID同步建议索引（一次查询）
+
+    Args:
+        product_ids: 商品ID列表
+    """
+    if not product_ids:
+        return
+    rows = db.session.query(Product.id, Product.name, Product.views, Product.status, Product.is_deleted).filter(
+        Product.id.in_(product_ids)
+    ).all()
+    sync_products(rows)
+
+
+def sync_tag(tag):
+    """标签写入后同步建议索引
+
+    Args:
+        tag: 标签对象
+    """
+    if tag.is_deleted:
+        _publish([{'action': 'remove', 'type': 'tag', 'id': tag.id}])
+        return
+    weight = 0
+    existing = _trie._items.get(('tag', tag.id))
+    if existing:
+        weight = existing[1]
+    _publish([{'action': 'upsert', 'type': 'tag', 'id': tag.id, 'name': tag.name, 'weight': weight}])
+
+
+def _start_listener(app):
+    """启动后台线程订阅其他进程的索引变更"""
+    if _state['listener'] is not None:
+        return
+
+    with app.app_context():
+        try:
+            client = get_redis_client()
+        except Exception as e:
+            logger.error(f"Suggest listener disabled: {str(e)}")
+            return
+
+    def listen():
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(SUGGEST_CHANNEL)
+                for message in pubsub.listen():
+                    try:
+                        event = json.loads(message['data'])
+                        if event.get('origin') != WORKER_ID:
+                            _apply_event(event)
+                    except (ValueError, KeyError, TypeError) as e:
+                        logger.warning(f"Invalid suggest event: {str(e)}")
+            except redis.RedisError as e:
+                # 断线期间可能错过变更，下次查询时全量重建
+                _state['built'] = False
+                logger.warning(f"Suggest listener disconnected: {str(e)}, retrying")
+                time.sleep(5)
+
+    thread = threading.Thread(target=listen, name='suggest-listener', daemon=True)
+    thread.start()
+    _state['listener'] = thread
@@ -0,0 +1,115 @@
+from .redis_client import get_redis_client
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+import time
+import redis
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TREND_KEY = 'trend:{}:{}:{}'  # 事件、粒度、桶起始时间戳；字段为分类ID
+EVENTS = ('view', 'cart', 'order')
+EVENT_WEIGHTS = np.array([1.0, 3.0, 5.0])  # 与 EVENTS 对应，加购和下单比浏览更能说明热度
+GRANULARITIES = {
+    'm': (60, 3 * 3600),  # 桶长度（秒）、过期时间（秒）
+    'h': (3600, 3 * 86400),
+}
+WINDOWS = {
+    '15m': ('m', 15),
+    '1h': ('m', 60),
+    '24h': ('h', 24),
+}
+SMOOTHING = 5.0  # 速度分母的平滑项，避免上一窗口接近0时小量波动被放大
+MIN_SCORE = 3.0  # 当前窗口加权计数低于此值的分类不参与排行
+
+
+def record_tag_events(event: str, tag_ids: Iterable[Optional[int]]):
+    """累加分类事件计数（同时写入分钟桶与小时桶），只写 Redis
+
+    Args:
+        event: 事件类型，view、cart 或 order
+        tag_ids: 发生事件的商品分类ID，可重复，None 会被忽略
+    """
+    counts: Dict[int, int] = {}
+    for tag_id in tag_ids:
+        if tag_id is not None:
+            counts[tag_id] = counts.get(tag_id, 0) + 1
+    if not counts:
+        return
+    now = int(time.time())
+    try:
+        with get_redis_client().pipeline(transaction=False) as pipe:
+            for granularity, (size, ttl) in GRANULARITIES.items():
+                key = TREND_KEY.format(event, granularity, now - now % size)
+                for tag_id, count in counts.items():
+                    pipe.hincrby(key, tag_id, count)
+                pipe.expire(key, ttl)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to record {event} events for tags {list(counts)}: {str(e)}")
+
+
+def compute_trending(window: str = '1h', limit: int = 10) -> List[dict]:
+    """计算分类热度上升速度：当前窗口与上一窗口的加权事件数之比
+
+    一次 pipeline 读取两个窗口内的全部桶（每个桶一个 HGETALL），按分类汇总后向量化计算，
+    耗时只与分类数和桶数有关，不扫描订单或浏览记录。
+
+    Args:
+        window: 窗口，15m、1h 或 24h
+        limit: 返回数量
+
+    Returns:
+        List[dict]: [{'tag_id', 'score', 'previous_score', 'velocity', 'counts': {事件: 当前窗口计数}}]，按速度降序
+
+    Raises:
+        ValueError: 窗口不存在
+    """
+    if window not in WINDOWS:
+        raise ValueError(f'无效的窗口: {window}')
+    granularity, buckets = WINDOWS[window]
+    size, _ = GRANULARITIES[granularity]
+    now = int(time.time())
+    current = now - now % size
+    starts = [current - i * size for i in range(2 * buckets)]  # 前一半为当前窗口，后一半为上一窗口
+
+    with get_redis_client().pipeline(transaction=False) as pipe:
+        for event in EVENTS:
+            for start in starts:
+                pipe.hgetall(TREND_KEY.format(event, granularity, start))
+        hashes = pipe.execute()
+
+    tag_parts, event_parts, period_parts, count_parts = [], [], [], []
+    for index, data in enumerate(hashes):
+        if not data:
+            continue
+        event_index, bucket = divmod(index, len(starts))
+        tag_parts.append(np.fromiter((int(k) for k in data.keys()), dtype=np.int64, count=len(data)))
+        count_parts.append(np.fromiter((int(v) for v in data.values()), dtype=np.float64, count=len(data)))
+        event_parts.append(np.full(len(data), event_index))
+        period_parts.append(np.full(len(data), 0 if bucket < buckets else 1))
+    if not tag_parts:
+        return []
+
+    tag_ids, tag_index = np.unique(np.concatenate(tag_parts), return_inverse=True)
+    totals = np.zeros((len(EVENTS), 2, len(tag_ids)))
+    np.add.at(totals, (np.concatenate(event_parts), np.concatenate(period_parts), tag_index),
+              np.concatenate(count_parts))
+    scores = np.tensordot(EVENT_WEIGHTS, totals, axes=1)  # [2, 分类数]
+    velocity = (scores[0] - scores[1]) / (scores[1] + SMOOTHING)
+    velocity[scores[0] < MIN_SCORE] = -np.inf
+
+    candidates = np.flatnonzero(np.isfinite(velocity))
+    if len(candidates) > limit:
+        candidates = candidates[np.argpartition(-velocity[candidates], limit - 1)[:limit]]
+    candidates = candidates[np.lexsort((-scores[0][candidates], -velocity[candidates]))]
+    logger.info(f"Computed trending tags for {window} over {len(tag_ids)} tags")
+    return [{
+        'tag_id': int(tag_ids[i]),
+        'score': float(scores[0][i]),
+        'previous_score': float(scores[1][i]),
+        'velocity': round(float(velocity[i]), 4),
+        'counts': {event: int(totals[e, 0, i]) for e, event in enumerate(EVENTS)}
+    } for i in candidates]
@@ -0,0 +1,171 @@
+from functools import wraps
+from flask import current_app, request
+from datetime import datetime, timedelta, timezone
+from .decorators import get_optional_user_id
+from .redis_client import get_redis_client
+from .offline_jobs import mark_built
+from typing import Callable, Dict, Iterable, List
+import hashlib
+import time
+import redis
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+UNIQUE_VIEWERS_KEY = 'uv:product:{}:{}'  # 商品ID、日期；每个 HyperLogLog 最多约12KB，与访问量无关
+VIEWED_PRODUCTS_KEY = 'uv:viewed:{}'  # 当天有浏览的商品ID集合，供热门排行只遍历有流量的商品
+HOT_RANKING_KEY = 'hot:unique_viewers'
+HOT_RANKING_JOB = 'hot_ranking'
+RETENTION_DAYS = 31
+HOT_WINDOW_DAYS = 7
+
+
+def _day_keys(product_id: int, days: int, today: datetime = None) -> List[str]:
+    """最近 days 天（含今天）的日桶键，按UTC日期划分"""
+    today = today or datetime.now(timezone.utc)
+    return [UNIQUE_VIEWERS_KEY.format(product_id, (today - timedelta(days=i)).strftime('%Y%m%d'))
+            for i in range(days)]
+
+
+def viewer_identity() -> str:
+    """当前请求的浏览者标识：登录用户为用户ID，匿名访问为 IP 与 User-Agent 的哈希（不保存原始IP）
+
+    IP 只取 request.remote_addr（部署在代理后时由 PROXY_FIX_X_FOR 配置的 ProxyFix 设置），
+    不解析客户端可任意伪造的 X-Forwarded-For。
+    """
+    user_id = get_optional_user_id()
+    if user_id:
+        return f'u:{user_id}'
+    ip = request.remote_addr or ''
+    raw = f"{ip}|{request.headers.get('User-Agent', '')}|{current_app.config['SECRET_KEY']}"
+    return 'a:' + hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def record_unique_view(product_id: int, viewer: str):
+    """将浏览者加入商品当天的 HyperLogLog，并记录当天有浏览的商品
+
+    Args:
+        product_id: 商品ID
+        viewer: 浏览者标识
+    """
+    day = datetime.now(timezone.utc).strftime('%Y%m%d')
+    key = UNIQUE_VIEWERS_KEY.format(product_id, day)
+    viewed_key = VIEWED_PRODUCTS_KEY.format(day)
+    ttl = RETENTION_DAYS * 86400
+    try:
+        with get_redis_client().pipeline(transaction=False) as pipe:
+            pipe.pfadd(key, viewer)
+            pipe.expire(key, ttl)
+            pipe.sadd(viewed_key, product_id)
+            pipe.expire(viewed_key, ttl)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to record unique view of product {product_id}: {str(e)}")
+
+
+def get_unique_viewers(product_id: int) -> Dict[str, int]:
+    """读取商品最近7天与30天的独立访客数（PFCOUNT 多个日桶时在服务端合并）
+
+    Args:
+        product_id: 商品ID
+
+    Returns:
+        Dict[str, int]: {'7d': 数量, '30d': 数量}，Redis 不可用时为0
+    """
+    try:
+        with get_redis_client().pipeline(transaction=False) as pipe:
+            pipe.pfcount(*_day_keys(product_id, 7))
+            pipe.pfcount(*_day_keys(product_id, 30))
+            week, month = pipe.execute()
+        return {'7d': week, '30d': month}
+    except redis.RedisError as e:
+        logger.warning(f"Failed to count unique viewers of product {product_id}: {str(e)}")
+        return {'7d': 0, '30d': 0}
+
+
+def count_unique_viewers(product_ids: Iterable[int], days: int = HOT_WINDOW_DAYS) -> Dict[int, int]:
+    """批量统计商品最近 days 天的独立访客数（一次 pipeline）
+
+    Args:
+        product_ids: 商品ID
+        days: 统计天数（不超过保留天数）
+
+    Returns:
+        Dict[int, int]: 商品ID到独立访客数的映射
+    """
+    product_ids = [int(pid) for pid in product_ids]
+    today = datetime.now(timezone.utc)
+    with get_redis_client().pipeline(transaction=False) as pipe:
+        for pid in product_ids:
+            pipe.pfcount(*_day_keys(pid, days, today))
+        counts = pipe.execute()
+    return dict(zip(product_ids, counts))
+
+
+def rebuild_hot_ranking(days: int = HOT_WINDOW_DAYS, batch_size: int = 1000) -> int:
+    """按最近 days 天的独立访客数重建热门排行（有序集合），只遍历窗口内有浏览的商品
+
+    Args:
+        days: 统计天数
+        batch_size: 每个 pipeline 统计的商品数
+
+    Returns:
+        int: 进入排行的商品数
+    """
+    start = time.time()
+    redis_client = get_redis_client()
+    today = datetime.now(timezone.utc)
+    viewed_keys = [VIEWED_PRODUCTS_KEY.format((today - timedelta(days=i)).strftime('%Y%m%d')) for i in range(days)]
+    product_ids = [int(pid) for pid in redis_client.sunion(viewed_keys)]
+
+    building_key = f'{HOT_RANKING_KEY}:building'
+    redis_client.delete(building_key)
+    ranked = 0
+    for offset in range(0, len(product_ids), batch_size):
+        counts = count_unique_viewers(product_ids[offset:offset + batch_size], days)
+        scores = {pid: count for pid, count in counts.items() if count}
+        if scores:
+            redis_client.zadd(building_key, scores)
+            ranked += len(scores)
+    with redis_client.pipeline() as pipe:
+        if ranked:
+            pipe.rename(building_key, HOT_RANKING_KEY)
+        else:
+            pipe.delete(HOT_RANKING_KEY)
+        mark_built(HOT_RANKING_JOB, ranked, pipe)
+        pipe.execute()
+    logger.info(f"Rebuilt hot ranking for {ranked} products in {time.time() - start:.2f}s")
+    return ranked
+
+
+def get_hot_ranking(limit: int) -> List[int]:
+    """读取按独立访客数排序的商品ID，排行尚未生成或 Redis 不可用时为空
+
+    Args:
+        limit: 返回数量
+
+    Returns:
+        List[int]: 商品ID列表
+    """
+    try:
+        return [int(pid) for pid in get_redis_client().zrevrange(HOT_RANKING_KEY, 0, limit - 1)]
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read hot ranking: {str(e)}")
+        return []
+
+
+def track_unique_viewer(f: Callable) -> Callable:
+    """商品详情接口的装饰器：请求成功（含304）时记录独立访客
+
+    应放在 conditional 之外，使条件请求命中时同样记录。
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        response = current_app.make_response(f(*args, **kwargs))
+        if response.status_code in (200, 304):
+            record_unique_view(kwargs['product_id'], viewer_identity())
+        return response
+
+    return decorated
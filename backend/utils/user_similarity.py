@@ -0,0 +1,328 @@
+from .redis_client import get_redis_client
+from .offline_jobs import built_at, mark_built
+from scipy import sparse
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import json
+import threading
+import time
+import uuid
+import redis
+import logging
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+USER_MINHASH_JOB = 'user_minhash'
+SIGNATURES_KEY = 'user_minhash:signatures'
+UPDATES_CHANNEL = 'user_minhash:updates'  # 增量更新的签名，各进程订阅后合并到本进程索引
+NUM_PERM = 128
+ROWS_PER_BAND = 2  # 64个band，每band两行：Jaccard约0.125以上的用户大概率成为候选，适合购买记录稀疏的场景
+BANDS = NUM_PERM // ROWS_PER_BAND
+MAX_BUCKET = 500  # 单个桶最多取的候选数，避免热门商品形成的大桶退化为全量扫描
+PRIME = np.uint64(4294967311)  # 大于 2^32 的素数
+EMPTY = np.uint32(0xFFFFFFFF)
+BAND_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+class MinHasher:
+    """MinHash 签名计算：h_i(x) = (a_i * x + b_i) mod P，签名为集合内各哈希的最小值"""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, int(PRIME), num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, int(PRIME), num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+
+    def hash_items(self, item_ids: np.ndarray) -> np.ndarray:
+        """计算商品ID的全部哈希值
+
+        Args:
+            item_ids: 商品ID数组（小于 2^31）
+
+        Returns:
+            np.ndarray: uint32[num_perm, len(item_ids)]
+        """
+        items = np.asarray(item_ids, dtype=np.uint64)
+        return ((self.a[:, None] * items[None, :] + self.b[:, None]) % PRIME).astype(np.uint32)
+
+    def signature(self, item_ids: Iterable[int]) -> np.ndarray:
+        """计算单个集合的签名，空集合返回全 EMPTY"""
+        items = np.fromiter(item_ids, dtype=np.int64)
+        if not len(items):
+            return np.full(self.num_perm, EMPTY, dtype=np.uint32)
+        return self.hash_items(items).min(axis=1)
+
+    def signatures(self, matrix: sparse.csr_matrix, item_ids: np.ndarray, chunk: int = 20000) -> np.ndarray:
+        """批量计算 用户 x 商品 矩阵每行的签名（按行分块，reduceat 向量化求最小值）
+
+        Args:
+            matrix: 0/1购买矩阵，每行至少一个商品
+            item_ids: 矩阵列对应的商品ID
+            chunk: 每块行数，控制峰值内存
+
+        Returns:
+            np.ndarray: uint32[用户数, num_perm]
+        """
+        hashes = self.hash_items(item_ids)
+        result = np.empty((matrix.shape[0], self.num_perm), dtype=np.uint32)
+        for start in range(0, matrix.shape[0], chunk):
+            block = matrix[start:start + chunk]
+            result[start:start + block.shape[0]] = np.minimum.reduceat(
+                hashes[:, block.indices], block.indptr[:-1], axis=1
+            ).T
+        return result
+
+
+def band_keys(signatures: np.ndarray) -> np.ndarray:
+    """将签名按band折叠为64位桶键
+
+    Args:
+        signatures: uint32[n, NUM_PERM]
+
+    Returns:
+        np.ndarray: uint64[n, BANDS]
+    """
+    bands = signatures.reshape(signatures.shape[0], BANDS, ROWS_PER_BAND).astype(np.uint64)
+    keys = np.zeros(bands.shape[:2], dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for row in range(ROWS_PER_BAND):
+            keys = keys * BAND_MULTIPLIER + bands[:, :, row]
+    return keys
+
+
+class LSHIndex:
+    """LSH 分带索引：每个band的桶键按列排序保存，查询时每个band一次二分查找，与用户总数近似无关
+
+    全量构建后的增量更新（本进程及通过 UPDATES_CHANNEL 收到的其他进程更新）保存在 _updates 中，
+    查询时一并比较，下次全量构建时合并。
+    """
+
+    def __init__(self, user_ids: np.ndarray, signatures: np.ndarray):
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.signatures = signatures
+        self.row_of = {int(user_id): row for row, user_id in enumerate(self.user_ids)}
+        keys = band_keys(signatures) if len(signatures) else np.zeros((0, BANDS), dtype=np.uint64)
+        self.order = np.argsort(keys, axis=0, kind='stable')
+        self.sorted_keys = np.take_along_axis(keys, self.order, axis=0)
+        self._updates: Dict[int, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.loaded_at = time.time()
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def update(self, user_id: int, signature: np.ndarray):
+        """记录用户签名的增量更新"""
+        with self._lock:
+            self._updates[int(user_id)] = signature
+
+    def signature_of(self, user_id: int) -> Optional[np.ndarray]:
+        """读取用户当前签名（优先使用增量更新）"""
+        if user_id in self._updates:
+            return self._updates[user_id]
+        row = self.row_of.get(user_id)
+        return self.signatures[row] if row is not None else None
+
+    def most_similar(self, signature: np.ndarray, k: int, exclude: Optional[int] = None) -> List[Tuple[int, float]]:
+        """查询签名最相似的用户（估计 Jaccard 相似度 = 签名中相等分量的比例）
+
+        Args:
+            signature: 查询签名
+            k: 返回数量
+            exclude: 排除的用户ID（通常为查询用户本身）
+
+        Returns:
+            List[Tuple[int, float]]: (用户ID, 估计相似度)，按相似度降序
+        """
+        if (signature == EMPTY).all():
+            return []
+        keys = band_keys(signature[None, :])[0]
+        rows = []
+        for band in range(BANDS):
+            column = self.sorted_keys[:, band]
+            lo = np.searchsorted(column, keys[band], side='left')
+            hi = min(np.searchsorted(column, keys[band], side='right'), lo + MAX_BUCKET)
+            if hi > lo:
+                rows.append(self.order[lo:hi, band])
+
+        candidates: Dict[int, np.ndarray] = {}
+        if rows:
+            unique_rows = np.unique(np.concatenate(rows))
+            for user_id, candidate in zip(self.user_ids[unique_rows].tolist(), self.signatures[unique_rows]):
+                candidates[user_id] = candidate
+        with self._lock:
+            updates = list(self._updates.items())
+        for user_id, candidate in updates:
+            if user_id in candidates or np.any(band_keys(candidate[None, :])[0] == keys):
+                candidates[user_id] = candidate
+        candidates.pop(exclude, None)
+        if not candidates:
+            return []
+
+        user_ids = np.fromiter(candidates.keys(), dtype=np.int64, count=len(candidates))
+        similarities = (np.stack(list(candidates.values())) == signature).mean(axis=1)
+        top = np.argsort(-similarities, kind='stable')[:k]
+        return [(int(user_ids[i]), float(similarities[i])) for i in top if similarities[i] > 0]
+
+
+hasher = MinHasher()
+_index: Dict[str, Optional[LSHIndex]] = {'current': None}
+_load_lock = threading.Lock()
+_state = {'listener': None}
+WORKER_ID = uuid.uuid4().hex
+
+
+def build_user_index(users: np.ndarray, items: np.ndarray, matrix: sparse.csr_matrix) -> int:
+    """由购买矩阵批量计算全部用户签名，写入 Redis 并替换本进程的索引
+
+    Args:
+        users: 矩阵行对应的用户ID
+        items: 矩阵列对应的商品ID
+        matrix: 用户 x 商品 的0/1购买矩阵
+
+    Returns:
+        int: 用户数量
+    """
+    signatures = hasher.signatures(matrix, items) if len(users) else np.zeros((0, NUM_PERM), dtype=np.uint32)
+    building_key = f'{SIGNATURES_KEY}:building'
+    with get_redis_client().pipeline(transaction=False) as pipe:
+        pipe.delete(building_key)
+        for row, user_id in enumerate(users.tolist()):
+            pipe.hset(building_key, user_id, signatures[row].astype('<u4').tobytes())
+            if row % 1000 == 999:
+                pipe.execute()
+        if len(users):
+            pipe.rename(building_key, SIGNATURES_KEY)
+        else:
+            pipe.delete(SIGNATURES_KEY)
+        mark_built(USER_MINHASH_JOB, len(users), pipe)
+        pipe.execute()
+    _index['current'] = LSHIndex(users, signatures)
+    return len(users)
+
+
+def load_user_index() -> Optional[LSHIndex]:
+    """获取本进程的 LSH 索引，其他进程重建签名后从 Redis 重新加载
+
+    Returns:
+        Optional[LSHIndex]: 索引，尚未构建时返回 None
+    """
+    index = _index['current']
+    last_built = built_at(USER_MINHASH_JOB)
+    if index is not None and (last_built is None or last_built <= index.loaded_at):
+        return index
+    with _load_lock:
+        index = _index['current']
+        if index is not None and (last_built is None or last_built <= index.loaded_at):
+            return index
+        # 先订阅再读取签名：读取之后发布的更新会在新索引就绪后合并，不会丢失
+        _start_listener()
+        data = get_redis_client().hgetall(SIGNATURES_KEY)
+        if not data and index is None:
+            return None
+        user_ids = np.fromiter((int(user_id) for user_id in data), dtype=np.int64, count=len(data))
+        signatures = np.frombuffer(b''.join(data.values()), dtype='<u4').reshape(len(data), NUM_PERM)
+        _index['current'] = index = LSHIndex(user_ids, signatures.astype(np.uint32))
+        logger.info(f"Loaded user MinHash index with {len(index)} users")
+        return index
+
+
+def update_user_signature(user_id: int, product_ids: List[int]):
+    """订单完成后增量更新用户签名：新签名 = 旧签名与新商品哈希的逐分量最小值
+
+    写入 Redis 并发布到 UPDATES_CHANNEL，其他进程的索引随即合并该更新。
+
+    Args:
+        user_id: 用户ID
+        product_ids: 新购买的商品ID
+    """
+    if not product_ids:
+        return
+    redis_client = get_redis_client()
+    data = redis_client.hget(SIGNATURES_KEY, user_id)
+    old = np.frombuffer(data, dtype='<u4') if data else np.full(NUM_PERM, EMPTY, dtype=np.uint32)
+    signature = np.minimum(old, hasher.signature(product_ids))
+    redis_client.hset(SIGNATURES_KEY, user_id, signature.astype('<u4').tobytes())
+    index = _index['current']
+    if index is not None:
+        index.update(user_id, signature)
+    try:
+        redis_client.publish(UPDATES_CHANNEL, json.dumps({
+            'user_id': int(user_id), 'signature': signature.astype('<u4').tobytes().hex(), 'origin': WORKER_ID
+        }))
+    except redis.RedisError as e:
+        logger.error(f"Failed to publish signature update for user {user_id}: {str(e)}")
+
+
+def _apply_update(event: dict):
+    """将其他进程发布的签名更新合并到本进程索引（与加载互斥，加载期间收到的更新合并到新索引）"""
+    signature = np.frombuffer(bytes.fromhex(event['signature']), dtype='<u4').astype(np.uint32)
+    if signature.shape != (NUM_PERM,):
+        raise ValueError('签名长度错误')
+    with _load_lock:
+        index = _index['current']
+        if index is not None:
+            index.update(int(event['user_id']), signature)
+
+
+def _start_listener():
+    """订阅其他进程的签名更新（调用方持有 _load_lock），断线后丢弃本进程索引，下次查询时从 Redis 重新加载"""
+    if _state['listener'] is not None:
+        return
+    try:
+        client = get_redis_client()
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(UPDATES_CHANNEL)
+    except redis.RedisError as e:
+        logger.error(f"User signature listener disabled: {str(e)}")
+        return
+
+    def listen():
+        subscription = pubsub
+        while True:
+            try:
+                if subscription is None:
+                    subscription = client.pubsub(ignore_subscribe_messages=True)
+                    subscription.subscribe(UPDATES_CHANNEL)
+                    # 断线期间可能错过更新，丢弃索引后重新加载
+                    with _load_lock:
+                        _index['current'] = None
+                for message in subscription.listen():
+                    try:
+                        event = json.loads(message['data'])
+                        if event.get('origin') != WORKER_ID:
+                            _apply_update(event)
+                    except (ValueError, KeyError, TypeError) as e:
+                        logger.warning(f"Invalid signature update: {str(e)}")
+            except redis.RedisError as e:
+                subscription = None
+                logger.warning(f"User signature listener disconnected: {str(e)}, retrying")
+                time.sleep(5)
+
+    thread = threading.Thread(target=listen, name='user-signature-listener', daemon=True)
+    thread.start()
+    _state['listener'] = thread
+
+
+def similar_users(user_id: int, k: int) -> List[Tuple[int, float]]:
+    """查询与用户购买记录最相似的用户
+
+    Args:
+        user_id: 用户ID
+        k: 返回数量
+
+    Returns:
+        List[Tuple[int, float]]: (用户ID, 估计 Jaccard 相似度)
+    """
+    index = load_user_index()
+    if index is None:
+        return []
+    signature = index.signature_of(user_id)
+    if signature is None:
+        data = get_redis_client().hget(SIGNATURES_KEY, user_id)
+        if not data:
+            return []
+        signature = np.frombuffer(data, dtype='<u4').astype(np.uint32)
+    return index.most_similar(signature, k, exclude=user_id)